@@ -0,0 +1,75 @@
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Benchmark helpers.
+
+    Benchmarks are run from the top source directory, e.g.:
+
+        python3 -m bench.ncx
+
+    Each measurement that cares about memory is run in a fresh interpreter
+    so that peak RSS values are not polluted by previous runs. """
+
+import json
+import subprocess
+import sys
+import time
+
+
+_CHILD = '''
+import json, resource, sys, time, importlib
+mod = importlib.import_module(sys.argv[1])
+func = getattr(mod, sys.argv[2])
+start = time.perf_counter()
+extra = func(*json.loads(sys.argv[3]))
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'time': elapsed,
+    'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    'result': extra,
+}))
+'''
+
+
+def run_isolated(module, func, *args):
+    """ Runs @module.@func(*@args) in a new interpreter and returns a dict
+        with its wall 'time', peak RSS ('maxrss', in bytes) and 'result'.
+        Arguments and return value must be JSON-serializable. """
+    out = subprocess.run([sys.executable, '-c', _CHILD, module, func,
+                          json.dumps(args)],
+                         check=True, stdout=subprocess.PIPE,
+                         universal_newlines=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def timeit(func, *args, repeat=5):
+    """ Returns the best wall time of @repeat calls to func(*args) """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return '%.1f%s' % (size, unit)
+        size /= 1024
+    return '%.1fGiB' % size
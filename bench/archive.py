@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Zipped book access: native zip storage vs. the gvfs-fuse mount.
+
+    Usage: python3 -m bench.archive [ZIP OPF-MEMBER]
+
+    Measures opening the archive, reading all of its members (checksumming
+    them, so that every byte is actually read) and parsing the book, through ZipStorage, the zipfile module and, if GIO and
+    gvfs-fuse are available, the archive mount of gdr.archive. """
+
+import os
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+
+from bench import timeit, format_size
+from bench.synth import write_book, write_mp3, write_zip
+from daisy.book import Book
+from daisy.storage import ZipStorage
+
+
+def read_storage(storage, paths):
+    total = 0
+    for path in paths:
+        data = storage.read(path)
+        zlib.crc32(data)
+        total += len(data)
+        if isinstance(data, memoryview):
+            data.release()
+    return total
+
+
+def read_zipfile(path):
+    total = 0
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            data = zf.read(info)
+            zlib.crc32(data)
+            total += len(data)
+    return total
+
+
+def read_files(paths):
+    total = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+            zlib.crc32(data)
+            total += len(data)
+    return total
+
+
+def report(name, elapsed, size):
+    print('  %-16s %8.1fms  %8.1f MiB/s' %
+          (name, elapsed * 1e3, size / elapsed / (1 << 20)))
+
+
+def mount(path):
+    """ Mounts @path with gdr.archive, returns the GFile or None """
+    try:
+        from gdr.archive import archive_open
+        zf = archive_open(path)
+    except Exception as ex:
+        print('  no gvfs archive mount: %s' % ex)
+        return None
+    if not zf.get_path():
+        print('  no gvfs-fuse local path')
+        from gdr.archive import archive_close
+        archive_close(zf)
+        return None
+    return zf
+
+
+def bench(path, opf_member):
+    size = os.path.getsize(path)
+    print('%s, %s' % (path, format_size(size)))
+
+    start = time.perf_counter()
+    storage = ZipStorage(path)
+    elapsed = time.perf_counter() - start
+    print('  %-16s %8.1fms  %d members' %
+          ('index', elapsed * 1e3, len(storage.members())))
+
+    members = storage.members()
+    total = read_storage(storage, members)
+    report('read ZipStorage', timeit(read_storage, storage, members), total)
+    report('read zipfile', timeit(read_zipfile, path), total)
+
+    opf = os.path.join(storage.root, opf_member)
+    elapsed = timeit(Book.parse, opf, 'fast', storage, repeat=3)
+    print('  %-16s %8.1fms' % ('parse ZipStorage', elapsed * 1e3))
+
+    zf = mount(path)
+    if zf is not None:
+        from gdr.archive import archive_close
+
+        root = zf.get_path()
+        paths = [os.path.join(root, os.path.relpath(m, storage.root))
+                 for m in members]
+        report('read gvfs-fuse', timeit(read_files, paths), total)
+        elapsed = timeit(Book.parse, os.path.join(root, opf_member),
+                         repeat=3)
+        print('  %-16s %8.1fms' % ('parse gvfs-fuse', elapsed * 1e3))
+        archive_close(zf)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        bench(sys.argv[1], sys.argv[2])
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            basedir = os.path.join(tmpdir, 'book')
+            os.mkdir(basedir)
+            smil_files = 20
+            write_book(basedir, points=500, smil_files=smil_files,
+                       clips_per_file=300, clip_length=2.0)
+            for n in range(smil_files):
+                write_mp3(os.path.join(basedir, f'audio{n:04d}.mp3'), 600)
+            path = write_zip(os.path.join(tmpdir, 'book.zip'), basedir,
+                             'book/')
+            bench(path, 'book/book.opf')
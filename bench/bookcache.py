@@ -0,0 +1,61 @@
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Cold (parsing) vs. warm (cached) book open.
+
+    Usage: python3 -m bench.bookcache [OPF...]
+
+    Each open runs in a fresh interpreter. """
+
+import sys
+import tempfile
+
+from bench import run_isolated, format_size
+from bench.synth import write_book
+
+
+def open_book(opffile, cache_dir):
+    from daisy.book import Book
+    from daisy.cache import BookCache
+
+    book = Book.open(opffile, cache=BookCache(cache_dir))
+    return len(book.timeline)
+
+
+def compare(opffile):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name in ('cold', 'warm', 'warm'):
+            r = run_isolated('bench.bookcache', 'open_book', opffile,
+                             cache_dir)
+            print('  %-5s %8.1fms  peak RSS %10s  (%d clips)' %
+                  (name, r['time'] * 1e3, format_size(r['maxrss']),
+                   r['result']))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            print(arg)
+            compare(arg)
+    else:
+        for points, smil_files in ((1000, 100), (20000, 1000)):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                opf = write_book(tmpdir, points=points, depth=3,
+                                 pages=points // 3, smil_files=smil_files,
+                                 clips_per_file=100)
+                print('%d navPoints, %d SMIL files, %d clips:' %
+                      (points, smil_files, smil_files * 100))
+                compare(opf)
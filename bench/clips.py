@@ -0,0 +1,72 @@
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Memory used per clip by AudioClip objects and by a ClipTable.
+
+    Usage: python3 -m bench.clips [CLIPS]
+
+    Sources are fresh strings for each clip, as they are when read from XML
+    attributes. """
+
+import sys
+import tracemalloc
+
+from daisy.audioclip import AudioClip, ClipTable
+
+
+class DictAudioClip:
+    """ AudioClip as it was before it got __slots__ """
+
+    def __init__(self, begin, end, src):
+        self.begin = begin
+        self.end = end
+        self.src = src
+
+
+def clips(count, files=200):
+    per_file = max(1, count // files)
+    for i in range(count):
+        # build a new string each time, like lxml does
+        src = 'audio%04d.mp3' % (i // per_file)
+        yield i * 1.5 % 3600, i * 1.5 % 3600 + 1.5, src
+
+
+def measure(build, count):
+    tracemalloc.start()
+    obj = build(clips(count))
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return size / count
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+
+    def table(it):
+        t = ClipTable()
+        t.extend(it)
+        return t
+
+    cases = (
+        ('AudioClip (__dict__)',
+         lambda it: [DictAudioClip(*c) for c in it]),
+        ('AudioClip (__slots__)', lambda it: [AudioClip(*c) for c in it]),
+        ('ClipTable', table),
+    )
+    print('%d clips:' % count)
+    for name, build in cases:
+        print('  %-22s %7.1f bytes/clip' % (name, measure(build, count)))
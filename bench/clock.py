@@ -0,0 +1,78 @@
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" SMIL clock value parsing throughput, in values per second.
+
+    Usage: python3 -m bench.clock [COUNT] """
+
+import re
+import sys
+
+from bench import timeit
+from bench.synth import clock_value
+from daisy.audioclip import parse_smil_time, parse_smil_times
+
+
+def legacy_parse_smil_time(time):
+    """ The former AudioClip.parse_smil_time(), only valid on full clocks """
+    m = re.match(r'(?:ntp=)?(?:(?:([0-9]+):)?([0-9]+):)?([0-9]+(?:[.][0-9]+)?)', time)
+    if not m:
+        return None
+    return int(m.group(1)) * 60 * 60 + int(m.group(2)) * 60 + float(m.group(3))
+
+
+def clip_times(count, fmt):
+    """ Returns clipBegin/clipEnd-like values: each clip begins where the
+        previous one ended """
+    times = []
+    for i in range(count // 2):
+        begin = i * 1.733
+        times.append(fmt(begin))
+        times.append(fmt(begin + 1.733))
+    return times
+
+
+def mixed_value(seconds):
+    kind = int(seconds) % 3
+    if kind == 0:
+        return '%.3fs' % seconds
+    elif kind == 1:
+        return '%dms' % (seconds * 1000)
+    else:
+        return clock_value(seconds)
+
+
+FORMATS = (
+    ('full clock', clock_value),
+    ('seconds', lambda v: '%.3fs' % v),
+    ('mixed', mixed_value),
+)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    for name, fmt in FORMATS:
+        times = clip_times(count, fmt)
+        print('%s (%d values):' % (name, len(times)))
+        cases = [('scalar', lambda: [parse_smil_time(t) for t in times]),
+                 ('bulk', lambda: parse_smil_times(times))]
+        if fmt is clock_value:
+            cases.insert(0, ('legacy', lambda: [legacy_parse_smil_time(t)
+                                                for t in times]))
+        for case, func in cases:
+            elapsed = timeit(func, repeat=3)
+            print('  %-8s %12.0f values/s' % (case, len(times) / elapsed))
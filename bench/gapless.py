@@ -0,0 +1,138 @@
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" File boundary latency of continuous playback.
+
+    Usage: python3 -m bench.gapless [FILES]
+
+    Plays a queue spanning several generated WAV files through the playback
+    engine, into a synchronized fakesink.  At each file boundary, the extra
+    wall time between the end of the last buffer of a file and the first
+    buffer of the next one is measured, as well as the running time
+    discontinuity.  Both are compared with the gapless and the former
+    (pipeline rebuild) file changes. """
+
+import os
+import sys
+import tempfile
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib
+from gi.repository import Gst
+
+from bench.synth import write_wav, write_smil
+from daisy.smil import Timeline
+from gdr.engine import PlaybackEngine
+from gdr.playqueue import PlayQueue
+
+
+# boundary latency target for gapless transitions, in seconds
+TARGET = 0.020
+
+CLIPS_PER_FILE = 3
+CLIP_LENGTH = 1.0
+
+
+def build_queue(tmpdir, files):
+    smil_files = []
+    for n in range(files):
+        audio = 'audio%02d.wav' % n
+        write_wav(os.path.join(tmpdir, audio), CLIPS_PER_FILE * CLIP_LENGTH,
+                  frequency=440 + 110 * n)
+        path = os.path.join(tmpdir, 'content%02d.smil' % n)
+        write_smil(path, CLIPS_PER_FILE, audio, clip_length=CLIP_LENGTH,
+                   id_prefix='f%d_' % n)
+        smil_files.append(path)
+    return PlayQueue(Timeline.from_files(smil_files))
+
+
+def measure(queue, gapless):
+    """ Returns a list of (wall gap, running time gap) at each boundary """
+    engine = PlaybackEngine()
+    engine.gapless = gapless
+    engine.set_queue(queue)
+
+    sink = Gst.ElementFactory.make('fakesink', None)
+    sink.set_property('sync', True)
+    engine.playbin.set_property('audio-sink', sink)
+
+    # (wall time, running time, duration, first buffer of a stream)
+    buffers = []
+    state = {'segment': None, 'new_stream': True}
+
+    def probe(pad, info):
+        if info.type & Gst.PadProbeType.BUFFER:
+            buf = info.get_buffer()
+            segment = state['segment']
+            running_time = buf.pts
+            if segment is not None:
+                running_time = segment.to_running_time(Gst.Format.TIME,
+                                                       buf.pts)
+            buffers.append((time.perf_counter(), running_time,
+                            buf.duration, state['new_stream']))
+            state['new_stream'] = False
+        else:
+            event = info.get_event()
+            if event.type == Gst.EventType.STREAM_START:
+                state['new_stream'] = True
+            elif event.type == Gst.EventType.SEGMENT:
+                state['segment'] = event.parse_segment()
+        return Gst.PadProbeReturn.OK
+
+    sink.get_static_pad('sink').add_probe(
+        Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM, probe)
+
+    loop = GLib.MainLoop()
+
+    engine.connect('finished', lambda e: loop.quit())
+    engine.play_clip(0)
+    engine.playbin.set_state(Gst.State.PLAYING)
+    loop.run()
+    engine.playbin.set_state(Gst.State.NULL)
+
+    gaps = []
+    for prev, cur in zip(buffers, buffers[1:]):
+        if cur[3]:
+            wall = cur[0] - prev[0] - prev[2] / Gst.SECOND
+            running = (cur[1] - prev[1] - prev[2]) / Gst.SECOND
+            gaps.append((wall, running))
+    # the first stream start is not a boundary
+    return gaps
+
+
+if __name__ == '__main__':
+    Gst.init(sys.argv)
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = build_queue(tmpdir, files)
+        results = {}
+        for gapless in (False, True):
+            gaps = measure(queue, gapless)
+            results[gapless] = gaps
+            print('%s: %d boundaries' % ('gapless' if gapless else 'rebuild',
+                                         len(gaps)))
+            for wall, running in gaps:
+                print('  wall gap %7.1fms  running time gap %7.1fms' %
+                      (wall * 1e3, running * 1e3))
+
+        worst = max((w for w, r in results[True]), default=0)
+        print('worst gapless boundary latency: %.1fms (target %.1fms)' %
+              (worst * 1e3, TARGET * 1e3))
+        assert len(results[True]) == files - 1, 'missing boundaries'
+        assert worst <= TARGET, 'boundary latency target missed'
@@ -0,0 +1,116 @@
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Library scan and catalog search on a generated library.
+
+    Usage: python3 -m bench.library [BOOKS]
+
+    Generates BOOKS small books (2000 by default), a quarter of them
+    zipped, spread in directories of 100.  Times a first scan with a single
+    worker and with the whole pool, a rescan with nothing changed, a rescan
+    with 1% of the books changed, and a few searches. """
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from bench import timeit
+from bench.synth import write_book, write_zip
+from daisy.library import Library
+
+
+NAMES = ('Hugo', 'Zola', 'Dumas', 'Verne', 'Sand', 'Colette', 'Proust',
+         'Camus', 'Duras', 'Ernaux', 'Maupassant', 'Flaubert', 'Stendhal',
+         'Balzac', 'Modiano', 'Yourcenar', 'Céline', 'Pérec')
+WORDS = ('voyage', 'château', 'mystère', 'été', 'nuit', 'mer', 'île',
+         'lumière', 'hiver', 'forêt', 'rivière', 'ville', 'étoile', 'jardin',
+         'silence', 'mémoire', 'départ', 'retour', 'orage', 'printemps')
+
+
+def generate(root, count):
+    """ Writes @count books under @root, and returns their paths """
+    rng = random.Random(0)
+    paths = []
+    for n in range(count):
+        group = os.path.join(root, 'group%03d' % (n // 100))
+        title = ' '.join(rng.sample(WORDS, 3)).capitalize() + ' %d' % n
+        author = rng.choice(NAMES)
+        path = os.path.join(group, 'book%05d' % n)
+        os.makedirs(path)
+        write_book(path, points=5, depth=1, smil_files=1, clips_per_file=5,
+                   title=title, author=author)
+        if n % 4 == 3:
+            write_zip(path + '.zip', path, prefix='book%05d/' % n)
+            shutil.rmtree(path)
+            path += '.zip'
+        paths.append(path)
+    return paths
+
+
+def scan(db, root, max_workers=None):
+    library = Library(db)
+    try:
+        start = time.perf_counter()
+        result = library.scan([root], max_workers=max_workers)
+        return time.perf_counter() - start, result
+    finally:
+        library.close()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = os.path.join(tmpdir, 'library')
+        start = time.perf_counter()
+        paths = generate(root, count)
+        print('%d books generated in %.1fs' %
+              (count, time.perf_counter() - start))
+
+        elapsed, result = scan(os.path.join(tmpdir, 'serial.sqlite'), root,
+                               max_workers=1)
+        print('  first scan, 1 worker:   %8.1fms  (%.3fms/book)' %
+              (elapsed * 1e3, elapsed * 1e3 / count))
+
+        db = os.path.join(tmpdir, 'library.sqlite')
+        elapsed, result = scan(db, root)
+        assert result.read == count and not result.failed, result.failed
+        print('  first scan, %2d workers: %8.1fms  (%.3fms/book)' %
+              (os.cpu_count(), elapsed * 1e3, elapsed * 1e3 / count))
+
+        elapsed, result = scan(db, root)
+        assert result.read == 0 and result.unchanged == count
+        print('  rescan, unchanged:      %8.1fms' % (elapsed * 1e3))
+
+        changed = paths[::100]
+        for path in changed:
+            if not path.endswith('.zip'):
+                path = os.path.join(path, 'book.opf')
+            os.utime(path, ns=(0, 0))
+        elapsed, result = scan(db, root)
+        assert result.read == len(changed)
+        print('  rescan, %3d changed:    %8.1fms' %
+              (len(changed), elapsed * 1e3))
+
+        library = Library(db)
+        for query in ('hugo', 'chateau', 'ete nuit', 'mem', 'pérec été 1'):
+            hits = library.search(query)
+            elapsed = timeit(library.search, query, repeat=5)
+            print('  search %-14r %3d hits %6.2fms' %
+                  (query, len(hits), elapsed * 1e3))
+        library.close()
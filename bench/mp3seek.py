@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" MP3 seek latency.
+
+    Usage: python3 -m bench.mp3seek [MP3]
+
+    Without argument, a 2 hours MP3 file is generated.  Measures the latency
+    and landing error of seeks at several offsets in the file: accurate
+    ones, like the playback engine does, and keyframe ones for comparison.
+    Accurate seeks landing more than a frame away from their target make the
+    exit status 1.  Needs GStreamer. """
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bench import format_size
+from bench.synth import write_mp3
+
+
+# fractions of the file duration seeked to
+OFFSETS = (0.01, 0.1, 0.25, 0.5, 0.75, 0.99)
+# seeks per offset
+REPEAT = 5
+# samples in the longest MP3 frames
+FRAME_SAMPLES = 1152
+
+
+def bench(path):
+    """ Measures seeks in @path.  Returns whether accurate seeks are all
+        within a frame of their target, or None if GStreamer is not
+        available. """
+    try:
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst
+    except (ImportError, ValueError):
+        print('  GStreamer not available, skipping seeks')
+        return None
+    Gst.init(None)
+    ok = True
+
+    pipeline = Gst.parse_launch('filesrc name=src ! mpegaudioparse ! '
+                                'mpg123audiodec name=dec ! '
+                                'fakesink sync=false')
+    pipeline.get_by_name('src').set_property('location', path)
+    pipeline.set_state(Gst.State.PAUSED)
+    pipeline.get_state(Gst.CLOCK_TIME_NONE)
+    bus = pipeline.get_bus()
+
+    caps = pipeline.get_by_name('dec').get_static_pad('src').get_current_caps()
+    frame_duration = FRAME_SAMPLES / caps.get_structure(0).get_value('rate')
+    available, duration = pipeline.query_duration(Gst.Format.TIME)
+    duration /= Gst.SECOND
+
+    targets = [(offset, offset * duration) for offset in OFFSETS] * REPEAT
+    random.shuffle(targets)
+    modes = (
+        ('accurate', Gst.SeekFlags.ACCURATE),
+        ('keyframe', Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SNAP_BEFORE),
+    )
+    print('  %-8s %8s %12s %12s' % ('seek', 'offset', 'latency', 'error'))
+    for name, flags in modes:
+        latencies = {offset: [] for offset in OFFSETS}
+        errors = {offset: [] for offset in OFFSETS}
+        for offset, t in targets:
+            start = time.perf_counter()
+            pipeline.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | flags,
+                                 int(t * Gst.SECOND))
+            bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                                   Gst.MessageType.ASYNC_DONE)
+            latencies[offset].append(time.perf_counter() - start)
+            available, pos = pipeline.query_position(Gst.Format.TIME)
+            if available:
+                errors[offset].append(abs(pos / Gst.SECOND - t))
+            else:
+                errors[offset].append(float('inf'))
+        for offset in OFFSETS:
+            latency = sorted(latencies[offset])[REPEAT // 2]
+            error = max(errors[offset])
+            print('  %-8s %7.0f%% %10.2fms %10.1fms' %
+                  (name, offset * 100, latency * 1e3, error * 1e3))
+            if name == 'accurate' and error > frame_duration:
+                ok = False
+    if not ok:
+        print('  accurate seeks landed more than a frame away')
+    pipeline.set_state(Gst.State.NULL)
+    return ok
+
+
+if __name__ == '__main__':
+    random.seed(42)
+    ok = True
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            print(arg)
+            ok = bench(arg) is not False and ok
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'long.mp3')
+            write_mp3(path, 2 * 3600)
+            print('2h MP3, %s:' % format_size(os.path.getsize(path)))
+            ok = bench(path) is not False
+    sys.exit(0 if ok else 1)
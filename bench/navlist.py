@@ -0,0 +1,93 @@
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Nav list lookup scaling, from 1k to 100k page targets.
+
+    Usage: python3 -m bench.navlist
+
+    Looking a page up by number or label, and searching labels by prefix,
+    should take roughly the same time whatever the size of the list, once
+    the index is built.  For reference, a linear walk of the list is timed
+    as well. """
+
+import os
+import tempfile
+
+from bench import timeit
+from bench.synth import write_ncx
+from daisy.navigationcontrol import NavigationControl
+
+
+SIZES = (1000, 10000, 50000, 100000)
+LOOKUPS = 1000
+
+
+def build_index(nav_list):
+    nav_list._index = None
+    return nav_list._ensure_index()
+
+
+def lookups(nav_list, values):
+    for value in values:
+        nav_list.by_value(value)
+
+
+def label_lookups(nav_list, labels):
+    for label in labels:
+        nav_list.lookup(label)
+
+
+def searches(nav_list, prefixes):
+    for prefix in prefixes:
+        nav_list.search(prefix)
+
+
+def walk(nav_list, value):
+    return next(t for t in nav_list if t.value == value)
+
+
+if __name__ == '__main__':
+    per_lookup = []
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'navigation.ncx')
+            write_ncx(path, points=10, pages=size)
+            nav_list = NavigationControl(path).nav_lists()[0]
+            assert len(nav_list) == size
+
+            step = max(1, size // LOOKUPS)
+            values = list(range(1, size + 1, step))[:LOOKUPS]
+            labels = [' %d ' % v for v in values]
+            prefixes = [str(v)[:3] for v in values]
+            assert nav_list.lookup('%d' % size).value == size
+
+            build = timeit(build_index, nav_list, repeat=3)
+            by_value = timeit(lookups, nav_list, values, repeat=3)
+            by_label = timeit(label_lookups, nav_list, labels, repeat=3)
+            search = timeit(searches, nav_list, prefixes, repeat=3)
+            linear = timeit(walk, nav_list, size, repeat=1)
+            n = len(values)
+            print('%6d targets: index %7.2fms  value %5.2fµs  label %5.2fµs'
+                  '  prefix %6.2fµs  walk %8.2fµs' % (
+                      size, build * 1e3, by_value * 1e6 / n,
+                      by_label * 1e6 / n, search * 1e6 / n, linear * 1e6))
+            per_lookup.append(by_value / n + by_label / n)
+
+    # lookups must not depend on the list size.  Allow for noise and cache
+    # effects, a linear walk would grow 100 times here.
+    ratio = per_lookup[-1] / per_lookup[0]
+    print('lookup cost growth from 1k to 100k targets: x%.2f' % ratio)
+    assert ratio < 5, 'nav list lookups do not scale'
@@ -0,0 +1,65 @@
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" NCX parsing: tree mode vs. streaming mode, parse time and peak RSS.
+
+    Usage: python3 -m bench.ncx [NCX...]
+
+    Without arguments, synthetic NCX files of various sizes are used. """
+
+import os
+import sys
+import tempfile
+
+from bench import run_isolated, format_size
+from bench.synth import write_ncx
+
+
+def load(ncxfile, streaming):
+    """ Parses @ncxfile the way the UI does """
+    from daisy.navigationcontrol import NavigationControl
+
+    nc = NavigationControl(ncxfile, streaming=streaming)
+    nc.title()
+    nav_map = nc.nav_map()
+    nav_lists = nc.nav_lists()
+
+    def count(points):
+        return sum(1 + count(p) for p in points)
+
+    return count(nav_map) + sum(len(l) for l in nav_lists)
+
+
+def compare(ncxfile):
+    print('%s (%s):' % (os.path.basename(ncxfile),
+                        format_size(os.path.getsize(ncxfile))))
+    for streaming in (False, True):
+        r = run_isolated('bench.ncx', 'load', ncxfile, streaming)
+        print('  %-9s %7.3fs  peak RSS %10s  (%d entries)' %
+              ('streaming' if streaming else 'tree', r['time'],
+               format_size(r['maxrss']), r['result']))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            compare(arg)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for points, pages in ((1000, 300), (5000, 2000), (20000, 8000)):
+                path = os.path.join(tmpdir, 'nav%d.ncx' % points)
+                write_ncx(path, points=points, depth=3, pages=pages)
+                compare(path)
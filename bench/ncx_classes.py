@@ -0,0 +1,64 @@
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Construction cost of each NCX class on a large NCX.
+
+    Usage: python3 -m bench.ncx_classes [NCX]
+
+    Construction of the container classes (NavPoint, NavList) includes their
+    labels and children, as this is how they are built in tree mode. """
+
+import os
+import sys
+import tempfile
+
+from lxml import etree
+
+from bench import timeit
+from bench.synth import write_ncx
+from daisy import navigationcontrol as ncx
+
+
+def run(ncxfile):
+    tree = etree.parse(ncxfile)
+
+    def nodes(path):
+        return ncx._xpath(tree, path)
+
+    cases = (
+        ('Audio', ncx.Audio, nodes('//ncx:navLabel/ncx:audio')),
+        ('Img', ncx.Img, nodes('//ncx:navLabel/ncx:img')),
+        ('NavLabel', ncx.NavLabel, nodes('//ncx:navLabel')),
+        ('NavTarget', ncx.NavTarget, nodes('//ncx:navTarget')),
+        ('NavPoint', ncx.NavPoint, nodes('//ncx:navPoint')),
+        ('NavList', ncx.NavList, nodes('//ncx:navList')),
+    )
+    for name, cls, elems in cases:
+        if not elems:
+            continue
+        elapsed = timeit(lambda: [cls(e) for e in elems], repeat=3)
+        print('  %-10s %7d objects  %8.2fµs/object' %
+              (name, len(elems), elapsed * 1e6 / len(elems)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'large.ncx')
+            write_ncx(path, points=20000, depth=3, pages=8000)
+            run(path)
@@ -0,0 +1,77 @@
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Spine resolution scaling, from 10 to 50k spine items.
+
+    Usage: python3 -m bench.opf
+
+    The per-item cost of spine resolution should stay roughly constant as
+    the spine grows.  For reference, the former XPath query per itemref is
+    timed as well on the smaller sizes, as it is quadratic. """
+
+import os
+import tempfile
+
+from bench import timeit
+from bench.synth import write_opf
+from daisy.package import Package
+
+
+SIZES = (10, 100, 1000, 5000, 10000, 50000)
+LEGACY_MAX = 1000
+
+
+def legacy_spine(pkg):
+    return [
+        os.path.join(pkg._basedir, pkg._xpath(
+            '/oeb:package/oeb:manifest/oeb:item[@id="%s"]/@href' % idref
+            )[0])
+        for idref in pkg._xpath('/oeb:package/oeb:spine/oeb:itemref/@idref')
+    ]
+
+
+def uncached_spine(pkg):
+    pkg._spine = None
+    return pkg.spine()
+
+
+if __name__ == '__main__':
+    per_item = []
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'book.opf')
+            write_opf(path, smil_files=size, create_files=True)
+
+            load = timeit(Package, path, repeat=3)
+            pkg = Package(path)
+            spine = timeit(uncached_spine, pkg, repeat=3)
+            cached = timeit(pkg.spine, repeat=3)
+            assert len(pkg.spine()) == size
+            line = ('%6d items: load %8.2fms  spine %7.2fms (%5.2fµs/item)'
+                    '  cached %6.2fµs' % (size, load * 1e3, spine * 1e3,
+                                          spine * 1e6 / size, cached * 1e6))
+            if size <= LEGACY_MAX:
+                legacy = timeit(legacy_spine, pkg, repeat=1)
+                assert legacy_spine(pkg) == pkg.spine()
+                line += '  legacy %9.2fms' % (legacy * 1e3)
+            print(line)
+            per_item.append(spine / size)
+
+    # spine resolution must scale linearly.  Allow for noise and cache
+    # effects, a quadratic lookup would grow ~50 times here.
+    ratio = per_item[-1] / min(per_item[2:])
+    print('per-item cost growth from 1k to 50k items: x%.2f' % ratio)
+    assert ratio < 10, 'spine resolution does not scale linearly'
@@ -0,0 +1,87 @@
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Cost of mapping a playback position back to the navigation.
+
+    Usage: python3 -m bench.position [CLIPS]
+
+    Measures PositionTracker.locate() when polled within the same clip, and
+    when jumping to random positions. """
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bench import timeit
+from bench.synth import write_smil
+from daisy.position import PositionTracker
+from daisy.smil import Timeline
+
+
+class Entry(list):
+    def __init__(self, content):
+        self.content = content
+
+
+def build(tmpdir, clips, files=100):
+    pars = clips // files
+    smil_files = []
+    for n in range(files):
+        path = os.path.join(tmpdir, 'content%04d.smil' % n)
+        write_smil(path, pars, 'audio%04d.mp3' % n, id_prefix='p%d_' % n)
+        smil_files.append(path)
+    timeline = Timeline.from_files(smil_files)
+
+    # a NavPoint every 10 clips, a page every 50
+    points = [Entry('content%04d.smil#p%d_%d' % (n, n, i))
+              for n in range(files) for i in range(0, pars, 10)]
+    pages = [Entry('content%04d.smil#p%d_%d' % (n, n, i))
+             for n in range(files) for i in range(0, pars, 50)]
+    return timeline, points, pages
+
+
+if __name__ == '__main__':
+    clips = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        timeline, points, pages = build(tmpdir, clips)
+        start = time.perf_counter()
+        tracker = PositionTracker(timeline, points, [pages], tmpdir)
+        print('%d clips, %d points, %d pages: index built in %.1fms' %
+              (len(timeline), len(points), len(pages),
+               (time.perf_counter() - start) * 1e3))
+
+        src = timeline.clips.srcs[0]
+        tracker.locate(src, 0.5)
+        assert tracker.nav_point is points[0] and tracker.targets[0] is pages[0]
+
+        calls = 100000
+        same = timeit(lambda: [tracker.locate(src, 0.7) for i in range(calls)])
+        print('  same clip:      %6.3fµs/call' % (same * 1e6 / calls))
+
+        positions = [(random.choice(timeline.clips.srcs), random.uniform(0, 2000))
+                     for i in range(calls)]
+        jumps = timeit(lambda: [tracker.locate(s, t) for s, t in positions])
+        print('  random jumps:   %6.3fµs/call' % (jumps * 1e6 / calls))
+
+        # check a known position: clip 123 of file 7 is at 246s
+        src = os.path.join(tmpdir, 'audio0007.mp3')
+        tracker.locate(src, 246.5)
+        assert tracker.nav_point.content == 'content0007.smil#p7_120'
+        assert tracker.targets[0].content == 'content0007.smil#p7_100'
+        assert timeline.text(tracker.clip).endswith('#tp7_123')
@@ -0,0 +1,92 @@
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Progressive vs. whole book parsing.
+
+    Usage: python3 -m bench.progressive [OPF...]
+
+    Compares Book.parse() to Book.open_progressively() and read_parts(),
+    reporting when the first clips are available (the beginning of the book
+    can be played), when the first and last navigation items are, and when
+    the book is complete.  The median and longest Timeline.append_file()
+    calls are reported too, as they run on the main thread and must fit in
+    the idle budget of BookLoader (the longest ones are usually garbage
+    collections, or the SMIL parsing processes taking the CPU).  Each
+    measurement runs in a fresh interpreter. """
+
+import sys
+import tempfile
+
+from bench import run_isolated
+from bench.synth import write_book
+
+
+def parse(opffile):
+    from daisy.book import Book
+
+    book = Book.parse(opffile)
+    return len(book.timeline)
+
+
+def progressive(opffile):
+    import time
+    from daisy.book import Book, NAV, SMIL
+
+    start = time.perf_counter()
+    book = Book.open_progressively(opffile)
+    times = {}
+    appends = []
+    for kind, part in book.read_parts():
+        now = time.perf_counter() - start
+        if kind == SMIL:
+            times.setdefault('first clips', now)
+            book.timeline.append_file(*part)
+            appends.append(time.perf_counter() - start - now)
+        elif kind == NAV:
+            times.setdefault('first nav', now)
+            times['last nav'] = now
+    book.timeline.finish()
+    times['complete'] = time.perf_counter() - start
+    appends.sort()
+    times['median append'] = appends[len(appends) // 2]
+    times['longest append'] = appends[-1]
+    return times
+
+
+def compare(opffile):
+    r = run_isolated('bench.progressive', 'parse', opffile)
+    print('  whole parse     %8.1fms  (%d clips)' % (r['time'] * 1e3,
+                                                    r['result']))
+    times = run_isolated('bench.progressive', 'progressive', opffile)['result']
+    for name in ('first clips', 'first nav', 'last nav', 'complete',
+                 'median append', 'longest append'):
+        print('  %-15s %8.1fms' % (name, times[name] * 1e3))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            print(arg)
+            compare(arg)
+    else:
+        for points, smil_files in ((1000, 100), (20000, 1000)):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                opf = write_book(tmpdir, points=points, depth=3,
+                                 pages=points // 3, smil_files=smil_files,
+                                 clips_per_file=100)
+                print('%d navPoints, %d SMIL files, %d clips:' %
+                      (points, smil_files, smil_files * 100))
+                compare(opf)
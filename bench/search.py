@@ -0,0 +1,99 @@
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Full-text search on a book with a 5MB DTBook.
+
+    Usage: python3 -m bench.search [OPF...]
+
+    Times building the index, storing it in and loading it from the cache,
+    and a few kinds of queries, including resolving the hits to clips.
+    Queries should take a few milliseconds at most. """
+
+import os
+import sys
+import tempfile
+
+from bench import timeit, format_size
+from bench.synth import write_book
+from daisy.book import Book
+from daisy.cache import BookCache
+from daisy.search import build_index, dtbook_files
+
+
+def queries(index):
+    """ Returns a common word, a rare word, a short prefix and a two words
+        query from the words of @index """
+    words = sorted((w for w in index._postings if w.isalpha()),
+                   key=lambda w: len(index._postings[w]))
+    common = words[-1]
+    rare = words[len(words) // 10]
+    return [common + ' ', rare + ' ', common[:2], common + ' ' + rare[:3]]
+
+
+def resolve_all(index, hits, timeline):
+    return [index.resolve(hit, timeline) for hit in hits]
+
+
+def run(opffile):
+    book = Book.open(opffile)
+    size = sum(os.path.getsize(p) for p in dtbook_files(book.package))
+    build = timeit(build_index, book, repeat=1)
+    index = build_index(book)
+    print('  %d documents from %s of DTBook: built in %.1fms' %
+          (len(index), format_size(size), build * 1e3))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = BookCache(cache_dir)
+        store = timeit(cache.store_search, opffile, index, repeat=1)
+        entry = cache._entry_path(opffile, cache.SEARCH_SUFFIX)
+        load = timeit(cache.load_search, opffile, book.storage(), repeat=3)
+        loaded = cache.load_search(opffile, book.storage())
+        assert loaded is not None
+        print('  stored %s in %.1fms, loaded in %.1fms' %
+              (format_size(os.path.getsize(entry)), store * 1e3,
+               load * 1e3))
+
+        worst = 0
+        for query in queries(index):
+            for name, idx in (('built', index), ('loaded', loaded)):
+                hits = idx.search(query)
+                elapsed = timeit(idx.search, query, repeat=5)
+                resolve = timeit(resolve_all, idx, hits, book.timeline,
+                                 repeat=3)
+                assert hits == index.search(query)
+                assert None not in resolve_all(idx, hits, book.timeline)
+                print('  %-6s %-20r %3d hits %7.2fms  resolve %6.2fms' %
+                      (name, query, len(hits), elapsed * 1e3,
+                       resolve * 1e3))
+                worst = max(worst, elapsed)
+    return worst
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            print(arg)
+            run(arg)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # about 5MB of text in 10k paragraphs
+            opf = write_book(tmpdir, points=1000, depth=2, pages=300,
+                             smil_files=50, clips_per_file=200,
+                             dtbook_words=75)
+            print('1000 navPoints, 300 pages, 10000 paragraphs:')
+            worst = run(opf)
+        print('slowest query: %.2fms' % (worst * 1e3))
+        assert worst < 0.05, 'queries are too slow'
@@ -0,0 +1,158 @@
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Time to first window, with GStreamer initialized eagerly or deferred.
+
+    Usage: python3 -m bench.startup [--repeat N] [--top N]
+
+    Starts the application in a fresh interpreter, and measures the time
+    from process creation to the first draw of the window.  "eager"
+    initializes GStreamer before importing the window, like startup used to,
+    and "deferred" leaves it to the first playback.  Each is run with a cold
+    plugin registry (a new GST_REGISTRY file, so every plugin is scanned) and
+    with a warm one.  The time the deferred initialization then takes is
+    reported as well, as it moves to the first playback.
+
+    The slowest imports are listed from the -X importtime output of a warm
+    deferred run.  Run `make` first to measure with the compiled UI
+    resources.  Needs GTK, GStreamer and a display. """
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+_CHILD = '''
+import sys, time
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('Gst', '1.0')
+from gi.repository import Gio, GLib, Gtk
+if not Gtk.init_check(sys.argv)[0]:
+    print('no-display')
+    sys.exit(0)
+if sys.argv[1] == 'eager':
+    from gi.repository import Gst
+    Gst.init(None)
+import window
+from gdr.gstinit import ensure_initialized
+
+def on_draw(win, cr):
+    print('first-window', time.time())
+    win.disconnect_by_func(on_draw)
+    GLib.idle_add(app.quit)
+    return False
+
+def on_activate(app):
+    app.get_active_window().connect_after('draw', on_draw)
+
+app = window.Application()
+app.set_flags(app.get_flags() | Gio.ApplicationFlags.NON_UNIQUE)
+app.connect_after('activate', on_activate)
+app.run(sys.argv[:1])
+start = time.perf_counter()
+ensure_initialized()
+print('gst-init', time.perf_counter() - start)
+'''
+
+
+def parse_importtime(lines):
+    """ Returns (self seconds, module) tuples from -X importtime @lines """
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        imports.append((int(fields[0]) / 1e6, fields[2].strip()))
+    return imports
+
+
+def run(mode, registry):
+    """ Starts the application once, and returns a dict with the time to
+        'first-window', the deferred 'gst-init' time and the 'imports'.
+        Returns None if the application cannot be shown. """
+    env = dict(os.environ, GST_REGISTRY=registry)
+    start = time.time()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _CHILD,
+                           mode],
+                          env=env, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    result = {'imports': parse_importtime(proc.stderr.splitlines())}
+    for line in proc.stdout.splitlines():
+        key, _, value = line.partition(' ')
+        if key == 'first-window':
+            result[key] = float(value) - start
+        elif key == 'gst-init':
+            result[key] = float(value)
+    if proc.returncode != 0 or 'first-window' not in result:
+        tail = proc.stderr.splitlines()[-1:] or ['no output']
+        if 'no-display' not in proc.stdout:
+            print('application failed: %s' % tail[0], file=sys.stderr)
+        return None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python3 -m bench.startup',
+        description='Time to first window, cold and warm')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10,
+                        help='amount of slowest imports to list')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        warm = os.path.join(tmpdir, 'warm.bin')
+        # fills the warm registry
+        if run('deferred', warm) is None:
+            print('cannot start the application (no GTK, GStreamer or '
+                  'display?)')
+            return 0
+
+        print('%-9s %-5s %14s %14s' % ('gst init', 'cache', 'first window',
+                                       'then gst init'))
+        imports = None
+        for mode in ('eager', 'deferred'):
+            for cache in ('cold', 'warm'):
+                best = None
+                for i in range(args.repeat):
+                    if cache == 'cold':
+                        registry = os.path.join(tmpdir, 'cold%d.bin' % i)
+                    else:
+                        registry = warm
+                    result = run(mode, registry)
+                    if result is None:
+                        return 1
+                    if best is None or \
+                            result['first-window'] < best['first-window']:
+                        best = result
+                print('%-9s %-5s %12.1fms %12.1fms' %
+                      (mode, cache, best['first-window'] * 1e3,
+                       best['gst-init'] * 1e3))
+                if mode == 'deferred' and cache == 'warm':
+                    imports = best['imports']
+
+    print('slowest imports (deferred, warm):')
+    for seconds, module in sorted(imports, reverse=True)[:args.top]:
+        print('  %8.1fms  %s' % (seconds * 1e3, module))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
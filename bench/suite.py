@@ -0,0 +1,236 @@
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" End-to-end benchmark suite on synthetic books of several sizes.
+
+    Usage: python3 -m bench.suite [--output FILE] [--baseline FILE]
+                                  [--save-baseline] [--sizes NAME,...]
+
+    For each size, a book is generated and measured in fresh interpreters:
+    - the parse time of the OPF (Package), the NCX (NavigationControl) and
+      the SMIL files (Timeline and its audio clips), and the peak RSS;
+    - the time to populate the tree models of the window (NavTree), for the
+      first paint and with every row populated as if expanded.  The models
+      are filled without any view, so no display is needed, but GTK is:
+      this is skipped without it.
+
+    Results are written as JSON, and compared to the baseline file if it
+    exists: metrics more than --tolerance worse than their baseline value
+    are reported, and make the exit status 1.  --save-baseline makes the
+    results the new baseline. """
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+from bench import run_isolated, format_size
+from bench.synth import write_book
+
+
+SIZES = {
+    'small': dict(points=100, depth=2, pages=50, smil_files=10,
+                  clips_per_file=100),
+    'medium': dict(points=2000, depth=3, pages=600, smil_files=100,
+                   clips_per_file=100),
+    'large': dict(points=20000, depth=3, pages=6000, smil_files=1000,
+                  clips_per_file=100),
+}
+
+# time differences small enough to be noise, in seconds
+NOISE = 0.002
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# metrics compared to the baseline, and how to show them
+METRICS = (
+    ('package', 'OPF', 'time'),
+    ('ncx', 'NCX', 'time'),
+    ('smil', 'SMIL', 'time'),
+    ('maxrss', 'peak RSS', 'size'),
+    ('populate', 'populate', 'time'),
+    ('populate_all', 'expand all', 'time'),
+)
+
+
+def parse(opffile):
+    """ Parses the book @opffile like Book.parse() does, timing each part """
+    import time
+    from daisy.package import Package
+    from daisy.navigationcontrol import NavigationControl
+    from daisy.smil import Timeline
+
+    start = time.perf_counter()
+    package = Package(opffile)
+    package.spine()
+    package_end = time.perf_counter()
+    navigation = NavigationControl(package.manifest(), streaming=True)
+    navigation.nav_map()
+    navigation.nav_lists()
+    ncx_end = time.perf_counter()
+    timeline = Timeline.from_files(package.spine())
+    smil_end = time.perf_counter()
+    return {
+        'package': package_end - start,
+        'ncx': ncx_end - package_end,
+        'smil': smil_end - ncx_end,
+        'clips': len(timeline),
+    }
+
+
+def populate(opffile):
+    """ Fills the tree models of the window with the navigation of
+        @opffile.  Returns None if GTK cannot be used. """
+    import time
+    try:
+        import gi
+        gi.require_version('Gtk', '3.0')
+        from gi.repository import Gtk
+    except (ImportError, ValueError):
+        return None
+    from daisy.package import Package
+    from daisy.navigationcontrol import NavigationControl
+    from gdr.navtree import NavTree
+
+    package = Package(opffile)
+    navigation = NavigationControl(package.manifest(), streaming=True)
+    nav_map = navigation.nav_map()
+    nav_lists = navigation.nav_lists()
+
+    trees = []
+    start = time.perf_counter()
+    for roots in (nav_map, nav_lists):
+        tree = NavTree(None, Gtk.TreeStore(str, int))
+        tree.set_roots(roots)
+        trees.append((tree, roots))
+    first_paint = time.perf_counter()
+    for tree, roots in trees:
+        # like expanding every row: populates the parents of each first child
+        stack = list(roots)
+        while stack:
+            item = stack.pop()
+            children = item if isinstance(item, list) else ()
+            if children:
+                tree.path_of(children[0])
+                stack.extend(children)
+    return {
+        'populate': first_paint - start,
+        'populate_all': time.perf_counter() - first_paint,
+    }
+
+
+def measure(params, repeat):
+    """ Generates a book of @params and returns its metrics, the best of
+        @repeat runs """
+    result = {'params': params}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        opf = write_book(tmpdir, **params)
+        for i in range(repeat):
+            r = run_isolated('bench.suite', 'parse', opf)
+            for key, value in r['result'].items():
+                result[key] = min(result.get(key, value), value)
+            result['maxrss'] = min(result.get('maxrss', r['maxrss']),
+                                   r['maxrss'])
+            r = run_isolated('bench.suite', 'populate', opf)['result']
+            for key, value in (r or {}).items():
+                result[key] = min(result.get(key, value), value)
+    return result
+
+
+def show(value, kind):
+    if value is None:
+        return '-'
+    if kind == 'size':
+        return format_size(value)
+    return '%.1fms' % (value * 1e3)
+
+
+def compare(results, baseline, tolerance):
+    """ Prints the metrics of @results against @baseline, and returns the
+        list of regressions """
+    regressions = []
+    for name, metrics in results['sizes'].items():
+        base = baseline.get('sizes', {}).get(name)
+        if base is None or base.get('params') != metrics['params']:
+            continue
+        for key, label, kind in METRICS:
+            new = metrics.get(key)
+            old = base.get(key)
+            if not new or not old:
+                continue
+            ratio = new / old
+            flag = ''
+            if ratio > 1 + tolerance and \
+                    (kind != 'time' or new - old > NOISE):
+                flag = '  REGRESSION'
+                regressions.append((name, key, ratio))
+            print('  %-6s %-10s %10s -> %10s  x%.2f%s' %
+                  (name, label, show(old, kind), show(new, kind), ratio,
+                   flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python3 -m bench.suite',
+        description='End-to-end benchmarks on synthetic books')
+    parser.add_argument('--output', help='where to write the JSON results')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='JSON results to compare to')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='make the results the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--sizes', default=','.join(SIZES),
+                        help='comma-separated sizes among %s' %
+                        ', '.join(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'sizes': {},
+    }
+    for name in args.sizes.split(','):
+        metrics = measure(SIZES[name], args.repeat)
+        results['sizes'][name] = metrics
+        print('%-6s %6d clips: %s' % (name, metrics['clips'], '  '.join(
+            '%s %s' % (label, show(metrics.get(key), kind))
+            for key, label, kind in METRICS)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    status = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print('compared to %s:' % args.baseline)
+        if compare(results, baseline, args.tolerance):
+            status = 1
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('baseline saved to %s' % args.baseline)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
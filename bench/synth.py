@@ -0,0 +1,343 @@
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Synthetic DAISY data for benchmarks.
+
+    Usage: python3 -m bench.synth DIRECTORY [NAME=VALUE...]
+
+    Writes a book in DIRECTORY, NAME=VALUE setting write_book() arguments,
+    e.g. "points=5000 pages=1000 audio=1". """
+
+import math
+import os
+import random
+import wave
+import zipfile
+from array import array
+from xml.sax.saxutils import quoteattr, escape
+
+
+def write_wav(path, seconds, rate=22050, frequency=None):
+    """ Writes a mono 16 bits WAV file of @seconds, silent or with a sine
+        tone of @frequency Hz """
+    frames = int(seconds * rate)
+    if frequency:
+        step = 2 * math.pi * frequency / rate
+        samples = array('h', (int(8000 * math.sin(i * step))
+                              for i in range(frames)))
+    else:
+        samples = array('h', bytes(frames * 2))
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(samples.tobytes())
+
+
+def write_mp3(path, seconds, bitrate=32, rate=44100):
+    """ Writes a silent mono MPEG 1 layer III file of @seconds, with a
+        constant @bitrate (in kbps) and sample @rate.  Frames are padded
+        as needed to keep the exact bitrate, like encoders do. """
+    bitrates = (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+    rates = (44100, 48000, 32000)
+    b2 = (bitrates.index(bitrate) + 1) << 4 | rates.index(rate) << 2
+    length = 144 * bitrate * 1000 // rate
+    frames = {
+        pad: b'\xff\xfb' + bytes((b2 | pad << 1, 0xC0)) +
+        bytes(length + pad - 4)
+        for pad in (0, 1)
+    }
+    remainder = 0
+    with open(path, 'wb') as out:
+        for i in range(int(seconds * rate / 1152)):
+            remainder += 144 * bitrate * 1000 % rate
+            pad = int(remainder >= rate)
+            remainder -= pad * rate
+            out.write(frames[pad])
+
+
+def clock_value(seconds):
+    """ Formats @seconds as a SMIL full clock value """
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f'{hours}:{minutes:02d}:{seconds:06.3f}'
+
+
+def _nav_label(out, indent, text, src, begin, end):
+    out.write(f'{indent}<navLabel><text>{escape(text)}</text>'
+              f'<audio src={quoteattr(src)} '
+              f'clipBegin="{clock_value(begin)}" '
+              f'clipEnd="{clock_value(end)}"/></navLabel>\n')
+
+
+def write_ncx(path, points=1000, depth=3, pages=0, title='Synthetic book',
+              clip_ref=None, author='Nobody'):
+    """ Writes an NCX with @points navPoints nested @depth levels deep (the
+        first level gets the remainder) and a page list of @pages targets.
+
+        @clip_ref(n) gives the (audio src, begin, content src) of the n-th
+        entry, navPoints first.  By default they point to made up files. """
+
+    play_order = 0
+    clip = 0
+
+    if clip_ref is None:
+        def clip_ref(n):
+            return (f'audio{n // 100:04d}.mp3', (n % 100) * 2.0,
+                    f'content{n // 100:04d}.smil#c{n}')
+
+    def next_clip():
+        nonlocal clip
+        ref = clip_ref(clip)
+        clip += 1
+        return ref
+
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" '
+                  'version="2005-1">\n'
+                  '<head><meta name="dtb:uid" content="synthetic"/></head>\n'
+                  f'<docTitle><text>{escape(title)}</text></docTitle>\n'
+                  f'<docAuthor><text>{escape(author)}</text></docAuthor>\n'
+                  '<navMap id="navmap">\n')
+
+        # spread points evenly over a tree of the given depth
+        per_level = max(1, round(points ** (1 / max(1, depth))))
+        remaining = points
+
+        def write_points(level, indent):
+            nonlocal remaining, play_order
+            count = per_level if level < depth else remaining
+            for i in range(count):
+                if remaining <= 0:
+                    return
+                remaining -= 1
+                play_order += 1
+                src, begin, content = next_clip()
+                out.write(f'{indent}<navPoint id="p{play_order}" '
+                          f'playOrder="{play_order}">\n')
+                _nav_label(out, indent + ' ', f'Section {play_order}',
+                           src, begin, begin + 2)
+                out.write(f'{indent} <content src={quoteattr(content)}/>\n')
+                if level > 1:
+                    write_points(level - 1, indent + ' ')
+                out.write(f'{indent}</navPoint>\n')
+
+        while remaining > 0:
+            write_points(depth, ' ')
+        out.write('</navMap>\n')
+
+        if pages:
+            out.write('<navList id="pages" class="pagenumber">\n')
+            _nav_label(out, ' ', 'Pages', 'audio0000.mp3', 0, 1)
+            for page in range(1, pages + 1):
+                play_order += 1
+                src, begin, content = next_clip()
+                out.write(f' <navTarget id="page{page}" value="{page}" '
+                          f'class="pagenumber" playOrder="{play_order}">\n')
+                _nav_label(out, '  ', str(page), src, begin, begin + 2)
+                out.write(f'  <content src={quoteattr(content)}/>\n'
+                          ' </navTarget>\n')
+            out.write('</navList>\n')
+
+        out.write('</ncx>\n')
+
+
+def write_opf(path, smil_files=10, extra_items=(), title='Synthetic book',
+              create_files=False, author='Nobody', total_time=None):
+    """ Writes an OPF whose spine lists @smil_files SMIL files.  The
+        manifest also lists an NCX, a resource file and @extra_items, a
+        sequence of (id, href, media-type).  If @create_files is true, empty
+        files are created for every manifest item.  @total_time is the
+        dtb:totalTime in seconds, if any. """
+
+    items = [('ncx', 'navigation.ncx', 'application/x-dtbncx+xml'),
+             ('resource', 'resources.res', 'application/x-dtbresource+xml')]
+    items.extend((f'smil{i}', f'content{i:04d}.smil', 'application/smil')
+                 for i in range(smil_files))
+    items.extend(extra_items)
+
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<package xmlns="http://openebook.org/namespaces/'
+                  'oeb-package/1.0/" unique-identifier="uid">\n'
+                  '<metadata><dc-metadata '
+                  'xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+                  f' <dc:Title>{escape(title)}</dc:Title>\n'
+                  f' <dc:Creator>{escape(author)}</dc:Creator>\n'
+                  ' <dc:Identifier id="uid">synthetic</dc:Identifier>\n'
+                  '</dc-metadata>\n')
+        if total_time is not None:
+            out.write('<x-metadata><meta name="dtb:totalTime" '
+                      f'content="{clock_value(total_time)}"/></x-metadata>\n')
+        out.write('</metadata>\n'
+                  '<manifest>\n')
+        for item_id, href, media_type in items:
+            out.write(f' <item id={quoteattr(item_id)} '
+                      f'href={quoteattr(href)} '
+                      f'media-type={quoteattr(media_type)}/>\n')
+        out.write('</manifest>\n'
+                  '<spine>\n')
+        for i in range(smil_files):
+            out.write(f' <itemref idref="smil{i}"/>\n')
+        out.write('</spine>\n'
+                  '</package>\n')
+
+    if create_files:
+        basedir = os.path.dirname(path)
+        for item_id, href, media_type in items:
+            open(os.path.join(basedir, href), 'w').close()
+
+
+def write_smil(path, pars, audio_src, begin=0.0, clip_length=2.0,
+               id_prefix='par', text_src='book.xml'):
+    """ Writes a Z39.86 SMIL file of @pars pars, each with a text and an
+        audio clip of @clip_length seconds in @audio_src, starting at
+        @begin.  Returns the end of the last clip. """
+
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<smil xmlns="http://www.w3.org/2001/SMIL20/">\n'
+                  '<head><meta name="dtb:uid" content="synthetic"/></head>\n'
+                  '<body>\n'
+                  f'<seq id="{id_prefix}seq">\n')
+        for i in range(pars):
+            end = begin + clip_length
+            out.write(f' <par id="{id_prefix}{i}">\n'
+                      f'  <text src={quoteattr(text_src + "#t" + id_prefix + str(i))}/>\n'
+                      f'  <audio src={quoteattr(audio_src)} '
+                      f'clipBegin="{clock_value(begin)}" '
+                      f'clipEnd="{clock_value(end)}"/>\n'
+                      ' </par>\n')
+            begin = end
+        out.write('</seq>\n'
+                  '</body>\n'
+                  '</smil>\n')
+    return begin
+
+
+_SYLLABLES = ('ba', 'ce', 'di', 'fo', 'gu', 'la', 'me', 'ni', 'po', 'ru',
+              'sa', 'te', 'vi', 'zo', 'é', 'an', 'ou', 'in', 'ré', 'ça')
+
+
+def write_dtbook(path, ids, words=60, vocabulary=5000, seed=0,
+                 title='Synthetic book'):
+    """ Writes a DTBook with a paragraph of @words made up words for each
+        ID in @ids, drawn from @vocabulary distinct words with a Zipf-like
+        distribution.  Some words have diacritics. """
+    rng = random.Random(seed)
+    lexicon = [''.join(rng.choice(_SYLLABLES)
+                       for i in range(rng.randint(1, 4)))
+               for n in range(vocabulary)]
+    # favor the first words, like natural language does
+    weights = [1 / (n + 1) for n in range(vocabulary)]
+
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<dtbook xmlns="http://www.daisy.org/z3986/2005/dtbook/" '
+                  'version="2005-3">\n'
+                  '<head><meta name="dtb:uid" content="synthetic"/></head>\n'
+                  f'<book><frontmatter><doctitle>{escape(title)}</doctitle>'
+                  '</frontmatter>\n<bodymatter><level1>\n')
+        for elem_id in ids:
+            text = ' '.join(rng.choices(lexicon, weights, k=words))
+            out.write(f'<p id={quoteattr(elem_id)}>'
+                      f'{escape(text.capitalize())}.</p>\n')
+        out.write('</level1></bodymatter></book>\n'
+                  '</dtbook>\n')
+
+
+def write_book(basedir, points=100, depth=2, pages=0, smil_files=10,
+               clips_per_file=100, clip_length=2.0, title='Synthetic book',
+               dtbook_words=0, author='Nobody', audio=False):
+    """ Writes a complete book in @basedir: an OPF, an NCX whose entries
+        point to evenly spread clips and @smil_files SMIL files of
+        @clips_per_file clips, each file using its own audio file.  Audio
+        files are silent MP3 files of the right duration if @audio is true,
+        empty files otherwise.  If @dtbook_words is not 0, a DTBook with a
+        paragraph of that many words for each clip is written too.  Returns
+        the path of the OPF. """
+
+    def audio_file(n):
+        return f'audio{n:04d}.mp3'
+
+    def smil(n):
+        return f'content{n:04d}.smil'
+
+    total = smil_files * clips_per_file
+    entries = max(1, points + pages)
+
+    def clip_ref(n):
+        clip = n * total // entries
+        f, i = divmod(clip, clips_per_file)
+        return audio_file(f), i * clip_length, f'{smil(f)}#s{f}_{i}'
+
+    extra_items = [(f'audio{n}', audio_file(n), 'audio/mpeg')
+                   for n in range(smil_files)]
+    if dtbook_words:
+        extra_items.append(('dtbook', 'book.xml', 'application/x-dtbook+xml'))
+    opf = os.path.join(basedir, 'book.opf')
+    write_opf(opf, smil_files=smil_files, title=title, create_files=True,
+              extra_items=extra_items, author=author,
+              total_time=total * clip_length)
+    write_ncx(os.path.join(basedir, 'navigation.ncx'), points=points,
+              depth=depth, pages=pages, title=title, clip_ref=clip_ref,
+              author=author)
+    for n in range(smil_files):
+        write_smil(os.path.join(basedir, smil(n)), clips_per_file,
+                   audio_file(n), clip_length=clip_length,
+                   id_prefix=f's{n}_')
+        if audio:
+            write_mp3(os.path.join(basedir, audio_file(n)),
+                      clips_per_file * clip_length)
+    if dtbook_words:
+        # the text IDs write_smil() references
+        write_dtbook(os.path.join(basedir, 'book.xml'),
+                     (f'ts{f}_{i}' for f in range(smil_files)
+                      for i in range(clips_per_file)),
+                     words=dtbook_words, title=title)
+    return opf
+
+
+def write_zip(path, basedir, prefix=''):
+    """ Archives the files of @basedir into @path under @prefix.  Audio
+        files are stored, others compressed, as usual in zipped books. """
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name in sorted(os.listdir(basedir)):
+            stored = os.path.splitext(name)[1] in ('.mp3', '.wav')
+            zf.write(os.path.join(basedir, name), prefix + name,
+                     zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+    return path
+
+
+if __name__ == '__main__':
+    import inspect
+    import sys
+
+    if len(sys.argv) < 2:
+        sys.exit(__doc__.split('\n\n')[1].strip())
+    defaults = inspect.signature(write_book).parameters
+    kwargs = {}
+    for arg in sys.argv[2:]:
+        name, sep, value = arg.partition('=')
+        if name not in defaults or name == 'basedir':
+            sys.exit('Unknown argument "%s"' % name)
+        # convert to the type of the default value
+        default = defaults[name].default
+        kwargs[name] = bool(int(value)) if isinstance(default, bool) \
+            else type(default)(value)
+    os.makedirs(sys.argv[1], exist_ok=True)
+    print(write_book(sys.argv[1], **kwargs))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Time to first paint of the table of contents.
+
+    Usage: python3 -m bench.tocpaint [NCX...]
+
+    Shows the navMap of NCX files in a tree view, either filling the whole
+    Gtk.TreeStore with a GObject per row (the former way) or lazily with a
+    NavTree, and measures the time until the view is first drawn.  Each
+    measurement runs in a fresh interpreter, and needs a display. """
+
+import os
+import sys
+import tempfile
+import time
+
+from bench import run_isolated, format_size
+from bench.synth import write_ncx
+
+
+def first_paint(ncxfile, lazy):
+    import gi
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import GLib
+    from gi.repository import GObject
+    from gi.repository import Gtk
+
+    from daisy.navigationcontrol import NavigationControl
+    from gdr.navtree import NavTree
+
+    class Container(GObject.Object):
+        def __init__(self, obj):
+            self.obj = obj
+            super().__init__()
+
+    nav_map = NavigationControl(ncxfile, streaming=True).nav_map()
+
+    window = Gtk.Window()
+    scrolled = Gtk.ScrolledWindow()
+    window.add(scrolled)
+    window.set_default_size(400, 600)
+    store = Gtk.TreeStore(str, int if lazy else GObject.Object)
+    view = Gtk.TreeView(model=store)
+    view.append_column(Gtk.TreeViewColumn('label', Gtk.CellRendererText(),
+                                          text=0))
+    scrolled.add(view)
+    window.show_all()
+    # let the window settle before measuring
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+
+    loop = GLib.MainLoop()
+    painted = []
+
+    def on_draw(widget, cr):
+        if not painted:
+            painted.append(time.perf_counter())
+            GLib.idle_add(loop.quit)
+        return False
+
+    view.connect_after('draw', on_draw)
+    start = time.perf_counter()
+    if lazy:
+        NavTree(view, store).set_roots(nav_map)
+    else:
+        def add(points, parent):
+            for point in points:
+                it = store.append(parent, (point.labels[0].text,
+                                           Container(point)))
+                add(point, it)
+        add(nav_map, None)
+    populated = time.perf_counter()
+    view.queue_draw()
+    loop.run()
+    return [populated - start, painted[0] - start]
+
+
+def compare(ncxfile, entries=None):
+    print('%s (%s%s):' % (os.path.basename(ncxfile),
+                          format_size(os.path.getsize(ncxfile)),
+                          ', %d entries' % entries if entries else ''))
+    for lazy in (False, True):
+        r = run_isolated('bench.tocpaint', 'first_paint', ncxfile, lazy)
+        populate, paint = r['result']
+        print('  %-6s populate %8.1fms  first paint %8.1fms  '
+              'peak RSS %10s' %
+              ('lazy' if lazy else 'eager', populate * 1e3, paint * 1e3,
+               format_size(r['maxrss'])))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            compare(arg)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for points in (1000, 5000, 20000, 50000):
+                path = os.path.join(tmpdir, 'toc%d.ncx' % points)
+                write_ncx(path, points=points, depth=3)
+                compare(path, points)
@@ -0,0 +1,70 @@
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Cost of tracing, disabled and enabled.
+
+    Usage: python3 -m bench.trace
+
+    Times spans, begin()/end() pairs and events in a loop, against the same
+    loop without any tracing.  Disabled tracing should only cost a function
+    call, and enabled tracing should stay around a microsecond. """
+
+from bench import timeit
+from daisy import trace
+
+
+COUNT = 100000
+
+
+def bare():
+    for i in range(COUNT):
+        pass
+
+
+def spans():
+    for i in range(COUNT):
+        with trace.span('span', i=i):
+            pass
+
+
+def pairs():
+    for i in range(COUNT):
+        trace.end('pair', trace.begin(), i=i)
+
+
+def events():
+    for i in range(COUNT):
+        trace.event('event', i=i)
+
+
+if __name__ == '__main__':
+    base = timeit(bare)
+    results = {}
+    for on in (False, True):
+        trace.enable(on)
+        for func in (spans, pairs, events):
+            trace.clear()
+            elapsed = timeit(func)
+            cost = (elapsed - base) / COUNT
+            results[(on, func.__name__)] = cost
+            print('%-8s %-6s %7.3fµs per call' %
+                  ('enabled' if on else 'disabled', func.__name__,
+                   cost * 1e6))
+    trace.enable(False)
+    trace.clear()
+
+    assert max(v for k, v in results.items() if not k[0]) < 1e-6, \
+        'disabled tracing is too expensive'
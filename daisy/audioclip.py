@@ -16,10 +16,85 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+from array import array
 from datetime import timedelta
 
 
+# SMIL 2.0 clock values, as used by Z39.86.  DAISY 2.02 also prefixes them
+# with "npt=" (and some producers write "ntp=")
+_CLOCK_RE = re.compile(r'''
+    \s*(?:n(?:pt|tp)=)?
+    (?:
+        # full or partial clock value
+        (?:(?P<hours>[0-9]+):)?(?P<minutes>[0-5][0-9]):
+        (?P<seconds>[0-5][0-9](?:\.[0-9]+)?)
+    |
+        # timecount value
+        (?P<count>[0-9]+(?:\.[0-9]+)?)(?P<metric>h|min|s|ms)?
+    )\s*''', re.VERBOSE)
+
+_METRICS = {None: 1, 'h': 3600, 'min': 60, 's': 1, 'ms': 0.001}
+
+# Fast paths for whole sequences using a single format, the most common
+# case.  They are matched against the values joined with newlines.
+_ALL_FULL_CLOCKS_RE = re.compile(r'(?:[0-9]+:[0-5][0-9]:[0-5][0-9](?:\.[0-9]+)?\n)*')
+_ALL_SECONDS_RE = re.compile(r'(?:[0-9]+(?:\.[0-9]+)?s\n)*')
+
+
+def parse_smil_time(time):
+    """ Parses a SMIL clock value and returns it in seconds, or None if it
+        is not valid """
+    m = _CLOCK_RE.fullmatch(time)
+    if not m:
+        return None
+    hours, minutes, seconds, count, metric = m.groups()
+    if count is not None:
+        return float(count) * _METRICS[metric]
+    return (int(hours) * 3600 if hours else 0) + int(minutes) * 60 + float(seconds)
+
+
+def parse_smil_times(times):
+    """ Parses a sequence of SMIL clock values into an array('d') of seconds.
+        Invalid values are represented as NaN. """
+
+    text = '\n'.join(times) + '\n'
+    # a value holding a newline would be split by the fast paths
+    fast = text.count('\n') == len(times)
+    if fast and _ALL_FULL_CLOCKS_RE.fullmatch(text):
+        # clips usually begin where the previous one ended, so consecutive
+        # values are often the same
+        result = array('d')
+        append = result.append
+        previous = value = None
+        for time in times:
+            if time != previous:
+                hours, minutes, seconds = time.split(':')
+                value = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+                previous = time
+            append(value)
+        return result
+    if fast and _ALL_SECONDS_RE.fullmatch(text):
+        return array('d', [float(time[:-1]) for time in times])
+
+    # mixed formats: many values are repeated
+    nan = float('nan')
+    cache = {}
+    result = array('d')
+    append = result.append
+    for time in times:
+        value = cache.get(time)
+        if value is None:
+            value = parse_smil_time(time)
+            if value is None:
+                value = nan
+            cache[time] = value
+        append(value)
+    return result
+
+
 class AudioClip:
+    __slots__ = ('begin', 'end', 'src')
+
     def __init__(self, begin, end, src):
         def ensure_time(v):
             return self.parse_smil_time(v) if isinstance(v, str) else v
@@ -28,13 +103,195 @@ class AudioClip:
         self.end = ensure_time(end)
         self.src = src
 
-    # FIXME: isn't there any better way to do that?
-    @staticmethod
-    def parse_smil_time(time):
-        m = re.match(r'(?:ntp=)?(?:(?:([0-9]+):)?([0-9]+):)?([0-9]+(?:[.][0-9]+)?)', time)
-        if not m:
-            return None
-        return int(m.group(1)) * 60 * 60 + int(m.group(2)) * 60 + float(m.group(3))
+    parse_smil_time = staticmethod(parse_smil_time)
 
     def __repr__(self):
         return f'{type(self)}{{begin={timedelta(seconds=self.begin)} end={timedelta(seconds=self.end)} src={self.src} {super().__repr__()}}}'
+
+
+class ClipView:
+    """ A lightweight view on a clip of a ClipTable, usable wherever an
+        AudioClip is expected """
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def begin(self):
+        return self.table.begins[self.index]
+
+    @property
+    def end(self):
+        return self.table.ends[self.index]
+
+    @property
+    def src(self):
+        return self.table.srcs[self.table.src_ids[self.index]]
+
+    def __eq__(self, other):
+        if isinstance(other, ClipView):
+            return self.table is other.table and self.index == other.index
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((id(self.table), self.index))
+
+    def __repr__(self):
+        return f'{type(self)}{{begin={timedelta(seconds=self.begin)} end={timedelta(seconds=self.end)} src={self.src} index={self.index}}}'
+
+
+class ClipTable:
+    """ A compact, columnar storage for large amounts of clips.
+
+        Begin and end times are stored in array('d') columns and sources
+        are interned: each clip only stores the index of its source in
+        @srcs.  The columns support the buffer protocol, so they can be
+        wrapped without copy, e.g. with numpy.frombuffer(). """
+
+    def __init__(self):
+        self.srcs = []
+        self._src_index = {}
+        self.src_ids = array('I')
+        self.begins = array('d')
+        self.ends = array('d')
+
+    def intern(self, src):
+        """ Returns the index of @src in @srcs, adding it if needed """
+        src_id = self._src_index.get(src)
+        if src_id is None:
+            src_id = len(self.srcs)
+            self.srcs.append(src)
+            self._src_index[src] = src_id
+        return src_id
+
+    def src_id(self, src):
+        """ Returns the index of @src in @srcs, or None """
+        return self._src_index.get(src)
+
+    def append(self, begin, end, src):
+        """ Appends a clip and returns its index.  @begin and @end can be
+            SMIL clock values or numbers of seconds. """
+        if isinstance(begin, str):
+            begin = parse_smil_time(begin)
+        if isinstance(end, str):
+            end = parse_smil_time(end)
+        self.src_ids.append(self.intern(src))
+        self.begins.append(begin)
+        self.ends.append(end)
+        return len(self.begins) - 1
+
+    def extend(self, clips):
+        """ Appends each clip of @clips, AudioClips or (begin, end, src)
+            tuples """
+        for clip in clips:
+            if isinstance(clip, tuple):
+                self.append(*clip)
+            else:
+                self.append(clip.begin, clip.end, clip.src)
+
+    def extend_columns(self, begins, ends, srcs):
+        """ Appends clips given as three parallel sequences.  @begins and
+            @ends can be sequences of SMIL clock values, parsed in bulk. """
+        if begins and isinstance(begins[0], str):
+            begins = parse_smil_times(begins)
+        if ends and isinstance(ends[0], str):
+            ends = parse_smil_times(ends)
+        if not len(begins) == len(ends) == len(srcs):
+            raise ValueError('columns have different lengths')
+        intern = self.intern
+        self.src_ids.extend(intern(src) for src in srcs)
+        self.begins.extend(begins)
+        self.ends.extend(ends)
+
+    def __len__(self):
+        return len(self.begins)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.begins)
+        if not 0 <= index < len(self.begins):
+            raise IndexError('clip index out of range')
+        return ClipView(self, index)
+
+    def __iter__(self):
+        for i in range(len(self.begins)):
+            yield ClipView(self, i)
+
+    def __repr__(self):
+        return f'{type(self)}{{{len(self)} clips, {len(self.srcs)} sources}}'
+
+
+# basic test
+if __name__ == '__main__':
+    from math import isnan
+
+    corpus = (
+        # full clock values
+        ('02:30:03', 9003),
+        ('50:00:10.25', 180010.25),
+        ('0:00:00', 0),
+        ('0:00:01.5', 1.5),
+        ('123:59:59.999', 123 * 3600 + 59 * 60 + 59.999),
+        # partial clock values
+        ('02:33', 153),
+        ('00:10.5', 10.5),
+        ('59:59', 3599),
+        # timecount values
+        ('3.2h', 11520),
+        ('45min', 2700),
+        ('30s', 30),
+        ('5ms', 0.005),
+        ('12.467', 12.467),
+        ('0', 0),
+        ('1.5min', 90),
+        ('250.5ms', 0.2505),
+        # DAISY 2.02 style
+        ('npt=3.5s', 3.5),
+        ('npt=0:01:02.5', 62.5),
+        ('ntp=12', 12),
+        # surrounding whitespace
+        (' 4s ', 4),
+        # invalid values
+        ('', None),
+        ('s', None),
+        ('1.', None),
+        ('.5s', None),
+        ('-1s', None),
+        ('1:2:3', None),
+        ('00:60', None),
+        ('00:00:60', None),
+        ('1:60:00', None),
+        ('10 s', None),
+        ('3sec', None),
+        ('1e3s', None),
+        ('inf', None),
+        ('nan', None),
+        ('0:00:01:00', None),
+        ('npt=', None),
+    )
+
+    def same(a, b):
+        if b is None:
+            return a is None or isnan(a)
+        return a is not None and abs(a - b) < 1e-9
+
+    for time, expected in corpus:
+        assert same(parse_smil_time(time), expected), (time, expected)
+
+    times = [t for t, e in corpus]
+    for value, (time, expected) in zip(parse_smil_times(times), corpus):
+        assert same(value, expected), (time, value, expected)
+
+    # fast paths
+    for times in (['0:00:01.5', '1:02:03', '10:00:00.125'],
+                  ['1.5s', '3s', '0.125s']):
+        assert list(parse_smil_times(times)) == [parse_smil_time(t)
+                                                for t in times]
+    # values holding the separator the fast paths use
+    for times in (['0:00:01\n0:00:02'], ['1s\n2s'], ['1s', '2s\n3s']):
+        assert all(isnan(v) for v in parse_smil_times(times)[-1:]), times
+
+    print('OK')
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from .package import Package
+from .navigationcontrol import NavigationControl
+from .smil import Timeline, parse_files
+from .storage import LOCAL
+from . import trace
+
+
+# kinds of the parts yielded by Book.read_parts()
+NAV = 'nav'
+SMIL = 'smil'
+
+
+class Book:
+    """ A book: its package, navigation control and timeline.  Books are
+        fully parsed, unless returned by open_progressively(). """
+
+    def __init__(self, package, navigation, timeline):
+        self.package = package
+        self.navigation = navigation
+        self.timeline = timeline
+
+    @classmethod
+    def parse(cls, opffile, validate='fast', storage=LOCAL):
+        with trace.span('opf parse', path=opffile):
+            package = Package(opffile, validate=validate, storage=storage)
+        with trace.span('ncx parse', path=package.manifest()):
+            navigation = NavigationControl(package.manifest(), streaming=True,
+                                           storage=storage)
+            # parse it all now
+            navigation.nav_map()
+        with trace.span('smil parse', files=len(package.spine())):
+            timeline = Timeline.from_files(package.spine(), storage=storage)
+        return cls(package, navigation, timeline)
+
+    @classmethod
+    def _load(cls, opffile, cache, storage):
+        if cache is None:
+            return None
+        with trace.span('book cache load', path=opffile):
+            return cache.load(opffile, storage)
+
+    @classmethod
+    def open(cls, opffile, cache=None, validate='fast', storage=LOCAL):
+        """ Opens the book @opffile from @storage, from @cache if it has an
+            up-to-date copy, otherwise parsing it and storing it in @cache """
+        book = cls._load(opffile, cache, storage)
+        if book is not None:
+            return book
+        book = cls.parse(opffile, validate=validate, storage=storage)
+        if cache is not None:
+            cache.store(opffile, book)
+        return book
+
+    @classmethod
+    def open_progressively(cls, opffile, cache=None, validate='fast',
+                           storage=LOCAL):
+        """ Opens the book @opffile from @storage like open(), but if @cache
+            has no up-to-date copy, only parses its package: the rest is read
+            with read_parts(), and storing it in @cache is up to the
+            caller """
+        book = cls._load(opffile, cache, storage)
+        if book is not None:
+            return book
+        with trace.span('opf parse', path=opffile):
+            package = Package(opffile, validate=validate, storage=storage)
+        navigation = NavigationControl(package.manifest(), streaming=True,
+                                       storage=storage)
+        return cls(package, navigation, Timeline())
+
+    def complete(self):
+        """ Returns whether the timeline has the clips of every SMIL file """
+        return len(self.timeline.files) == len(self.package.spine())
+
+    def read_parts(self, max_workers=None):
+        """ Yields the parts of the book as they are read:
+            - (NAV, item) for each top level NavPoint, then each NavList;
+            - (SMIL, (path, columns, anchors)) for each SMIL file not in the
+              timeline yet, to give to Timeline.append_file().  The timeline
+              is complete after Timeline.finish() is called on the last
+              one.
+
+            The first SMIL file comes first, so that the beginning of the
+            book can be played before the rest is read.  The navigation
+            control is complete at the end.  Can run on a worker thread, as
+            the book is not modified. """
+        storage = self.storage()
+        pending = self.package.spine()[len(self.timeline.files):]
+        if pending:
+            yield SMIL, next(parse_files(pending[:1], storage=storage))
+
+        token = trace.begin()
+        for item in self.navigation.read_items():
+            yield NAV, item
+        trace.end('ncx parse', token, path=self.package.manifest())
+
+        token = trace.begin()
+        for parsed in parse_files(pending[1:], max_workers, storage):
+            yield SMIL, parsed
+        trace.end('smil parse', token, files=len(pending))
+
+    def storage(self):
+        return self.package.storage()
+
+    def source_files(self):
+        """ Returns the files the parsed data comes from """
+        return [self.package.path(), self.package.manifest()] + \
+            self.package.spine()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" On-disk cache of parsed books.
+
+    Each book is stored in a single file named after its OPF path, holding:
+    - a header with the format version and the modification time and size
+      of every file the book was parsed from (OPF, NCX and SMIL files).
+      The entry is only used if they all are unchanged;
+    - the pickled Package and NavigationControl;
+    - the Timeline, in its columnar format.
+
+    Entries are memory-mapped when loaded, so that the timeline columns are
+    used in place.  The cache is bounded in size, least recently used
+    entries being evicted first.
+
+    The search index of a book is stored next to its entry, in a file of its
+    own as it is built later, and only depends on the NCX and DTBook
+    files. """
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+
+from .book import Book
+from .search import SearchIndex
+from .smil import Timeline
+from .storage import LOCAL
+
+
+__all__ = ['BookCache', 'default_cache_dir']
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'gdr')
+
+
+class BookCache:
+    MAGIC = b'GDRBOOK\0'
+    # to bump whenever the pickled state of Package, NavigationControl or
+    # the navigation items changes, or what parsing yields, as entries are
+    # otherwise only checked against their source files
+    VERSION = 5
+    SUFFIX = '.book'
+    SEARCH_SUFFIX = '.search'
+
+    def __init__(self, path=None, max_size=256 * 1024 * 1024):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+
+    def _entry_path(self, opffile, suffix=SUFFIX):
+        key = os.path.abspath(opffile).encode('utf-8', 'surrogateescape')
+        return os.path.join(self.path,
+                            hashlib.sha1(key).hexdigest() + suffix)
+
+    def _up_to_date(self, sources, storage):
+        for path, key in sources:
+            try:
+                if storage.stat_key(path) != key:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _remove(self, entry):
+        try:
+            os.unlink(entry)
+        except OSError:
+            pass
+
+    def _touch(self, entry):
+        # mark as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+    def _write(self, entry, write):
+        """ Atomically replaces @entry with what @write(f) writes """
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, entry)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def load(self, opffile, storage=LOCAL):
+        """ Returns the cached Book for @opffile, or None if there is no
+            up-to-date entry """
+        entry = self._entry_path(opffile)
+        try:
+            with open(entry, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            book = self._read(buf, opffile, storage)
+        except Exception:
+            # whatever is wrong with it, it's useless
+            book = None
+        if book is None:
+            self._remove(entry)
+            return None
+
+        self._touch(entry)
+        return book
+
+    def _read(self, buf, opffile, storage):
+        view = memoryview(buf)
+        header_size = len(self.MAGIC) + 8
+        if view[:len(self.MAGIC)].tobytes() != self.MAGIC:
+            return None
+        version, meta_size = struct.unpack_from('<II', view, len(self.MAGIC))
+        if version != self.VERSION:
+            return None
+        pos = header_size + meta_size
+        meta = json.loads(view[header_size:pos].tobytes().decode('utf-8'))
+
+        if meta['opf'] != os.path.abspath(opffile):
+            return None
+        if not self._up_to_date(meta['sources'], storage):
+            return None
+
+        sections = {}
+        for name, size in meta['sections']:
+            sections[name] = view[pos:pos + size]
+            pos += size
+
+        package, navigation = pickle.loads(sections['objects'])
+        timeline = Timeline.from_buffer(sections['timeline'])
+        return Book(package, navigation, timeline)
+
+    def store(self, opffile, book):
+        """ Stores @book as the entry for @opffile """
+        storage = book.package.storage()
+        sources = [[os.path.abspath(p), storage.stat_key(p)]
+                   for p in book.source_files()]
+        objects = pickle.dumps((book.package, book.navigation),
+                               protocol=pickle.HIGHEST_PROTOCOL)
+        objects += b'\0' * (-len(objects) % 8)
+
+        timeline = io.BytesIO()
+        book.timeline.save(timeline)
+        timeline = timeline.getbuffer()
+
+        meta = json.dumps({
+            'opf': os.path.abspath(opffile),
+            'sources': sources,
+            'sections': [['objects', len(objects)],
+                         ['timeline', len(timeline)]],
+        }).encode('utf-8')
+        meta += b' ' * (-len(meta) % 8)
+
+        def write(f):
+            f.write(self.MAGIC)
+            f.write(struct.pack('<II', self.VERSION, len(meta)))
+            f.write(meta)
+            f.write(objects)
+            f.write(timeline)
+
+        self._write(self._entry_path(opffile), write)
+        self.evict()
+
+    def load_search(self, opffile, storage=LOCAL):
+        """ Returns the cached SearchIndex of the book @opffile, or None if
+            there is no up-to-date one """
+        entry = self._entry_path(opffile, self.SEARCH_SUFFIX)
+        try:
+            with open(entry, 'rb') as f:
+                index = SearchIndex.from_buffer(f.read())
+        except (OSError, ValueError):
+            index = None
+        if index is None or not self._up_to_date(index.sources, storage):
+            self._remove(entry)
+            return None
+        self._touch(entry)
+        return index
+
+    def store_search(self, opffile, index):
+        """ Stores the complete SearchIndex @index of the book @opffile """
+        self._write(self._entry_path(opffile, self.SEARCH_SUFFIX), index.save)
+        self.evict()
+
+    def entries(self):
+        """ Returns a list of (path, size, last use) of the cache entries """
+        entries = []
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if entry.name.endswith((self.SUFFIX,
+                                            self.SEARCH_SUFFIX)):
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((entry.path, st.st_size, st.st_mtime))
+        except OSError:
+            pass
+        return entries
+
+    def evict(self, max_size=None):
+        """ Removes the least recently used entries until the cache is
+            within @max_size bytes (by default, its own limit) """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for path, size, last_use in sorted(entries, key=lambda e: e[2]):
+            if total <= max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        self.evict(0)
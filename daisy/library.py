@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Catalog of the books of a library.
+
+    A library is a set of root directories holding books, either as
+    directories with an OPF or as zip files.  Library.scan() walks them and
+    records the title, author and duration of each book in a SQLite
+    database, reading the books on a process pool.
+
+    Books are identified by the path of their directory or zip file, and
+    only read again if the modification time or size of their OPF (or zip
+    file) changed since the last scan.  Titles and authors are searched
+    through a full-text index, with case and diacritics folded. """
+
+import multiprocessing
+import os
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from .cache import default_cache_dir
+from .navigationcontrol import NavigationControl, normalize_label
+from .package import Package
+from .storage import LOCAL, ZipStorage
+
+
+__all__ = ['Library', 'LibraryBook', 'ScanResult']
+
+
+# below this amount of books to read, the pool startup cost is not worth it
+PARALLEL_THRESHOLD = 32
+
+# not forked, as the calling process can have threads holding locks
+_MP_CONTEXT = multiprocessing.get_context('forkserver')
+
+
+LibraryBook = namedtuple('LibraryBook', ('path', 'opf', 'title', 'author',
+                                         'duration'))
+
+ScanResult = namedtuple('ScanResult', ('read', 'unchanged', 'removed',
+                                       'failed'))
+
+
+def _find_books(root):
+    """ Yields (path, stat key file path, stat result) for each book under
+        @root.  Directories holding an OPF are not searched further. """
+    stack = [root]
+    while stack:
+        dirname = stack.pop()
+        subdirs = []
+        opf = None
+        try:
+            with os.scandir(dirname) as it:
+                for entry in it:
+                    name = entry.name
+                    if name.startswith('.'):
+                        continue
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif name.endswith('.opf') and opf is None:
+                        opf = entry
+                    elif name.endswith('.zip') and entry.is_file():
+                        yield entry.path, entry.path, entry.stat()
+        except OSError:
+            continue
+        if opf is not None:
+            yield dirname, opf.path, opf.stat()
+        else:
+            stack.extend(subdirs)
+
+
+def _read_book(path, opf):
+    """ Returns a (title, author, duration) tuple for the book @path, whose
+        OPF is @opf, or the zip file itself.  Runs in worker processes. """
+    storage = LOCAL
+    try:
+        if opf == path:
+            storage = ZipStorage(path)
+            opfs = [m for m in storage.members() if m.endswith('.opf')]
+            if not opfs:
+                raise FileNotFoundError('Cannot find OPF in "%s"' % path)
+            # the shallowest one is the most likely to be the book's
+            opf = min(opfs, key=lambda m: m.count(os.sep))
+        # only the metadata is needed, the content files don't matter
+        package = Package(opf, validate='none', storage=storage)
+        title = author = None
+        try:
+            navigation = NavigationControl(package.manifest(),
+                                           storage=storage)
+            title = navigation.title()
+            author = navigation.author()
+        except (KeyError, IndexError, OSError):
+            pass
+        return (title or package.title() or os.path.basename(path),
+                author or package.creator(), package.total_time())
+    finally:
+        if storage is not LOCAL:
+            storage.close()
+
+
+def _read_book_safe(args):
+    try:
+        return _read_book(*args), None
+    except Exception as ex:
+        return None, str(ex)
+
+
+class Library:
+    """ A catalog of books, stored in the SQLite database @path """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(default_cache_dir(), 'library.sqlite')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS books (
+                path TEXT PRIMARY KEY,
+                opf TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                title TEXT,
+                author TEXT,
+                duration REAL
+            );
+        ''')
+        try:
+            self._db.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+                    title, author, content='books', content_rowid='rowid',
+                    tokenize='unicode61 remove_diacritics 2'
+                )''')
+            self._fts = True
+        except sqlite3.OperationalError:
+            # SQLite without FTS5: fall back to scanning folded values
+            self._db.create_function('fold', 1, normalize_label,
+                                     deterministic=True)
+            self._fts = False
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+
+    def _delete(self, paths):
+        db = self._db
+        for path in paths:
+            if self._fts:
+                db.execute('''
+                    INSERT INTO books_fts(books_fts, rowid, title, author)
+                    SELECT 'delete', rowid, title, author FROM books
+                    WHERE path = ?''', (path,))
+            db.execute('DELETE FROM books WHERE path = ?', (path,))
+
+    def _insert(self, rows):
+        db = self._db
+        for row in rows:
+            cur = db.execute('''
+                INSERT INTO books (path, opf, mtime_ns, size, title, author,
+                                   duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?)''', row)
+            if self._fts:
+                db.execute('''
+                    INSERT INTO books_fts (rowid, title, author)
+                    VALUES (?, ?, ?)''', (cur.lastrowid, row[4], row[5]))
+
+    def scan(self, roots, max_workers=None, progress=None):
+        """ Updates the catalog with the books under the directories @roots,
+            and removes the ones that are not there anymore.  @progress(done,
+            total) is called as changed books are read.  Returns a
+            ScanResult. """
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                 self._db.execute('SELECT path, mtime_ns, size FROM books')}
+        roots = [os.path.abspath(r) for r in roots]
+
+        seen = set()
+        pending = []
+        for root in roots:
+            for path, opf, st in _find_books(root):
+                seen.add(path)
+                key = (st.st_mtime_ns, st.st_size)
+                if known.get(path) != key:
+                    pending.append((path, opf, key))
+
+        removed = [path for path in known if path not in seen and
+                   any(path == r or path.startswith(r + os.sep)
+                       for r in roots)]
+
+        failed = []
+        read = 0
+        work = [(path, opf) for path, opf, key in pending]
+        with self._db:
+            self._delete(removed)
+            self._delete(path for path, opf, key in pending
+                         if path in known)
+            if len(work) >= PARALLEL_THRESHOLD:
+                executor = ProcessPoolExecutor(max_workers=max_workers,
+                                               mp_context=_MP_CONTEXT)
+                results = executor.map(_read_book_safe, work, chunksize=32)
+            else:
+                executor = None
+                results = map(_read_book_safe, work)
+            try:
+                rows = []
+                for (path, opf, key), (info, error) in zip(pending, results):
+                    if error is not None:
+                        failed.append((path, error))
+                    else:
+                        rows.append((path, opf) + key + info)
+                        read += 1
+                    if len(rows) >= 256:
+                        self._insert(rows)
+                        rows = []
+                    if progress is not None:
+                        progress(read + len(failed), len(pending))
+                self._insert(rows)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+        return ScanResult(read, len(seen) - len(pending), len(removed),
+                          failed)
+
+    def books(self):
+        """ Returns all the LibraryBooks, by title """
+        return [LibraryBook(*row) for row in self._db.execute('''
+            SELECT path, opf, title, author, duration FROM books
+            ORDER BY title COLLATE NOCASE''')]
+
+    def search(self, text, limit=50):
+        """ Returns up to @limit LibraryBooks whose title or author contain
+            all the words of @text, the last one as a prefix """
+        words = normalize_label(text).split()
+        if not words:
+            return []
+        if self._fts:
+            # quote the words so that FTS5 doesn't interpret them
+            query = ' '.join('"%s"' % w.replace('"', '""') for w in words)
+            query += '*'
+            rows = self._db.execute('''
+                SELECT b.path, b.opf, b.title, b.author, b.duration
+                FROM books_fts JOIN books AS b ON b.rowid = books_fts.rowid
+                WHERE books_fts MATCH ? ORDER BY rank LIMIT ?''',
+                (query, limit))
+        else:
+            condition = ' AND '.join(
+                "fold(coalesce(title, '') || ' ' || coalesce(author, '')) "
+                "LIKE ? ESCAPE '\\'" for w in words)
+            patterns = ['%' + w.replace('\\', '\\\\').replace('%', '\\%')
+                        .replace('_', '\\_') + '%' for w in words]
+            rows = self._db.execute('''
+                SELECT path, opf, title, author, duration FROM books
+                WHERE %s ORDER BY title COLLATE NOCASE LIMIT ?''' % condition,
+                patterns + [limit])
+        return [LibraryBook(*row) for row in rows]
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import zipfile
+
+    # basic test
+    with tempfile.TemporaryDirectory() as tmpdir:
+        books = os.path.join(tmpdir, 'books')
+        os.makedirs(os.path.join(books, 'a', 'sub'))
+        opf = os.path.join(books, 'a', 'book.opf')
+        with open(opf, 'w') as f:
+            f.write('<package xmlns="http://openebook.org/namespaces/'
+                    'oeb-package/1.0/"><metadata><dc-metadata '
+                    'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                    '<dc:Title>Les Misérables</dc:Title>'
+                    '<dc:Creator>Victor Hugo</dc:Creator></dc-metadata>'
+                    '<x-metadata><meta name="dtb:totalTime" '
+                    'content="12:00:00"/></x-metadata></metadata>'
+                    '<manifest/></package>')
+        with zipfile.ZipFile(os.path.join(books, 'b.zip'), 'w') as zf:
+            with open(opf) as f:
+                zf.writestr('b/book.opf', f.read().replace(
+                    'Les Misérables', 'Notre-Dame de Paris'))
+        library = Library(os.path.join(tmpdir, 'library.sqlite'))
+        assert library.scan([books]) == (2, 0, 0, [])
+        assert [b.title for b in library.search('hugo')] == \
+            ['Les Misérables', 'Notre-Dame de Paris']
+        assert [b.title for b in library.search('MISERA')] == \
+            ['Les Misérables']
+        assert library.search('notre dame')[0].duration == 12 * 3600
+        assert library.scan([books]) == (0, 2, 0, [])
+        os.unlink(os.path.join(books, 'b.zip'))
+        assert library.scan([books]) == (0, 1, 1, [])
+        assert library.search('notre') == [] and len(library) == 1
+        library.close()
+
+    if len(sys.argv) > 1:
+        library = Library()
+        print(library.scan(sys.argv[1:])[:3])
+        for book in library.books():
+            print('%s: %s (%s)' % (book.author, book.title, book.path))
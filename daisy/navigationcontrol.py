@@ -18,18 +18,44 @@
 # http://www.daisy.org/z3986/2005/Z3986-2005.html#NCX
 
 import os
+import unicodedata
+from bisect import bisect_left
 from lxml import etree
 from .audioclip import AudioClip
+from .storage import LOCAL
+from .xpath import XPathRegistry
 
 
-def _xpath(node, path, namespaces=None, **kwargs):
-    nslist = {'ncx': 'http://www.daisy.org/z3986/2005/ncx/'}
-    if namespaces:
-        nslist.update(namespaces)
-    return node.xpath(path, namespaces=nslist, **kwargs)
+NCX_NS = 'http://www.daisy.org/z3986/2005/ncx/'
+
+
+def _tag(name):
+    return '{%s}%s' % (NCX_NS, name)
+
+
+_xpath = XPathRegistry({'ncx': NCX_NS})
+
+_NAV_LABEL = _tag('navLabel')
+_NAV_POINT = _tag('navPoint')
+_NAV_TARGET = _tag('navTarget')
+_CONTENT = _tag('content')
+_TEXT = _tag('text')
+_AUDIO = _tag('audio')
+_IMG = _tag('img')
+
+
+def normalize_label(text):
+    """ Folds @text for matching: case and diacritics are removed, and
+        white space is collapsed """
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
 
 
 class Audio(AudioClip):
+    __slots__ = ('id', 'cls')
+
     @property
     def clipBegin(self):
         return self.begin
@@ -39,12 +65,11 @@ class Audio(AudioClip):
         return self.end
 
     def __init__(self, node):
-        begin = node.get('clipBegin')
-        end = node.get('clipEnd')
-        src = node.get('src')
-        self.id = node.get('id', None)
-        self.cls = node.get('class', None)
-        super().__init__(begin, end, src)
+        attrib = node.attrib
+        self.id = attrib.get('id')
+        self.cls = attrib.get('class')
+        super().__init__(attrib.get('clipBegin'), attrib.get('clipEnd'),
+                         attrib.get('src'))
 
     def __str__(self):
         return f'<audio clipBegin="{self.begin}" clipEnd="{self.end}" src="{self.src}" />'
@@ -52,9 +77,10 @@ class Audio(AudioClip):
 
 class Img:
     def __init__(self, node):
-        self.id = node.get('id', None)
-        self.cls = node.get('class', None)
-        self.src = node.get('src')
+        attrib = node.attrib
+        self.id = attrib.get('id')
+        self.cls = attrib.get('class')
+        self.src = attrib.get('src')
 
     def __str__(self):
         return f'<img id="{self.id}" class="{self.cls}" src="{self.src}" />'
@@ -65,25 +91,64 @@ class NavLabel:
         self.lang = node.get('xml:lang', None)
         self.dir = node.get('dir', None)
         # FIXME: text is optional if audio is provided
-        self.text = _xpath(node, './ncx:text/text()')[0]
-
-        nodes = _xpath(node, './ncx:audio')
-        self.audio = Audio(nodes[0]) if nodes else None
-
-        nodes = _xpath(node, './ncx:img')
-        self.img = Img(nodes[0]) if nodes else None
+        self.text = None
+        self.audio = None
+        self.img = None
+
+        for child in node:
+            tag = child.tag
+            if tag == _TEXT:
+                if self.text is None:
+                    self.text = child.text
+            elif tag == _AUDIO:
+                if self.audio is None:
+                    self.audio = Audio(child)
+            elif tag == _IMG:
+                if self.img is None:
+                    self.img = Img(child)
+
+
+def _read_children(node, child_tag, child_type, labels, children):
+    """ Reads the navLabels, content and @child_tag children of @node in a
+        single pass.  If @labels or @children are not None, they are used
+        instead of reading the corresponding nodes. """
+
+    read_labels = labels is None
+    read_children = children is None and child_tag is not None
+    if read_labels:
+        labels = []
+    if read_children:
+        children = []
+    content = None
+
+    for child in node:
+        tag = child.tag
+        if tag == _NAV_LABEL:
+            if read_labels:
+                labels.append(NavLabel(child))
+        elif tag == _CONTENT:
+            if content is None:
+                content = child.get('src')
+        elif tag == child_tag:
+            if read_children:
+                children.append(child_type(child))
+
+    return labels, content, children
 
 
 class NavPoint(list):
-    def __init__(self, node):
-        self.id = node.get('id')
-        self.play_order = int(node.get('playOrder'))
-
-        self.labels = [NavLabel(l) for l in _xpath(node, './ncx:navLabel')]
-        self.content = _xpath(node, './ncx:content/@src')[0]
-
-        for child in _xpath(node, './ncx:navPoint'):
-            self.append(NavPoint(child))
+    def __init__(self, node, labels=None, children=None):
+        attrib = node.attrib
+        self.id = attrib.get('id')
+        self.play_order = int(attrib.get('playOrder'))
+
+        self.labels, self.content, children = _read_children(node, _NAV_POINT,
+                                                             NavPoint, labels,
+                                                             children)
+        if self.content is None:
+            raise ValueError('navPoint "%s" has no content' % self.id)
+
+        self.extend(children)
         self.sort(key=lambda p: p.play_order)
 
     def __repr__(self):
@@ -91,13 +156,14 @@ class NavPoint(list):
 
 
 class NavMap(list):
-    def __init__(self, node):
+    def __init__(self, node, labels=None, children=None):
         self.id = node.get('id', None)
 
         # TODO: navInfo
-        self.labels = [NavLabel(l) for l in _xpath(node, './ncx:navLabel')]
-        for point in _xpath(node, './ncx:navPoint'):
-            self.append(NavPoint(point))
+        self.labels, content, children = _read_children(node, _NAV_POINT,
+                                                        NavPoint, labels,
+                                                        children)
+        self.extend(children)
         self.sort(key=lambda p: p.play_order)
 
     def __repr__(self):
@@ -105,56 +171,274 @@ class NavMap(list):
 
 
 class NavTarget:
-    def __init__(self, node):
-        self.id = node.get('id')
-        self.value = int(node.get('value', -1))
-        self.cls = node.get('class', None)
-        self.play_order = int(node.get('playOrder'))
-
-        self.labels = [NavLabel(l) for l in _xpath(node, './ncx:navLabel')]
-        self.content = _xpath(node, './ncx:content/@src')[0]
+    def __init__(self, node, labels=None):
+        attrib = node.attrib
+        self.id = attrib.get('id')
+        self.value = int(attrib.get('value', -1))
+        self.cls = attrib.get('class')
+        self.play_order = int(attrib.get('playOrder'))
+
+        self.labels, self.content, children = _read_children(node, None, None,
+                                                             labels, ())
+        if self.content is None:
+            raise ValueError('navTarget "%s" has no content' % self.id)
 
     def __repr__(self):
         return f'{type(self)}{{{self.id} {repr(self.labels[0].text)} {super().__repr__()}}}'
 
 
 class NavList(list):
-    def __init__(self, node):
+    """ A list of NavTargets.  Targets can be looked up by value, ID and
+        label in constant time, and searched by label prefix, through an
+        index built on first use. """
+
+    def __init__(self, node, labels=None, children=None):
         self.id = node.get('id', None)
 
         # TODO: navInfo
-        self.labels = [NavLabel(l) for l in _xpath(node, './ncx:navLabel')]
-        for target in _xpath(node, './ncx:navTarget'):
-            self.append(NavTarget(target))
+        self.labels, content, children = _read_children(node, _NAV_TARGET,
+                                                        NavTarget, labels,
+                                                        children)
+        self.extend(children)
         self.sort(key=lambda p: p.play_order)
+        self._index = None
+
+    def __getstate__(self):
+        # the index is cheap to rebuild
+        state = self.__dict__.copy()
+        state['_index'] = None
+        return state
+
+    def _ensure_index(self):
+        if self._index is None:
+            by_value = {}
+            by_id = {}
+            by_label = {}
+            labels = []
+            for i, target in enumerate(self):
+                by_value.setdefault(target.value, target)
+                by_id.setdefault(target.id, target)
+                for label in target.labels:
+                    if label.text:
+                        key = normalize_label(label.text)
+                        by_label.setdefault(key, target)
+                        labels.append((key, i))
+            labels.sort()
+            self._index = (by_value, by_id, by_label, labels)
+        return self._index
+
+    def by_value(self, value):
+        """ Returns the first target of value @value, or None """
+        return self._ensure_index()[0].get(value)
+
+    def by_id(self, target_id):
+        return self._ensure_index()[1].get(target_id)
+
+    def by_label(self, label):
+        """ Returns the first target labeled @label (compared normalized), or
+            None """
+        return self._ensure_index()[2].get(normalize_label(label))
+
+    def lookup(self, text):
+        """ Returns the target the user input @text designates, by label,
+            value or ID, or None """
+        target = self.by_label(text)
+        if target is None:
+            try:
+                target = self.by_value(int(text))
+            except ValueError:
+                pass
+        if target is None:
+            target = self.by_id(text.strip())
+        return target
+
+    def search(self, prefix, limit=10):
+        """ Returns up to @limit targets whose label starts with @prefix,
+            ordered by label """
+        labels = self._ensure_index()[3]
+        prefix = normalize_label(prefix)
+        results = []
+        seen = set()
+        for i in range(bisect_left(labels, (prefix, -1)), len(labels)):
+            key, index = labels[i]
+            if not key.startswith(prefix) or len(results) >= limit:
+                break
+            if index not in seen:
+                seen.add(index)
+                results.append(self[index])
+        return results
 
     def __repr__(self):
         return f'{type(self)}{{{self.id} {repr(self.labels[0].text) if self.labels else None} {super().__repr__()}}}'
 
 
+def _release(elem):
+    """ Drops an element that has been fully consumed during iterparse() """
+    elem.clear()
+    parent = elem.getparent()
+    if parent is not None:
+        parent.remove(elem)
+
+
 class NavigationControl:
+    """ Reads an NCX file.
+
+        In streaming mode the file is read in a single iterparse() pass the
+        first time any of its data is requested, and the XML nodes are
+        released as soon as the corresponding objects are built, so that only
+        the resulting Python objects are kept in memory.  Otherwise the whole
+        document is loaded upfront and queried as needed. """
+
+    _CONTAINERS = (_tag('navMap'), _NAV_POINT, _tag('navList'), _NAV_TARGET)
+    _TAGS = _CONTAINERS + (_NAV_LABEL, _tag('docTitle'), _tag('docAuthor'))
+
     def _xpath(self, path, node=None, namespaces=None, **kwargs):
         if node is None:
             node = self._tree
         return _xpath(node, path, namespaces=namespaces, **kwargs)
 
-    def __init__(self, ncxfile, basedir=None):
+    def __init__(self, ncxfile, basedir=None, streaming=False,
+                 storage=LOCAL):
         self._basedir = basedir or os.path.dirname(ncxfile)
-        self._tree = etree.parse(ncxfile)
+        self._ncxfile = ncxfile
+        self._storage = storage
+        self._tree = None
+        self._parsed = False
+        self._title = None
+        self._author = None
+        self._nav_map = None
+        self._nav_lists = None
+        if not streaming:
+            with storage.open(ncxfile) as f:
+                self._tree = etree.parse(f)
         # ~ print(etree.tostring(self._tree,
                              # ~ pretty_print=True, encoding='unicode'))
 
+    def _parse_stream(self):
+        for item in self._iter_stream():
+            pass
+
+    def _iter_stream(self):
+        """ Parses the file, yielding the top level NavPoints and the
+            NavLists as soon as they are read """
+        # each open container gets a frame of (labels, children)
+        frames = []
+        # and its tag
+        tags = []
+        nav_lists = []
+
+        with self._storage.open(self._ncxfile) as f:
+            for event, elem in etree.iterparse(f, events=('start', 'end'),
+                                               tag=self._TAGS):
+                tag = elem.tag
+                if event == 'start':
+                    if tag in self._CONTAINERS:
+                        frames.append(([], []))
+                        tags.append(tag)
+                    continue
+
+                item = None
+                if tag == _NAV_LABEL:
+                    if frames:
+                        frames[-1][0].append(NavLabel(elem))
+                elif tag == _NAV_POINT:
+                    labels, children = frames.pop()
+                    tags.pop()
+                    point = NavPoint(elem, labels, children)
+                    frames[-1][1].append(point)
+                    if tags[-1] == _tag('navMap'):
+                        item = point
+                elif tag == _NAV_TARGET:
+                    labels, children = frames.pop()
+                    tags.pop()
+                    frames[-1][1].append(NavTarget(elem, labels))
+                elif tag == _tag('navMap'):
+                    labels, children = frames.pop()
+                    tags.pop()
+                    self._nav_map = NavMap(elem, labels, children)
+                elif tag == _tag('navList'):
+                    labels, children = frames.pop()
+                    tags.pop()
+                    item = NavList(elem, labels, children)
+                    nav_lists.append(item)
+                elif tag == _tag('docTitle'):
+                    self._title = elem.findtext(_TEXT)
+                elif tag == _tag('docAuthor'):
+                    self._author = elem.findtext(_TEXT)
+                _release(elem)
+                if item is not None:
+                    yield item
+
+        self._nav_lists = nav_lists
+        self._parsed = True
+
+    def __getstate__(self):
+        # only keep the parsed data, not the tree
+        state = self.__dict__.copy()
+        state.update(_tree=None, _parsed=True, _title=self.title(),
+                     _author=self.author(), _nav_map=self.nav_map(),
+                     _nav_lists=self.nav_lists())
+        return state
+
+    def _ensure_parsed(self):
+        if not self._parsed and self._tree is None:
+            self._parse_stream()
+
+    def read_items(self):
+        """ Yields the top level NavPoints, in document order, then the
+            NavLists.  In streaming mode, if the file is not parsed yet, it
+            is parsed along, and items are yielded as soon as they are read.
+            Other methods must not be called before the end in that case:
+            it is only parsed then. """
+        if self._parsed or self._tree is not None:
+            yield from self.nav_map()
+            yield from self.nav_lists()
+        else:
+            yield from self._iter_stream()
+
     def basedir(self):
         return self._basedir
 
     def title(self):
+        if self._tree is None:
+            self._ensure_parsed()
+            return self._title
         return self._xpath('/ncx:ncx/ncx:docTitle/ncx:text/text()')[0]
 
     def author(self):
+        if self._tree is None:
+            self._ensure_parsed()
+            return self._author
         return self._xpath('/ncx:ncx/ncx:docAuthor/ncx:text/text()')[0]
 
     def nav_map(self):
-        return NavMap(self._xpath('/ncx:ncx/ncx:navMap')[0])
+        self._ensure_parsed()
+        if self._nav_map is None:
+            self._nav_map = NavMap(self._xpath('/ncx:ncx/ncx:navMap')[0])
+        return self._nav_map
 
     def nav_lists(self):
-        return [NavList(l) for l in self._xpath('/ncx:ncx/ncx:navList')]
+        self._ensure_parsed()
+        if self._nav_lists is None:
+            self._nav_lists = [NavList(l)
+                               for l in self._xpath('/ncx:ncx/ncx:navList')]
+        return self._nav_lists
+
+    def find_target(self, text):
+        """ Returns the first NavTarget of the nav lists designated by the
+            user input @text (see NavList.lookup()), or None """
+        for nav_list in self.nav_lists():
+            target = nav_list.lookup(text)
+            if target is not None:
+                return target
+        return None
+
+    def search_targets(self, prefix, limit=10):
+        """ Returns up to @limit NavTargets whose label starts with @prefix,
+            from all nav lists """
+        results = []
+        for nav_list in self.nav_lists():
+            results.extend(nav_list.search(prefix, limit - len(results)))
+            if len(results) >= limit:
+                break
+        return results
@@ -16,44 +16,117 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+from collections import namedtuple
 from lxml import etree
+from .audioclip import parse_smil_time
+from .xpath import XPathRegistry
+from .storage import LOCAL
+from .validation import ManifestError, validate_items
+
+
+_xpath = XPathRegistry({
+    'oeb': 'http://openebook.org/namespaces/oeb-package/1.0/',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+})
+
+
+ManifestItem = namedtuple('ManifestItem', ('id', 'href', 'media_type', 'path'))
 
 
 class Package:
     def _xpath(self, path, namespaces=None, **kwargs):
-        nslist = {'oeb': 'http://openebook.org/namespaces/oeb-package/1.0/'}
-        if namespaces:
-            nslist.update(namespaces)
-        return self._tree.xpath(path, namespaces=nslist, **kwargs)
+        return _xpath(self._tree, path, namespaces=namespaces, **kwargs)
 
-    def __init__(self, opffile, basedir=None):
+    def __init__(self, opffile, basedir=None, validate='fast',
+                 storage=LOCAL):
+        self._path = opffile
         self._basedir = basedir or os.path.dirname(opffile)
-        self._tree = etree.parse(opffile)
+        self._storage = storage
+        with storage.open(opffile) as f:
+            self._tree = etree.parse(f)
         # ~ print(etree.tostring(self._tree,
                              # ~ pretty_print=True, encoding='unicode'))
         self._id = self._xpath('oeb:package/@unique-identifier')
-        self._check_manifest()
+        self._spine = None
+        self._read_metadata()
+        self._index_manifest()
+        self.validation = self._check_manifest(validate)
+
+    def __getstate__(self):
+        # the tree is not needed anymore once everything is indexed
+        state = self.__dict__.copy()
+        state['_spine'] = self.spine()
+        state['_tree'] = None
+        return state
+
+    def _read_metadata(self):
+        def first(path):
+            values = self._xpath(path)
+            return values[0].strip() if values else None
+
+        metadata = '/oeb:package/oeb:metadata/'
+        self._title = first(metadata + 'oeb:dc-metadata/dc:Title/text()')
+        self._creator = first(metadata + 'oeb:dc-metadata/dc:Creator/text()')
+        total_time = first(metadata + 'oeb:x-metadata/'
+                           'oeb:meta[@name="dtb:totalTime"]/@content')
+        self._total_time = parse_smil_time(total_time) if total_time \
+            else None
+
+    def _index_manifest(self):
+        self._items = {}
+        for item in self._xpath('/oeb:package/oeb:manifest/oeb:item'):
+            attrib = item.attrib
+            href = attrib.get('href', 'MISSING')
+            item_id = attrib.get('id')
+            self._items[item_id] = ManifestItem(item_id, href,
+                                                attrib.get('media-type'),
+                                                os.path.join(self._basedir,
+                                                             href))
+
+    def _check_manifest(self, level):
+        result = validate_items(self._items.values(), level,
+                                storage=self._storage)
+        if not result:
+            raise ManifestError(result)
+        return result
+
+    def path(self):
+        return self._path
+
+    def storage(self):
+        return self._storage
+
+    def title(self):
+        """ Returns the dc:Title of the book, or None """
+        return self._title
+
+    def creator(self):
+        """ Returns the first dc:Creator of the book, or None """
+        return self._creator
+
+    def total_time(self):
+        """ Returns the dtb:totalTime of the book in seconds, or None """
+        return self._total_time
+
+    def items(self):
+        """ Returns the manifest items, in document order """
+        return self._items.values()
 
-    def _check_manifest(self):
-        items = self._xpath('/oeb:package/oeb:manifest/oeb:item')
-        for item in items:
-            item_path = os.path.join(self._basedir,
-                                     item.get('href', 'MISSING'))
-            assert os.path.exists(item_path)
+    def item(self, item_id):
+        """ Returns the manifest item with ID @item_id """
+        return self._items[item_id]
 
     def manifest(self):
-        return os.path.join(self._basedir,
-            self._xpath('/oeb:package/oeb:manifest/oeb:item[@id="ncx"]/@href')[0])
+        return self._items['ncx'].path
 
     def resource(self):
-        return os.path.join(self._basedir,
-            self._xpath('/oeb:package/oeb:manifest/oeb:item[@id="resource"]/@href')[0])
+        return self._items['resource'].path
 
     def spine(self):
-        return [
-            os.path.join(self._basedir, self._xpath(
-                '/oeb:package/oeb:manifest/oeb:item[@id="%s"]/@href' % idref
-                )[0])
-            for idref in self._xpath(
-                '/oeb:package/oeb:spine/oeb:itemref/@idref')
-        ]
+        if self._spine is None:
+            self._spine = [
+                self._items[idref].path
+                for idref in self._xpath(
+                    '/oeb:package/oeb:spine/oeb:itemref/@idref')
+            ]
+        return self._spine
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Reverse lookup from a playback position to the navigation structure.
+
+    A playback position is an audio file and a time in it.  It is mapped
+    to a timeline clip through a per-file interval index, and the clip to
+    the NavPoint and NavTargets covering it through sorted start indices.
+    Lookups are bisections on arrays, and PositionTracker.locate() only
+    updates the tracker in place, so that it can be polled often. """
+
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+
+
+__all__ = ['ClipIndex', 'NavIndex', 'PositionTracker']
+
+
+class ClipIndex:
+    """ Maps (audio file, time) to a timeline clip index """
+
+    def __init__(self, timeline):
+        clips = timeline.clips
+        by_src = defaultdict(list)
+        for i, src_id in enumerate(clips.src_ids):
+            by_src[src_id].append(i)
+
+        self._files = {}
+        for src_id, indices in by_src.items():
+            indices.sort(key=clips.begins.__getitem__)
+            self._files[clips.srcs[src_id]] = (
+                array('d', (clips.begins[i] for i in indices)),
+                array('d', (clips.ends[i] for i in indices)),
+                array('I', indices),
+            )
+
+    def lookup(self, src, time):
+        """ Returns the index of the clip playing @src at @time, or -1 """
+        entry = self._files.get(src)
+        if entry is None:
+            return -1
+        begins, ends, indices = entry
+        i = bisect_right(begins, time) - 1
+        # clips without a clipEnd (NaN) extend to the next one
+        if i < 0 or time >= ends[i]:
+            return -1
+        return indices[i]
+
+
+class NavIndex:
+    """ Maps a timeline clip index to the last navigation entry starting at
+        or before it """
+
+    def __init__(self, timeline, entries, basedir=''):
+        """ @entries is an iterable of objects with a 'content' reference,
+            such as NavPoints or NavTargets """
+        resolved = []
+        for order, entry in enumerate(entries):
+            index = timeline.resolve(entry.content, basedir)
+            if index is not None:
+                resolved.append((index, order, entry))
+        resolved.sort(key=lambda r: r[:2])
+        self._starts = array('I', (r[0] for r in resolved))
+        self.entries = [r[2] for r in resolved]
+
+    def lookup(self, clip_index):
+        """ Returns the position in @entries of the entry covering
+            @clip_index, or -1 """
+        return bisect_right(self._starts, clip_index) - 1
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def _walk(points):
+    for point in points:
+        yield point
+        yield from _walk(point)
+
+
+class PositionTracker:
+    """ Tracks the current clip, NavPoint and NavTarget of each NavList
+
+        After a successful locate() call, @clip is the current clip index,
+        @nav_point the current NavPoint and @targets[i] the current target of
+        the i-th NavList (each of those can be None). """
+
+    __slots__ = ('_timeline', '_clips', '_points', '_lists', '_src', '_begin',
+                 '_end', 'clip', 'nav_point', 'targets')
+
+    def __init__(self, timeline, nav_map, nav_lists, basedir=''):
+        self._timeline = timeline
+        self._clips = ClipIndex(timeline)
+        self._points = NavIndex(timeline, _walk(nav_map), basedir)
+        self._lists = [NavIndex(timeline, l, basedir) for l in nav_lists]
+        self._src = None
+        self._begin = self._end = 0.0
+        self.clip = -1
+        self.nav_point = None
+        self.targets = [None] * len(self._lists)
+
+    def locate(self, src, time):
+        """ Updates the tracker for the position @time in @src.  Returns
+            whether the current clip changed. """
+
+        # fast path: still in the same clip
+        if src == self._src and self._begin <= time < self._end:
+            return False
+
+        clip = self._clips.lookup(src, time)
+        if clip == self.clip:
+            return False
+
+        self.clip = clip
+        if clip < 0:
+            self._src = None
+            return True
+
+        clips = self._timeline.clips
+        self._src = src
+        self._begin = clips.begins[clip]
+        self._end = clips.ends[clip]
+
+        i = self._points.lookup(clip)
+        self.nav_point = self._points.entries[i] if i >= 0 else None
+        targets = self.targets
+        for n, nav_index in enumerate(self._lists):
+            i = nav_index.lookup(clip)
+            targets[n] = nav_index.entries[i] if i >= 0 else None
+
+        return True
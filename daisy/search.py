@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Full-text search over a book.
+
+    The searched documents are the labels of the navigation entries and the
+    text of the DTBook files.  DTBook text is split at the elements the SMIL
+    files reference, so that each document maps to the clip reading it.
+
+    Text is folded like navigation labels (see normalize_label()) and split
+    into words.  The index maps each word to the sorted array of the
+    documents containing it, so a query is an intersection of those.  The
+    last word of a query also matches as a prefix, for search as you type.
+
+    Documents are added by batches, so that the index can be queried while
+    an IndexBuilder fills it on a background thread. """
+
+import json
+import os
+import re
+import struct
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from functools import lru_cache
+from lxml import etree
+
+from .navigationcontrol import normalize_label
+from . import trace
+
+
+__all__ = ['Hit', 'SearchIndex', 'IndexBuilder', 'build_index',
+           'dtbook_files', 'NAV', 'TEXT']
+
+
+DTBOOK_MEDIA_TYPE = 'application/x-dtbook+xml'
+
+# document kinds
+NAV = 0
+TEXT = 1
+
+# length of the text kept to show a hit
+SNIPPET_LENGTH = 80
+
+_WORD = re.compile(r'\w+')
+
+
+Hit = namedtuple('Hit', ('kind', 'ref', 'text'))
+Hit.__doc__ = """ A search result: a navigation label or a DTBook element.
+    @ref is the absolute content reference for the former, the absolute
+    "path#id" of the element for the latter.  @text is the beginning of
+    its text. """
+
+
+@lru_cache(maxsize=65536)
+def _fold(word):
+    # decomposition can split a word, e.g. "½" gives "1⁄2"
+    return _WORD.findall(normalize_label(word))
+
+
+def _words(text):
+    """ Returns the folded words of @text, in order """
+    # folding each distinct word only once is a lot faster than folding
+    # the text, as there are much fewer words than occurrences
+    if not text.isascii():
+        text = unicodedata.normalize('NFC', text)
+    return [w for word in _WORD.findall(text) for w in _fold(word)]
+
+
+def _snippet(text):
+    text = ' '.join(text.split())
+    if len(text) > SNIPPET_LENGTH:
+        text = text[:SNIPPET_LENGTH - 1] + '…'
+    return text
+
+
+def _absolute_ref(ref, basedir):
+    path, sep, fragment = ref.partition('#')
+    path = os.path.normpath(os.path.abspath(os.path.join(basedir, path)))
+    return path + sep + fragment
+
+
+def text_clips(timeline):
+    """ Returns a dict of absolute text references ("path#id") to the index
+        of the first clip of @timeline reading them """
+    refs = {}
+    texts = timeline.texts
+    text_ids = timeline.text_ids
+    count = len(timeline)
+    starts = list(timeline.file_starts) + [count]
+    for f, path in enumerate(timeline.files):
+        basedir = os.path.dirname(path)
+        for i in range(starts[f], starts[f + 1]):
+            text_id = text_ids[i]
+            if text_id >= 0:
+                ref = _absolute_ref(texts[text_id], basedir)
+                refs.setdefault(ref, i)
+    return refs
+
+
+def dtbook_files(package):
+    """ Returns the paths of the DTBook files of @package """
+    return [item.path for item in package.items()
+            if item.media_type == DTBOOK_MEDIA_TYPE]
+
+
+class SearchIndex:
+    """ An inverted index of the words of a book's documents """
+
+    MAGIC = b'GDRSERCH'
+    VERSION = 1
+
+    def __init__(self):
+        self.documents = []
+        # [path, stat key] of the files the documents come from
+        self.sources = []
+        self.complete = False
+        # word: sorted document indices
+        self._postings = {}
+        # sorted words, for prefix matches.  None when outdated.
+        self._words = None
+        self._text_clips = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, documents):
+        """ Adds @documents, a list of (kind, ref, text) """
+        tokenized = [(Hit(kind, ref, _snippet(text)), set(_words(text)))
+                     for kind, ref, text in documents]
+        with self._lock:
+            postings = self._postings
+            for hit, words in tokenized:
+                doc = len(self.documents)
+                self.documents.append(hit)
+                for word in words:
+                    column = postings.get(word)
+                    if column is None:
+                        postings[word] = array('I', (doc,))
+                        self._words = None
+                    else:
+                        column.append(doc)
+
+    def _matching(self, prefix):
+        """ Returns the postings of all the words starting with @prefix """
+        if self._words is None:
+            self._words = sorted(self._postings)
+        words = self._words
+        postings = self._postings
+        matches = []
+        for i in range(bisect_left(words, prefix), len(words)):
+            if not words[i].startswith(prefix):
+                break
+            matches.append(postings[words[i]])
+        return matches
+
+    def search(self, query, limit=50):
+        """ Returns up to @limit Hits containing all the words of @query, in
+            book order, navigation labels first.  The last word matches as a
+            prefix unless @query ends with a space. """
+        words = _words(query)
+        if not words:
+            return []
+        prefix = None
+        if not query[-1].isspace():
+            prefix = words.pop()
+
+        with self._lock:
+            columns = []
+            for word in words:
+                column = self._postings.get(word)
+                if column is None:
+                    return []
+                columns.append(column)
+            columns.sort(key=len)
+
+            if columns:
+                docs = set(columns[0])
+                for column in columns[1:]:
+                    docs.intersection_update(column)
+            if prefix is not None:
+                matched = set()
+                for column in self._matching(prefix):
+                    matched.update(column)
+                docs = docs & matched if columns else matched
+            documents = self.documents
+            return [documents[d] for d in sorted(docs)[:limit]]
+
+    def resolve(self, hit, timeline):
+        """ Returns the index of the clip of @timeline to play @hit from, or
+            None """
+        if hit.kind == NAV:
+            return timeline.resolve(hit.ref)
+        if self._text_clips is None:
+            self._text_clips = text_clips(timeline)
+        return self._text_clips.get(hit.ref)
+
+    def save(self, f):
+        """ Writes the complete index to the binary file object @f """
+        with self._lock:
+            words = sorted(self._postings)
+            columns = [self._postings[w] for w in words]
+            meta = json.dumps({
+                'sources': self.sources,
+                'documents': self.documents,
+                'words': words,
+                'counts': [len(c) for c in columns],
+            }).encode('utf-8')
+        meta += b' ' * (-len(meta) % 8)
+        f.write(self.MAGIC)
+        f.write(struct.pack('<II', self.VERSION, len(meta)))
+        f.write(meta)
+        for column in columns:
+            f.write(column)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """ Creates an index from data written by save().  Postings are
+            read-only views on @buffer.  Raises ValueError if the data is
+            not a valid index. """
+        view = memoryview(buffer)
+        header_size = len(cls.MAGIC) + 8
+        if len(view) < header_size or \
+                view[:len(cls.MAGIC)].tobytes() != cls.MAGIC:
+            raise ValueError('not a search index')
+        version, meta_size = struct.unpack_from('<II', view, len(cls.MAGIC))
+        if version != cls.VERSION:
+            raise ValueError('unsupported search index version %d' % version)
+        pos = header_size + meta_size
+        meta = json.loads(view[header_size:pos].tobytes().decode('utf-8'))
+
+        index = cls()
+        index.sources = meta['sources']
+        index.documents = [Hit(*d) for d in meta['documents']]
+        postings = view[pos:].cast('B')
+        if len(postings) != sum(meta['counts']) * 4:
+            raise ValueError('truncated search index')
+        postings = postings.cast('I')
+        pos = 0
+        for word, count in zip(meta['words'], meta['counts']):
+            index._postings[word] = postings[pos:pos + count]
+            pos += count
+        index._words = meta['words']
+        index.complete = True
+        return index
+
+
+def _walk(entries):
+    for entry in entries:
+        yield entry
+        if isinstance(entry, list):
+            yield from _walk(entry)
+
+
+def _nav_documents(navigation):
+    basedir = navigation.basedir()
+    for entry in _walk([navigation.nav_map()] + navigation.nav_lists()):
+        content = getattr(entry, 'content', None)
+        if not content:
+            continue
+        text = ' '.join(l.text for l in entry.labels if l.text)
+        if text:
+            yield NAV, _absolute_ref(content, basedir), text
+
+
+def _dtbook_documents(path, storage, anchors):
+    """ Yields the (TEXT, ref, text) documents of the DTBook @path, one per
+        element with an ID in @anchors.  The text of nested anchors only
+        belongs to them. """
+    depth = 0
+    with storage.open(path) as f:
+        for event, elem in etree.iterparse(f, events=('start', 'end')):
+            elem_id = elem.get('id')
+            is_anchor = elem_id is not None and elem_id in anchors
+            if event == 'start':
+                depth += is_anchor
+                continue
+            if is_anchor:
+                depth -= 1
+                text = ''.join(elem.itertext())
+                # the enclosing anchor needs the tail, but not the text
+                tail = elem.tail
+                elem.clear()
+                elem.tail = tail
+                if text.strip():
+                    yield TEXT, path + '#' + elem_id, text
+            elif not depth:
+                # outside any anchor, nothing will be needed anymore
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+
+def build_index(book, index=None, batch=500, cancelled=None):
+    """ Indexes the navigation labels and DTBook text of @book into @index,
+        a new SearchIndex by default, by batches of @batch documents.
+        Stops early if @cancelled() becomes true.  Returns the index. """
+    if index is None:
+        index = SearchIndex()
+    storage = book.storage()
+    navigation = book.navigation
+    files = [book.package.manifest()] + dtbook_files(book.package)
+    index.sources = [[os.path.abspath(p), storage.stat_key(p)]
+                     for p in files]
+
+    def batches(documents):
+        pending = []
+        for document in documents:
+            pending.append(document)
+            if len(pending) >= batch:
+                yield pending
+                pending = []
+        yield pending
+
+    sources = [_nav_documents(navigation)]
+    refs = text_clips(book.timeline)
+    for path in files[1:]:
+        path = os.path.normpath(os.path.abspath(path))
+        prefix = path + '#'
+        anchors = {r[len(prefix):] for r in refs if r.startswith(prefix)}
+        if anchors:
+            sources.append(_dtbook_documents(path, storage, anchors))
+
+    for documents in sources:
+        for pending in batches(documents):
+            if cancelled is not None and cancelled():
+                return index
+            index.add(pending)
+    index._text_clips = refs
+    index.complete = True
+    return index
+
+
+class IndexBuilder(threading.Thread):
+    """ Loads the SearchIndex of a book from a BookCache, or builds it, on a
+        background thread.  @index can be queried while it is being built.
+        @on_done(index) is called from the thread when it is complete. """
+
+    def __init__(self, book, cache=None, on_done=None):
+        super().__init__(name='search index', daemon=True)
+        self.index = SearchIndex()
+        self._book = book
+        self._cache = cache
+        self._on_done = on_done
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as ex:
+            # e.g. a malformed DTBook, or the storage closed meanwhile
+            trace.warning('Failed to index %s: %s' %
+                          (self._book.package.path(), ex))
+
+    def _run(self):
+        opffile = self._book.package.path()
+        storage = self._book.storage()
+        index = None
+        if self._cache is not None:
+            index = self._cache.load_search(opffile, storage)
+        if index is not None:
+            self.index = index
+        else:
+            index = build_index(self._book, self.index,
+                                cancelled=lambda: self._cancelled)
+            if not index.complete:
+                return
+            if self._cache is not None:
+                self._cache.store_search(opffile, index)
+        if self._on_done is not None and not self._cancelled:
+            self._on_done(index)
+
+
+# basic test
+if __name__ == '__main__':
+    import io
+
+    index = SearchIndex()
+    index.add([(NAV, '/b/c.smil#a', 'Chapitre Premier'),
+               (TEXT, '/b/t.xml#p1', 'Il était une fois, un éléphant.'),
+               (TEXT, '/b/t.xml#p2', 'Une ELEPHANTE et un ours')])
+    assert [h.ref for h in index.search('elephant ')] == ['/b/t.xml#p1']
+    assert [h.ref for h in index.search('ÉLÉPHANT')] == \
+        ['/b/t.xml#p1', '/b/t.xml#p2']
+    assert [h.ref for h in index.search('une ours')] == ['/b/t.xml#p2']
+    assert [h.ref for h in index.search('chap')] == ['/b/c.smil#a']
+    assert index.search('zebra') == [] and index.search('  ') == []
+
+    f = io.BytesIO()
+    index.save(f)
+    loaded = SearchIndex.from_buffer(f.getvalue())
+    for query in ('eleph', 'une ours', 'chapitre ', 'il'):
+        assert loaded.search(query) == index.search(query), query
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# http://www.daisy.org/z3986/2005/Z3986-2005.html#SMIL
+
+""" SMIL parsing into a book-wide timeline.
+
+    Each SMIL file of the spine is streamed, and its audio clips are
+    appended in playback order to a single ClipTable.  Every clip gets an
+    offset on the book timeline, and the ids of the SMIL elements map to the
+    first clip they contain, so that a NavPoint content reference like
+    "content.smil#id" resolves to a clip with a single dict lookup. """
+
+import json
+import multiprocessing
+import os
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from lxml import etree
+
+from .audioclip import ClipTable, parse_smil_times
+from .storage import LOCAL
+
+
+__all__ = ['Timeline', 'parse_files']
+
+
+# below this amount of SMIL files, the pool startup cost is not worth it
+PARALLEL_THRESHOLD = 32
+
+# workers are not forked from the calling process, which can have threads
+# holding locks (GLib, storage, trace) that would never be released in them
+_MP_CONTEXT = multiprocessing.get_context('forkserver')
+
+_PAR = 'par'
+_AUDIO = 'audio'
+_TEXT = 'text'
+
+
+def _localname(tag):
+    # DAISY 2.02 SMIL files have no namespace, Z39.86 ones do
+    return tag.rpartition('}')[2]
+
+
+def _parse_smil(path, storage=LOCAL):
+    """ Parses the SMIL file @path from @storage.  Returns a tuple of
+        columns for its audio clips (srcs, begins, ends, texts) and a list of
+        (id, clip index) anchors, all relative to the file.  Runs in worker
+        processes. """
+
+    with storage.open(path) as f:
+        return _parse_smil_events(etree.iterparse(f, events=('start', 'end')),
+                                  os.path.dirname(path))
+
+
+def _parse_smil_events(events, basedir):
+    # clips of a file usually share a handful of sources
+    resolved = {}
+    srcs = []
+    begins = []
+    ends = []
+    texts = []
+    anchors = []
+    # first clip and text reference of each open par
+    pars = []
+
+    for event, elem in events:
+        if not isinstance(elem.tag, str):
+            continue
+        name = _localname(elem.tag)
+        if event == 'start':
+            elem_id = elem.get('id')
+            if elem_id is not None:
+                if pars and name == _TEXT:
+                    # the text of a par can come after its audio
+                    anchors.append((elem_id, pars[-1][0]))
+                else:
+                    anchors.append((elem_id, len(srcs)))
+            if name == _PAR:
+                pars.append([len(srcs), None])
+            continue
+
+        if name == _AUDIO:
+            attrib = elem.attrib
+            src = attrib.get('src')
+            src_path = resolved.get(src)
+            if src_path is None:
+                src_path = os.path.normpath(os.path.join(basedir, src))
+                resolved[src] = src_path
+            srcs.append(src_path)
+            begins.append(attrib.get('clipBegin', '0s'))
+            ends.append(attrib.get('clipEnd', ''))
+            texts.append(pars[-1][1] if pars else None)
+        elif name == _TEXT:
+            if pars:
+                pars[-1][1] = elem.get('src')
+        elif name == _PAR:
+            start, text = pars.pop()
+            if text is not None:
+                # clips that came before the text
+                for i in range(start, len(texts)):
+                    if texts[i] is None:
+                        texts[i] = text
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    return (srcs, parse_smil_times(begins), parse_smil_times(ends), texts), \
+        anchors
+
+
+def parse_files(smil_files, max_workers=None, storage=LOCAL):
+    """ Parses @smil_files from @storage, on a process pool if there are
+        many of them, and yields a (path, columns, anchors) tuple for each,
+        in order, to give to Timeline.append_file() """
+    if len(smil_files) < PARALLEL_THRESHOLD:
+        for path in smil_files:
+            yield (path,) + _parse_smil(path, storage)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=max_workers,
+                                   mp_context=_MP_CONTEXT)
+    try:
+        results = executor.map(_parse_smil, smil_files, repeat(storage),
+                               chunksize=16)
+        for path, result in zip(smil_files, results):
+            yield (path,) + result
+    finally:
+        # doesn't parse the remaining files if iteration stopped early
+        executor.shutdown(cancel_futures=True)
+
+
+class Timeline:
+    """ The audio clips of a whole book, in playback order.
+
+        - @clips is a ClipTable of all the clips.  Sources are normalized
+          absolute paths.
+        - @offsets[i] is the position of clip i on the book timeline.
+        - @files are the SMIL files, and @file_starts[i] the index of the
+          first clip of file i.
+        - @texts are the text references, and @text_ids[i] the index of the
+          text of clip i, or -1.
+
+        Clips without a clipEnd are considered to be empty, as their actual
+        duration depends on the audio file. """
+
+    MAGIC = b'GDRTLINE'
+    VERSION = 1
+
+    def __init__(self):
+        self.clips = ClipTable()
+        self.offsets = array('d')
+        self.files = []
+        self.file_starts = array('I')
+        self.texts = []
+        self._text_index = {}
+        self.text_ids = array('i')
+        self._anchors = {}
+        self.duration = 0.0
+
+    @classmethod
+    def from_files(cls, smil_files, max_workers=None, storage=LOCAL):
+        """ Parses @smil_files from @storage, in order, on a process pool if
+            there are many of them """
+        timeline = cls()
+        for parsed in parse_files(smil_files, max_workers, storage):
+            timeline.append_file(*parsed)
+        timeline.finish()
+        return timeline
+
+    def _intern_text(self, text):
+        if text is None:
+            return -1
+        text_id = self._text_index.get(text)
+        if text_id is None:
+            text_id = len(self.texts)
+            self.texts.append(text)
+            self._text_index[text] = text_id
+        return text_id
+
+    def append_file(self, path, columns, anchors):
+        """ Appends the clips of the SMIL file @path, as parsed by
+            parse_files().  finish() has to be called after the last one. """
+        srcs, begins, ends, texts = columns
+        path = os.path.normpath(os.path.abspath(path))
+        first = len(self.clips)
+
+        self.files.append(path)
+        self.file_starts.append(first)
+        self.clips.extend_columns(begins, ends, srcs)
+        self.text_ids.extend(self._intern_text(t) for t in texts)
+
+        offset = self.duration
+        offsets = self.offsets
+        for begin, end in zip(begins, ends):
+            offsets.append(offset)
+            if end > begin:  # NaN compares false
+                offset += end - begin
+        self.duration = offset
+
+        self._anchors[path] = first
+        for elem_id, index in anchors:
+            self._anchors[path + '#' + elem_id] = first + index
+
+    def finish(self):
+        # anchors after the last clip point to the last clip
+        last = len(self.clips) - 1
+        if last >= 0:
+            for key, index in self._anchors.items():
+                if index > last:
+                    self._anchors[key] = last
+
+    def __len__(self):
+        return len(self.clips)
+
+    def resolve(self, ref, basedir=''):
+        """ Returns the index of the first clip of the SMIL reference @ref
+            (e.g. a NavPoint content), relative to @basedir, or None """
+        path, sep, fragment = ref.partition('#')
+        key = os.path.normpath(os.path.abspath(os.path.join(basedir, path)))
+        if fragment:
+            key += '#' + fragment
+        index = self._anchors.get(key)
+        if index is None or index >= len(self.clips):
+            return None
+        return index
+
+    def clip(self, index):
+        return self.clips[index]
+
+    def offset(self, index):
+        return self.offsets[index]
+
+    def open_ended(self):
+        """ Returns the set of audio files with clips lacking a clipEnd """
+        clips = self.clips
+        return {clips.srcs[clips.src_ids[i]]
+                for i, end in enumerate(clips.ends) if end != end}
+
+    def set_file_durations(self, durations):
+        """ Ends the clips lacking a clipEnd at the end of their audio file,
+            given by @durations, a dict of source to duration in seconds, and
+            updates the offsets accordingly """
+        clips = self.clips
+        ends = array('d', clips.ends)
+        for i, end in enumerate(ends):
+            if end != end:  # NaN
+                duration = durations.get(clips.srcs[clips.src_ids[i]])
+                if duration is not None:
+                    ends[i] = duration
+        clips.ends = ends
+
+        offsets = array('d')
+        offset = 0.0
+        for begin, end in zip(clips.begins, ends):
+            offsets.append(offset)
+            if end > begin:
+                offset += end - begin
+        self.offsets = offsets
+        self.duration = offset
+
+    def span(self, first, last):
+        """ Returns the duration from the start of clip @first to the start
+            of clip @last, or to the end of the book if @last is None """
+        end = self.duration if last is None else self.offsets[last]
+        return end - self.offsets[first]
+
+    def text(self, index):
+        """ Returns the text reference of clip @index, or None """
+        text_id = self.text_ids[index]
+        return self.texts[text_id] if text_id >= 0 else None
+
+    def _columns(self):
+        # 8 bytes items first so that every column stays aligned
+        return (self.clips.begins, self.clips.ends, self.offsets,
+                self.clips.src_ids, self.text_ids, self.file_starts)
+
+    def save(self, f):
+        """ Writes the timeline to the binary file object @f """
+        meta = json.dumps({
+            'count': len(self.clips),
+            'srcs': self.clips.srcs,
+            'files': self.files,
+            'texts': self.texts,
+            'anchors': self._anchors,
+            'duration': self.duration,
+        }).encode('utf-8')
+        meta += b' ' * (-len(meta) % 8)
+        f.write(self.MAGIC)
+        f.write(struct.pack('<II', self.VERSION, len(meta)))
+        f.write(meta)
+        for column in self._columns():
+            column.tofile(f)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """ Creates a timeline from data written by save().  The columns
+            are read-only views on @buffer, which is not copied: this makes
+            loading from a memory-mapped file very cheap.  Raises ValueError
+            if the data is not a valid timeline. """
+        view = memoryview(buffer)
+        header_size = len(cls.MAGIC) + 8
+        if len(view) < header_size or \
+                view[:len(cls.MAGIC)].tobytes() != cls.MAGIC:
+            raise ValueError('not a timeline')
+        version, meta_size = struct.unpack_from('<II', view, len(cls.MAGIC))
+        if version != cls.VERSION:
+            raise ValueError('unsupported timeline version %d' % version)
+        pos = header_size + meta_size
+        meta = json.loads(view[header_size:pos].tobytes().decode('utf-8'))
+
+        timeline = cls()
+        count = meta['count']
+        clips = timeline.clips
+        for src in meta['srcs']:
+            clips.intern(src)
+        timeline.files = meta['files']
+        for text in meta['texts']:
+            timeline._intern_text(text)
+        timeline._anchors = meta['anchors']
+        timeline.duration = meta['duration']
+
+        columns = []
+        for column in timeline._columns():
+            length = count if column is not timeline.file_starts \
+                else len(timeline.files)
+            size = length * column.itemsize
+            if pos + size > len(view):
+                raise ValueError('truncated timeline')
+            columns.append(view[pos:pos + size].cast(column.typecode))
+            pos += size
+        (clips.begins, clips.ends, timeline.offsets,
+         clips.src_ids, timeline.text_ids, timeline.file_starts) = columns
+        return timeline
+
+    @classmethod
+    def load(cls, f):
+        """ Reads a timeline written by save() from the binary file object
+            @f.  Raises ValueError if the data is not a valid timeline. """
+        return cls.from_buffer(f.read())
+
+
+# basic test
+if __name__ == '__main__':
+    from sys import argv
+    from datetime import timedelta
+
+    timeline = Timeline.from_files(argv[1:])
+    print('%d clips, %s' % (len(timeline),
+                            timedelta(seconds=timeline.duration)))
+    for path, start in zip(timeline.files, timeline.file_starts):
+        print('%s: clip %d at %s' % (path, start,
+                                     timedelta(seconds=timeline.offset(start))
+                                     if start < len(timeline) else '-'))
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Access to the files of a book.
+
+    A storage reads the files of a book, wherever they live.  Paths are
+    always regular absolute paths, so that they can be joined and normalized
+    with os.path as usual:
+    - FileStorage reads the local file system;
+    - ZipStorage reads a zip archive directly, without mounting it.  The
+      members of the archive "/books/b.zip" are addressed as
+      "/books/b.zip/<member name>".
+
+    The zip central directory is read once into an index.  The archive is
+    memory-mapped, and members stored without compression, which is the
+    usual case for audio, are served as zero-copy memoryview slices. """
+
+import io
+import mmap
+import os
+import re
+import struct
+import threading
+import zipfile
+import zlib
+
+
+__all__ = ['FileStorage', 'ZipStorage', 'LOCAL', 'is_remote']
+
+
+_REMOTE_FS_TYPES = {
+    'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afs', 'ncpfs', '9p',
+    'fuse.gvfsd-fuse', 'fuse.sshfs', 'fuse.rclone', 'fuse.s3fs',
+}
+_mounts = None
+
+
+def _unescape_mount_point(field):
+    """ Decodes the octal escapes of spaces & co in a /proc/self/mounts
+        @field """
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m[1], 8)), field)
+
+
+def _remote_mount_points():
+    global _mounts
+
+    if _mounts is None:
+        _mounts = []
+        try:
+            with open('/proc/self/mounts', encoding='utf-8',
+                      errors='surrogateescape') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 2 and fields[2] in _REMOTE_FS_TYPES:
+                        _mounts.append(_unescape_mount_point(fields[1]))
+        except (OSError, ValueError):
+            pass
+    return _mounts
+
+
+def is_remote(path):
+    """ Guesses whether @path lives on a file system where each access is
+        expensive """
+    path = os.path.abspath(path)
+    return any(path == m or path.startswith(m.rstrip('/') + '/')
+               for m in _remote_mount_points())
+
+
+class FileStorage:
+    """ Files of the local file system """
+
+    def open(self, path):
+        """ Opens @path for reading as a binary file object """
+        return open(path, 'rb')
+
+    def read(self, path):
+        """ Returns the content of @path as a bytes-like object """
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def size(self, path):
+        return os.stat(path).st_size
+
+    def listdir(self, dirname):
+        """ Returns the set of entry names in @dirname.  Raises OSError if it
+            cannot be listed. """
+        with os.scandir(dirname) as it:
+            return {entry.name for entry in it}
+
+    def stat_key(self, path):
+        """ Returns a value that changes whenever @path changes """
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+
+    def local_path(self, path):
+        """ Returns a local file system path for @path, or None """
+        return path
+
+    def is_remote(self, path):
+        """ Whether each access to @path is expensive """
+        return is_remote(path)
+
+
+LOCAL = FileStorage()
+
+
+class _MemberReader(io.RawIOBase):
+    """ Seekable raw file over a memoryview """
+
+    def __init__(self, view):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view = memoryview(b'')
+        super().close()
+
+
+# signature and fixed fields of a local file header
+_LOCAL_HEADER = struct.Struct('<4s22xHH')
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+
+# opened archives of the process, see ZipStorage.__reduce__()
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def _open_archive(path):
+    with _archives_lock:
+        storage = _archives.get(path)
+    return storage or ZipStorage(path)
+
+
+class ZipStorage:
+    """ Files of a zip archive """
+
+    def __init__(self, path):
+        self.root = os.path.abspath(path)
+        self._file = open(self.root, 'rb')
+        st = os.fstat(self._file.fileno())
+        self._key = [st.st_mtime_ns, st.st_size]
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        with zipfile.ZipFile(self._file) as zf:
+            self._members = {info.filename: info for info in zf.infolist()
+                             if not info.is_dir()}
+        # start offset of the data of each member, read from its local
+        # header when first needed
+        self._offsets = {}
+        self._dirs = {}
+        for name in self._members:
+            dirname, sep, basename = name.rpartition('/')
+            self._dirs.setdefault(dirname, set()).add(basename)
+            # implicit parent directories
+            while dirname:
+                dirname, sep, basename = dirname.rpartition('/')
+                self._dirs.setdefault(dirname, set()).add(basename)
+        with _archives_lock:
+            _archives.setdefault(self.root, self)
+
+    def __reduce__(self):
+        # worker processes open the archive themselves, once
+        return _open_archive, (self.root,)
+
+    def close(self):
+        """ Closes the archive.  Views returned by read() must have been
+            released. """
+        with _archives_lock:
+            if _archives.get(self.root) is self:
+                del _archives[self.root]
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # views are still in use somewhere, the map gets closed when
+            # they are released
+            pass
+        self._file.close()
+
+    def _member_name(self, path):
+        path = os.path.normpath(path)
+        if path == self.root:
+            return ''
+        if not path.startswith(self.root + os.sep):
+            raise FileNotFoundError('%s is not in %s' % (path, self.root))
+        return path[len(self.root) + 1:].replace(os.sep, '/')
+
+    def _member(self, path):
+        name = self._member_name(path)
+        info = self._members.get(name)
+        if info is None:
+            raise FileNotFoundError('No member %s in %s' % (name, self.root))
+        return info
+
+    def _data_offset(self, info):
+        offset = self._offsets.get(info.filename)
+        if offset is None:
+            start = info.header_offset
+            signature, name_len, extra_len = _LOCAL_HEADER.unpack_from(
+                self._map, start)
+            if signature != _LOCAL_SIGNATURE:
+                raise zipfile.BadZipFile('Bad local header for %s' %
+                                         info.filename)
+            offset = start + _LOCAL_HEADER.size + name_len + extra_len
+            self._offsets[info.filename] = offset
+        return offset
+
+    def members(self):
+        """ Returns the paths of all the files of the archive """
+        return [os.path.join(self.root, name) for name in self._members]
+
+    def is_stored(self, path):
+        """ Whether @path is stored without compression """
+        return self._member(path).compress_type == zipfile.ZIP_STORED
+
+    def view(self, path):
+        """ Returns a zero-copy memoryview of the stored member @path.
+            Raises ValueError if it is compressed. """
+        info = self._member(path)
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError('%s is compressed' % path)
+        if info.flag_bits & 0x1:
+            raise ValueError('%s is encrypted' % path)
+        offset = self._data_offset(info)
+        return self._view[offset:offset + info.file_size]
+
+    def read(self, path):
+        """ Returns the content of @path: a memoryview for stored members,
+            bytes otherwise """
+        info = self._member(path)
+        if info.compress_type == zipfile.ZIP_STORED:
+            return self.view(path)
+        if info.compress_type != zipfile.ZIP_DEFLATED or \
+                info.flag_bits & 0x1:
+            # let zipfile deal with anything unusual
+            with zipfile.ZipFile(self.root) as zf:
+                return zf.read(info)
+        offset = self._data_offset(info)
+        data = zlib.decompress(self._view[offset:offset + info.compress_size],
+                               -zlib.MAX_WBITS)
+        if zlib.crc32(data) != info.CRC:
+            raise zipfile.BadZipFile('Bad CRC-32 for %s' % info.filename)
+        return data
+
+    def open(self, path):
+        """ Opens @path for reading as a binary file object """
+        data = self.read(path)
+        if isinstance(data, memoryview):
+            return io.BufferedReader(_MemberReader(data))
+        return io.BytesIO(data)
+
+    def size(self, path):
+        return self._member(path).file_size
+
+    def listdir(self, dirname):
+        """ Returns the set of entry names in @dirname.  Raises OSError if it
+            is not a directory of the archive. """
+        names = self._dirs.get(self._member_name(dirname))
+        if names is None:
+            raise NotADirectoryError('No directory %s in %s' %
+                                     (dirname, self.root))
+        return set(names)
+
+    def stat_key(self, path):
+        """ Returns a value that changes whenever @path changes """
+        info = self._member(path)
+        return self._key + [info.CRC, info.file_size]
+
+    def local_path(self, path):
+        """ Returns a local file system path for @path, or None """
+        return None
+
+    def is_remote(self, path):
+        # the central directory is in memory
+        return False
+
+
+if __name__ == '__main__':
+    import pickle
+    import sys
+    import tempfile
+
+    # basic test
+    assert _unescape_mount_point('/mnt/my\\040book\\134s') == \
+        '/mnt/my book\\s'
+    assert _unescape_mount_point('/mnt/文档') == '/mnt/文档'
+    is_remote('/')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'book.zip')
+        with zipfile.ZipFile(path, 'w') as zf:
+            zf.writestr('book/a.mp3', b'\x00' * 1000, zipfile.ZIP_STORED)
+            zf.writestr('book/b.smil', b'<smil>' * 100, zipfile.ZIP_DEFLATED)
+            zf.writestr('book/sub/c.txt', b'c')
+        storage = ZipStorage(path)
+        root = os.path.join(storage.root, 'book')
+        assert storage.listdir(root) == {'a.mp3', 'b.smil', 'sub'}
+        assert storage.listdir(storage.root) == {'book'}
+        view = storage.read(os.path.join(root, 'a.mp3'))
+        assert isinstance(view, memoryview) and view == b'\x00' * 1000
+        view.release()
+        assert storage.read(os.path.join(root, 'sub/../b.smil')) == \
+            b'<smil>' * 100
+        with storage.open(os.path.join(root, 'a.mp3')) as f:
+            f.seek(990)
+            assert f.read() == b'\x00' * 10
+        with storage.open(os.path.join(root, 'b.smil')) as f:
+            assert f.read(6) == b'<smil>'
+        assert storage.size(os.path.join(root, 'b.smil')) == 600
+        try:
+            storage.read(os.path.join(root, 'missing'))
+            assert False
+        except FileNotFoundError:
+            pass
+        assert pickle.loads(pickle.dumps(storage)) is storage
+        storage.close()
+
+    for arg in sys.argv[1:]:
+        storage = ZipStorage(arg)
+        for member in storage.members():
+            print('%10d %s %s' % (storage.size(member),
+                                  'stored' if storage.is_stored(member)
+                                  else '      ',
+                                  member))
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Lightweight tracing of named spans and events.
+
+    Tracing is enabled by the GDR_TRACE environment variable.  A summary of
+    the span latencies is then printed to stderr at exit, and if the value
+    is not "1", it is the path of a Chrome trace JSON file to write as well
+    (to load in chrome://tracing or https://ui.perfetto.dev).
+
+    Records go to a fixed-size ring buffer.  Slots are claimed with an
+    itertools.count(), which is atomic, so recording takes no lock, and only
+    the last CAPACITY records are kept.  When tracing is disabled, span()
+    returns a shared no-op context manager, and begin() and end() return
+    right away.
+
+    Spans either wrap a block:
+
+        with trace.span('ncx parse', path=path):
+            ...
+
+    or run across callbacks, from begin() to end():
+
+        token = trace.begin()
+        ...
+        trace.end('archive mount', token)
+
+    warning() reports problems: they are always printed, and recorded as
+    events when tracing. """
+
+import atexit
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+
+__all__ = ['enabled', 'enable', 'span', 'begin', 'end', 'event', 'warning',
+           'records', 'clear', 'summary', 'write_chrome_trace']
+
+
+CAPACITY = 65536
+
+# phases, as in the Chrome trace format
+_COMPLETE = 'X'
+_INSTANT = 'i'
+
+_enabled = False
+_buffer = [None] * CAPACITY
+_counter = itertools.count()
+_now = time.perf_counter_ns
+_thread_id = threading.get_ident
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    """ Turns tracing on or off """
+    global _enabled
+    _enabled = on
+
+
+def _record(phase, name, start, duration, args):
+    _buffer[next(_counter) % CAPACITY] = (phase, name, start, duration,
+                                          _thread_id(), args)
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _record(_COMPLETE, self.name, self.start, _now() - self.start,
+                self.args)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """ Returns a context manager recording its block as the span @name """
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name, args)
+
+
+def begin():
+    """ Returns a token to end() a span with, or None if not tracing """
+    return _now() if _enabled else None
+
+
+def end(name, token, **args):
+    """ Records the span @name, from the begin() call that returned
+        @token """
+    if token is not None:
+        _record(_COMPLETE, name, token, _now() - token, args)
+
+
+def event(name, **args):
+    """ Records the instant event @name """
+    if _enabled:
+        _record(_INSTANT, name, _now(), 0, args)
+
+
+def warning(message, **args):
+    """ Reports the problem @message """
+    print(message, file=sys.stderr)
+    if _enabled:
+        _record(_INSTANT, 'warning', _now(), 0, dict(args, message=message))
+
+
+def records():
+    """ Returns the recorded (phase, name, start ns, duration ns, thread ID,
+        args) tuples, oldest first """
+    # the counter can only be read by advancing it, and a skipped slot is
+    # harmless
+    count = next(_counter)
+    if count <= CAPACITY:
+        recorded = _buffer[:count]
+    else:
+        start = count % CAPACITY
+        recorded = _buffer[start:] + _buffer[:start]
+    return sorted((r for r in recorded if r is not None), key=lambda r: r[2])
+
+
+def clear():
+    global _counter
+    _counter = itertools.count()
+    for i in range(CAPACITY):
+        _buffer[i] = None
+
+
+def _percentile(values, p):
+    """ Returns the nearest-rank @p percentile of the sorted @values """
+    rank = max(0, min(len(values) - 1, int(len(values) * p / 100 + 0.5) - 1))
+    return values[rank]
+
+
+def summary(file=None):
+    """ Prints the count and latency percentiles of each span to @file
+        (stderr by default) """
+    if file is None:
+        file = sys.stderr
+    durations = {}
+    for phase, name, start, duration, tid, args in records():
+        if phase == _COMPLETE:
+            durations.setdefault(name, []).append(duration / 1e6)
+    if not durations:
+        print('trace: no spans', file=file)
+        return
+    print('%-24s %6s %9s %9s %9s %9s' %
+          ('span (ms)', 'count', 'p50', 'p90', 'p99', 'max'), file=file)
+    for name, values in sorted(durations.items()):
+        values.sort()
+        print('%-24s %6d %9.2f %9.2f %9.2f %9.2f' %
+              (name, len(values), _percentile(values, 50),
+               _percentile(values, 90), _percentile(values, 99), values[-1]),
+              file=file)
+
+
+def write_chrome_trace(path):
+    """ Writes the records to @path in the Chrome trace event format """
+    pid = os.getpid()
+    events = []
+    for phase, name, start, duration, tid, args in records():
+        event = {'name': name, 'cat': 'gdr', 'ph': phase, 'pid': pid,
+                 'tid': tid, 'ts': start / 1e3, 'args': args}
+        if phase == _COMPLETE:
+            event['dur'] = duration / 1e3
+        else:
+            event['s'] = 't'
+        events.append(event)
+    with open(path, 'w', encoding='utf-8') as f:
+        # args can hold anything
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f,
+                  default=str)
+
+
+def _at_exit(path):
+    summary()
+    if path != '1':
+        try:
+            write_chrome_trace(path)
+        except OSError as ex:
+            print('Failed to write trace: %s' % ex, file=sys.stderr)
+
+
+_setting = os.environ.get('GDR_TRACE')
+if _setting:
+    enable()
+    atexit.register(_at_exit, _setting)
+
+
+# basic test
+if __name__ == '__main__':
+    import io
+    import tempfile
+
+    enable(False)
+    with span('disabled'):
+        pass
+    end('disabled', begin())
+    event('disabled')
+    assert not records()
+
+    enable()
+    for i in range(10):
+        with span('block', i=i):
+            pass
+    end('callbacks', begin(), ok=True)
+    event('instant')
+    recorded = records()
+    assert [r[1] for r in recorded] == ['block'] * 10 + ['callbacks',
+                                                         'instant']
+    assert recorded[0][5] == {'i': 0}
+
+    out = io.StringIO()
+    summary(out)
+    assert 'block' in out.getvalue() and 'callbacks' in out.getvalue()
+
+    with tempfile.NamedTemporaryFile('r', suffix='.json') as f:
+        write_chrome_trace(f.name)
+        events = json.load(f)['traceEvents']
+    assert events[0]['ph'] == 'X' and events[-1]['ph'] == 'i'
+
+    # the ring buffer keeps the most recent records
+    clear()
+    for i in range(CAPACITY + 10):
+        event('e', i=i)
+    recorded = records()
+    assert len(recorded) == CAPACITY
+    assert recorded[-1][5]['i'] == CAPACITY + 9
+    assert _percentile([1, 2, 3, 4], 50) == 2
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Manifest validation.
+
+    Rather than checking each item separately, each directory is listed
+    once and items are looked up in the listing.  On remote file systems
+    (network shares, gvfs-fuse mounts) each listing or stat is a round trip,
+    so they are run concurrently on a bounded thread pool.
+
+    Levels:
+    - 'none': no validation at all
+    - 'fast': check that every item exists
+    - 'full': also check that items are not empty """
+
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import LOCAL
+
+
+__all__ = ['LEVELS', 'ValidationResult', 'ManifestError', 'validate_items']
+
+
+LEVELS = ('none', 'fast', 'full')
+
+MAX_WORKERS = 8
+
+class ValidationResult:
+    """ Outcome of a validation: @missing and @empty are lists of the
+        offending items.  A result is true if there is no problem. """
+
+    def __init__(self, level, missing=None, empty=None):
+        self.level = level
+        self.missing = missing or []
+        self.empty = empty or []
+
+    def __bool__(self):
+        return not (self.missing or self.empty)
+
+    def __str__(self):
+        if self:
+            return 'no problem found'
+        problems = []
+        if self.missing:
+            problems.append('missing: %s' %
+                            ', '.join(i.href for i in self.missing))
+        if self.empty:
+            problems.append('empty: %s' %
+                            ', '.join(i.href for i in self.empty))
+        return '; '.join(problems)
+
+
+class ManifestError(Exception):
+    def __init__(self, result):
+        self.result = result
+        super().__init__('Invalid manifest: %s' % result)
+
+
+def validate_items(items, level='fast', max_workers=MAX_WORKERS,
+                   storage=LOCAL):
+    """ Validates @items, an iterable of objects with a 'path' and an
+        'href' attribute, such as daisy.package.ManifestItem, in @storage.
+        Returns a ValidationResult. """
+
+    def list_dir(dirname):
+        try:
+            return storage.listdir(dirname)
+        except OSError:
+            return set()
+
+    def is_empty(item):
+        try:
+            return storage.size(item.path) == 0
+        except OSError:
+            return False
+
+    if level not in LEVELS:
+        raise ValueError('Invalid validation level "%s"' % level)
+
+    result = ValidationResult(level)
+    if level == 'none':
+        return result
+
+    by_dir = defaultdict(list)
+    for item in items:
+        by_dir[os.path.dirname(os.path.normpath(item.path))].append(item)
+    remote = {d for d in by_dir if storage.is_remote(d)}
+
+    executor = None
+    if remote:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def run(func, args, is_remote):
+        if executor and is_remote:
+            return executor.map(func, args)
+        return map(func, args)
+
+    try:
+        dirs = list(by_dir)
+        listings = dict(zip(dirs, run(list_dir, dirs, bool(remote))))
+
+        present = []
+        for dirname, dir_items in by_dir.items():
+            names = listings[dirname]
+            for item in dir_items:
+                if os.path.basename(item.path) in names:
+                    present.append((item, dirname in remote))
+                else:
+                    result.missing.append(item)
+
+        if level == 'full':
+            for is_remote_item in (False, True):
+                checked = [i for i, r in present if r == is_remote_item]
+                for item, empty in zip(checked, run(is_empty, checked,
+                                                    is_remote_item)):
+                    if empty:
+                        result.empty.append(item)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    return result
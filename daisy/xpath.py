@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from lxml import etree
+
+
+class XPathRegistry:
+    """ Evaluates XPath expressions with a fixed set of namespace prefixes,
+        compiling each expression only once.
+
+        String results are plain strings, so they don't keep the whole
+        document alive. """
+
+    def __init__(self, namespaces):
+        self._namespaces = dict(namespaces)
+        self._compiled = {}
+
+    def compile(self, path, namespaces=None):
+        key = (path, tuple(sorted(namespaces.items()))) if namespaces else path
+        xpath = self._compiled.get(key)
+        if xpath is None:
+            nslist = self._namespaces
+            if namespaces:
+                nslist = dict(nslist, **namespaces)
+            xpath = etree.XPath(path, namespaces=nslist, smart_strings=False)
+            self._compiled[key] = xpath
+        return xpath
+
+    def __call__(self, node, path, namespaces=None, **kwargs):
+        return self.compile(path, namespaces)(node, **kwargs)
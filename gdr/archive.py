@@ -29,13 +29,18 @@
     which can be unmounted by anybody, not only the caller.  This means that
     there is no guarantee somebody won't just close the archive on the caller.
     Doing so would lead all operations to fail on the caller, just as if the
-    file disappeared. """
+    file disappeared.
+
+    Zip archives can be read without any mount with daisy.storage.ZipStorage
+    instead. """
 
 from gi.repository import GLib
 from gi.repository import Gio
 
+from daisy import trace
+
 
-__all__ = ['archive_open', 'archive_close']
+__all__ = ['archive_open', 'archive_open_async', 'archive_close']
 
 
 def synchronize_async(async_func, finish_func):
@@ -68,9 +73,8 @@ def synchronize_async(async_func, finish_func):
     return wrapper
 
 
-def archive_open(path):
-    """ Opens the archive @path as a GFile representing it as a directory.
-    @path must be a local path (for the moment). """
+def _archive_file(path):
+    """ Returns the GFile of the content of the archive @path """
 
     # This is crazy, but it's the only way to get it working:
     # 1. get a URI with special characters escaped.  This makes sense.
@@ -84,25 +88,63 @@ def archive_open(path):
     for i in range(2):  # WTF, seriously!??
         uri = GLib.uri_escape_string(uri, None, False)
     uri = 'archive://' + uri
-    print(uri)
+    trace.event('archive uri', uri=uri)
 
     zf = Gio.File.new_for_uri(uri)
-
     zf._was_already_mounted = False
+    return zf
+
+
+def _is_already_mounted(ex):
+    return ex.matches(GLib.quark_from_string('g-io-error-quark'),
+                      Gio.IOErrorEnum.ALREADY_MOUNTED)
+
+
+def archive_open(path):
+    """ Opens the archive @path as a GFile representing it as a directory.
+    @path must be a local path (for the moment). """
+
+    zf = _archive_file(path)
+    token = trace.begin()
     try:
         func = synchronize_async(type(zf).mount_enclosing_volume,
                                  type(zf).mount_enclosing_volume_finish)
         func(zf, Gio.MountMountFlags.NONE, None, None)
     except GLib.Error as ex:
-        if ex.matches(GLib.quark_from_string('g-io-error-quark'),
-                      Gio.IOErrorEnum.ALREADY_MOUNTED):
+        if _is_already_mounted(ex):
             zf._was_already_mounted = True
         else:
             raise
+    finally:
+        trace.end('archive mount', token, path=path)
 
     return zf
 
 
+def archive_open_async(path, callback):
+    """ Like archive_open(), but mounts the archive without blocking nor
+        running a nested main loop.  Calls @callback(GFile, None) when done,
+        or @callback(None, GLib.Error) on error. """
+
+    zf = _archive_file(path)
+    token = trace.begin()
+
+    def on_mounted(f, res):
+        try:
+            f.mount_enclosing_volume_finish(res)
+        except GLib.Error as ex:
+            if not _is_already_mounted(ex):
+                trace.end('archive mount', token, path=path, error=ex.message)
+                callback(None, ex)
+                return
+            zf._was_already_mounted = True
+        trace.end('archive mount', token, path=path)
+        callback(zf, None)
+
+    zf.mount_enclosing_volume(Gio.MountMountFlags.NONE, None, None,
+                              on_mounted)
+
+
 def archive_close(zf):
     """ cleans up after @zf """
     if not zf._was_already_mounted:
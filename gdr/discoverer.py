@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Asynchronous media duration discovery.
+
+    A single GstPbutils.Discoverer runs in asynchronous mode on the main
+    loop.  Results are kept in an in-memory LRU cache, and durations of local
+    files are also stored on disk, keyed by path, modification time and size,
+    so that VBR files don't get probed again and again. """
+
+import json
+import os
+from collections import OrderedDict
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import GLib
+from gi.repository import GObject
+from gi.repository import Gst
+
+from daisy import trace
+from daisy.cache import default_cache_dir
+
+from .gstinit import ensure_initialized
+from .membersrc import setup_source
+
+
+__all__ = ['DurationService']
+
+
+# imported along with GStreamer initialization, as it is slow to load
+GstPbutils = None
+
+
+def _local_path(uri):
+    if not uri.startswith('file:'):
+        return None
+    try:
+        return GLib.filename_from_uri(uri)[0]
+    except GLib.Error:
+        return None
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+class DurationService(GObject.Object):
+    """ Discovers media durations in the background.
+
+        Durations are in nanoseconds, Gst.CLOCK_TIME_NONE if unknown. """
+
+    __gtype_name__ = 'GdrDurationService'
+    __gsignals__ = {
+        # URI, duration
+        'discovered': (GObject.SignalFlags.RUN_FIRST, None,
+                       (str, GObject.TYPE_UINT64)),
+        # emitted when all URIs queued by discover_all() are known
+        'all-discovered': (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+
+    MEMORY_CACHE_SIZE = 1024
+    TIMEOUT = 10 * Gst.SECOND
+
+    _default = None
+
+    @classmethod
+    def get_default(cls):
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def __init__(self, cache_file=None):
+        super().__init__()
+        self._memory = OrderedDict()
+        self._cache_file = cache_file or os.path.join(default_cache_dir(),
+                                                      'durations.json')
+        self._disk = None
+        self._disk_dirty = False
+        self._save_id = 0
+        # URIs being discovered, and their trace token
+        self._pending = {}
+        self._bulk = set()
+        self._discoverer = None
+
+    def _ensure_discoverer(self):
+        if self._discoverer is None:
+            global GstPbutils
+            from gi.repository import GstPbutils
+            ensure_initialized()
+            self._discoverer = GstPbutils.Discoverer.new(self.TIMEOUT)
+            self._discoverer.connect('discovered', self._on_discovered)
+            self._discoverer.connect(
+                'source-setup', lambda discoverer, source: setup_source(source))
+            self._discoverer.start()
+        return self._discoverer
+
+    def _load_disk_cache(self):
+        if self._disk is None:
+            try:
+                with open(self._cache_file, encoding='utf-8') as f:
+                    self._disk = json.load(f)
+            except (OSError, ValueError):
+                self._disk = {}
+        return self._disk
+
+    def _save_disk_cache(self):
+        self._save_id = 0
+        if not self._disk_dirty:
+            return False
+        tmp = self._cache_file + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._disk, f)
+            os.replace(tmp, self._cache_file)
+            self._disk_dirty = False
+        except OSError as ex:
+            trace.warning('Failed to save duration cache: %s' % ex)
+        return False
+
+    def _remember(self, uri, duration):
+        self._memory[uri] = duration
+        self._memory.move_to_end(uri)
+        while len(self._memory) > self.MEMORY_CACHE_SIZE:
+            self._memory.popitem(last=False)
+
+        path = _local_path(uri)
+        key = _stat_key(path) if path else None
+        if key is not None and duration != Gst.CLOCK_TIME_NONE:
+            self._load_disk_cache()[path] = key + [duration]
+            self._disk_dirty = True
+            # batch writes
+            if self._save_id == 0:
+                self._save_id = GLib.timeout_add_seconds(
+                    2, self._save_disk_cache)
+
+    def lookup(self, uri):
+        """ Returns the known duration of @uri, or None if it has to be
+            discovered """
+        duration = self._memory.get(uri)
+        if duration is not None:
+            self._memory.move_to_end(uri)
+            return duration
+
+        path = _local_path(uri)
+        if path:
+            entry = self._load_disk_cache().get(path)
+            if entry and entry[:2] == _stat_key(path):
+                self._remember(uri, entry[2])
+                return entry[2]
+        return None
+
+    def discover_uri_async(self, uri):
+        """ Discovers @uri in the background, and emits 'discovered' when
+            done.  If the duration is already known, the signal is emitted
+            from an idle callback. """
+        duration = self.lookup(uri)
+        if duration is not None:
+            def emit_cached():
+                self._emit_discovered(uri, duration)
+                return False
+            GLib.idle_add(emit_cached)
+        elif uri not in self._pending:
+            self._pending[uri] = trace.begin()
+            self._ensure_discoverer().discover_uri_async(uri)
+
+    def discover_all(self, uris):
+        """ Discovers all @uris in the background, and emits 'all-discovered'
+            when they are all known """
+        for uri in uris:
+            if self.lookup(uri) is None:
+                self._bulk.add(uri)
+                if uri not in self._pending:
+                    self._pending[uri] = trace.begin()
+                    self._ensure_discoverer().discover_uri_async(uri)
+        if not self._bulk:
+            def emit_all_discovered():
+                self.emit('all-discovered')
+                return False
+            GLib.idle_add(emit_all_discovered)
+
+    def total_duration(self, uris):
+        """ Returns the sum of the durations of @uris, or None if any of them
+            is not known yet """
+        total = 0
+        for uri in uris:
+            duration = self.lookup(uri)
+            if duration is None or duration == Gst.CLOCK_TIME_NONE:
+                return None
+            total += duration
+        return total
+
+    def _emit_discovered(self, uri, duration):
+        self.emit('discovered', uri, duration)
+        if uri in self._bulk:
+            self._bulk.discard(uri)
+            if not self._bulk:
+                self.emit('all-discovered')
+
+    def _on_discovered(self, discoverer, info, error):
+        uri = info.get_uri()
+        trace.end('discoverer probe', self._pending.pop(uri, None), uri=uri)
+        duration = Gst.CLOCK_TIME_NONE
+        if error is None and \
+                info.get_result() == GstPbutils.DiscovererResult.OK:
+            duration = info.get_duration()
+        else:
+            trace.warning('Failed to discover media info for %s: %s' %
+                          (uri, error.message if error
+                           else info.get_result()))
+        self._remember(uri, duration)
+        self._emit_discovered(uri, duration)
+
+    def flush(self):
+        """ Writes pending cache changes to disk """
+        if self._save_id:
+            GLib.source_remove(self._save_id)
+        self._save_disk_cache()
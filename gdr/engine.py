@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Playback engine, without any UI.
+
+    The engine plays either a single clip, or a PlayQueue continuously.
+
+    Clips and runs ending before the end of their file are played with a
+    segment seek with a stop position, so that the pipeline stops exactly at
+    their end and posts a SEGMENT_DONE message.  When the next run is in the
+    same file, it is then started with a non-flushing segment seek.
+
+    When a run reaches the end of its audio file, the next file is queued
+    from playbin's "about-to-finish" signal, so that playbin prerolls it and
+    switches to it without any gap nor pipeline rebuild.
+
+    In warm mode, other file switches only bring the pipeline down to READY,
+    which keeps the audio sink open.  The time from a clip request to its
+    first audio buffer reaching the sink is recorded in the first_audio
+    histogram.
+
+    Seeks are always accurate.  Every MP3 frame is a keyframe, but the
+    parser only estimates where in the file a time is, so in VBR files
+    without a TOC a keyframe seek can land seconds away from its target:
+    there is no keyframe data telling when a cheaper seek would do. """
+
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GObject
+from gi.repository import Gst
+
+from daisy import trace
+from daisy.storage import LOCAL
+
+from .discoverer import DurationService
+from .gstinit import ensure_initialized
+from .histogram import Histogram
+from .membersrc import path_uri, setup_source
+
+
+__all__ = ['PlaybackEngine']
+
+
+class PlaybackEngine(GObject.Object):
+    __gtype_name__ = 'GdrPlaybackEngine'
+    __gsignals__ = {
+        # begin and end of the new stretch of audio, in seconds.  The end is
+        # NaN if it's the end of the file.
+        'run-changed': (GObject.SignalFlags.RUN_FIRST, None, (float, float)),
+        # playback reached the end of the clip or queue
+        'finished': (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+
+    # a run ending closer than this to the end of its file is considered to
+    # end with the file, and is chained to the next one
+    CHAIN_TOLERANCE = 0.5
+
+    # time from a clip request to its first audio, shared by all engines
+    first_audio = Histogram('time to first audio')
+
+    def __init__(self):
+        super().__init__()
+        self.queue = None
+        # whether to chain files gaplessly
+        self.gapless = True
+        # whether to keep the pipeline warm when switching files
+        self.warm = True
+        # storage the played files are read from
+        self.storage = LOCAL
+        self._uri = None
+        self._run = None
+        # stop position of the current segment, or None
+        self._segment_end = None
+        # run queued from the streaming thread, waiting for its stream start
+        self._chained = None
+        self._lock = threading.Lock()
+        self._durations = DurationService.get_default()
+        # start time of the pending clip request, and whether its new
+        # segment reached the sink
+        self._request_time = None
+        self._request_token = None
+        self._request_segment = False
+
+        ensure_initialized()
+        self.playbin = Gst.ElementFactory.make('playbin', 'playbin')
+        self.playbin.connect('about-to-finish', self._on_about_to_finish)
+        self.playbin.connect('source-setup',
+                             lambda playbin, source: setup_source(source))
+
+        # an explicit sink is kept across files instead of being rebuilt
+        self._audio_sink = Gst.ElementFactory.make('autoaudiosink',
+                                                   'audio-sink')
+        self.playbin.set_property('audio-sink', self._audio_sink)
+        self._audio_sink.get_static_pad('sink').add_probe(
+            Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+            self._on_sink_probe)
+
+        bus = self.playbin.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::stream-start', self._on_stream_start)
+        bus.connect('message::segment-done', self._on_segment_done)
+        bus.connect('message::eos', self._on_eos)
+
+    @GObject.Property(type=str)
+    def uri(self):
+        return self._uri
+
+    @uri.setter
+    def uri(self, uri):
+        if uri == self._uri:
+            return
+        with self._lock:
+            self._chained = None
+        if self.warm:
+            self.playbin.set_state(Gst.State.READY)
+        else:
+            self.playbin.set_state(Gst.State.NULL)
+        self._uri = uri
+        self.playbin.set_property('uri', uri)
+        self.playbin.set_state(Gst.State.PAUSED)
+
+    def is_playing(self):
+        ret, state, pending = self.playbin.get_state(0)
+        return Gst.State.PLAYING in (state, pending)
+
+    def _seek(self, begin, end=None, flush=True):
+        """ Seeks to @begin, stopping at @end with a SEGMENT_DONE if not
+            None.  All positions are in seconds. """
+        self._segment_end = end
+        flags = Gst.SeekFlags.ACCURATE
+        if flush:
+            flags |= Gst.SeekFlags.FLUSH
+        if end is None:
+            stop_type, stop = Gst.SeekType.NONE, Gst.CLOCK_TIME_NONE
+        else:
+            flags |= Gst.SeekFlags.SEGMENT
+            stop_type, stop = Gst.SeekType.SET, int(end * Gst.SECOND)
+        self.playbin.seek(1.0, Gst.Format.TIME, flags,
+                          Gst.SeekType.SET, int(begin * Gst.SECOND),
+                          stop_type, stop)
+
+    def seek(self, position):
+        """ Seeks to @position in the current file, keeping the current
+            clip or run end """
+        end = self._segment_end
+        if end is not None and position >= end:
+            end = None
+        self._seek(position, end)
+
+    def _file_duration(self, src):
+        duration = self._durations.lookup(path_uri(src, self.storage))
+        if duration is None or duration == Gst.CLOCK_TIME_NONE:
+            return None
+        return duration / Gst.SECOND
+
+    def _request(self):
+        """ Starts measuring the time to first audio of a clip request """
+        with self._lock:
+            self._request_time = time.perf_counter()
+            self._request_token = trace.begin()
+            self._request_segment = False
+
+    def _on_sink_probe(self, pad, info):
+        # called from a streaming thread
+        with self._lock:
+            if self._request_time is None:
+                pass
+            elif info.type & Gst.PadProbeType.BUFFER:
+                if self._request_segment:
+                    elapsed = time.perf_counter() - self._request_time
+                    self._request_time = None
+                    self.first_audio.record(elapsed * 1000)
+                    trace.end('seek to first audio', self._request_token,
+                              uri=self.uri)
+            elif info.get_event().type == Gst.EventType.SEGMENT:
+                # buffers flowing before the new segment are stale
+                self._request_segment = True
+        return Gst.PadProbeReturn.OK
+
+    def _load(self, src, begin, end):
+        playing = self.is_playing()
+        self.uri = path_uri(src, self.storage)
+        self._seek(begin, end)
+        if playing:
+            self.playbin.set_state(Gst.State.PLAYING)
+
+    def play_single(self, src, begin, end):
+        """ Loads the clip of @src from @begin to @end (in seconds) """
+        self._run = None
+        self._request()
+        # NaN ends go to the end of the file
+        self._load(src, begin, end if end == end else None)
+        self.emit('run-changed', begin, end)
+
+    def set_queue(self, queue):
+        self.queue = queue
+        self._run = None
+
+    def play_clip(self, index):
+        """ Loads the clip @index of the queue, playback continuing with the
+            next clips """
+        run = self.queue.run(self.queue.run_of(index))
+        self._request()
+        self._start(run, self.queue.timeline.clips.begins[index])
+
+    def _run_stop(self, run):
+        """ Returns the position to stop @run at, or None if it plays to the
+            end of its file """
+        if run.end != run.end:  # NaN
+            return None
+        index = run.index + 1
+        if index < len(self.queue) and self.queue.run(index).src == run.src:
+            return run.end
+        duration = self._file_duration(run.src)
+        if duration is not None and \
+                run.end >= duration - self.CHAIN_TOLERANCE:
+            return None
+        return run.end
+
+    def _start(self, run, position, flush=True):
+        self._run = run
+        if flush:
+            self._load(run.src, position, self._run_stop(run))
+        else:
+            self._seek(position, self._run_stop(run), flush=False)
+        self.emit('run-changed', run.begin, run.end)
+
+    def current_clip(self, position):
+        """ Returns the index of the queue clip playing at @position, or
+            None """
+        if self._run is None:
+            return None
+        return self.queue.clip_at(self._run, position)
+
+    def skip(self, position, delta):
+        """ Moves @delta clips away from the one playing at @position """
+        clip = self.current_clip(position)
+        if clip is None:
+            return
+        clip = min(max(clip + delta, 0), len(self.queue.timeline) - 1)
+        self.play_clip(clip)
+
+    def _finish(self):
+        end = self._segment_end
+        self._run = None
+        self._segment_end = None
+        self.playbin.set_state(Gst.State.PAUSED)
+        if end is not None:
+            # after a SEGMENT_DONE nothing flows anymore until a flushing
+            # seek: re-arm at the segment stop, so that playing again goes
+            # on from there
+            self._seek(end)
+        self.emit('finished')
+
+    def _advance(self):
+        index = self._run.index + 1
+        if index >= len(self.queue):
+            self._finish()
+            return
+        run = self.queue.run(index)
+        if run.src == self._run.src:
+            # the pipeline is still running after a SEGMENT_DONE, a
+            # non-flushing seek continues seamlessly
+            self._start(run, run.begin, flush=False)
+        else:
+            self._start(run, run.begin)
+
+    def _on_about_to_finish(self, playbin):
+        # called from a streaming thread
+        with self._lock:
+            run = self._run
+            queue = self.queue
+        if not self.gapless or run is None or queue is None:
+            return
+        index = run.index + 1
+        if index >= len(queue):
+            return
+        next_run = queue.run(index)
+        if next_run.src == run.src:
+            return
+        with self._lock:
+            self._chained = next_run
+        playbin.set_property('uri', path_uri(next_run.src, self.storage))
+
+    def _on_stream_start(self, bus, msg):
+        with self._lock:
+            run = self._chained
+            self._chained = None
+        if run is None:
+            return
+
+        self._run = run
+        self._uri = path_uri(run.src, self.storage)
+        self.notify('uri')
+        stop = self._run_stop(run)
+        if run.begin > self.queue.EPSILON or stop is not None:
+            self._seek(run.begin, stop)
+        else:
+            self._segment_end = None
+        self.emit('run-changed', run.begin, run.end)
+
+    def _on_segment_done(self, bus, msg):
+        if self._run is not None:
+            self._advance()
+        else:
+            self._finish()
+
+    def _on_eos(self, bus, msg):
+        if self._run is not None:
+            self._advance()
+        else:
+            self._finish()
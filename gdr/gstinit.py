@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Deferred GStreamer initialization.
+
+    Gst.init() loads the plugin registry, which takes a while, and even
+    longer when the registry cache is outdated and all plugins get scanned.
+    Nothing needs GStreamer before the first playback or duration
+    discovery, so the code creating elements calls ensure_initialized()
+    right before, instead of initializing GStreamer at startup.
+
+    Importing the Gst module itself is cheap, and its constants and enums
+    can be used without initialization. """
+
+import sys
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from daisy import trace
+
+
+__all__ = ['ensure_initialized']
+
+
+def ensure_initialized():
+    """ Initializes GStreamer if it isn't yet.  Must be called from the main
+        thread. """
+    if not Gst.is_initialized():
+        with trace.span('gst init'):
+            # like at startup, so that GStreamer options are honored
+            Gst.init(sys.argv)
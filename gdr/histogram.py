@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Fixed-bucket latency histogram """
+
+import threading
+from bisect import bisect_left
+
+
+__all__ = ['Histogram']
+
+
+class Histogram:
+    """ Histogram of durations in milliseconds.  Values are counted in fixed
+        buckets, so recording is cheap and memory is constant.  Recording is
+        thread-safe, as values often come from streaming threads. """
+
+    # upper bounds of the buckets, in milliseconds.  An extra bucket counts
+    # the values above the last one.
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self, name, bounds=BOUNDS):
+        self.name = name
+        self.bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def record(self, value):
+        """ Records a duration of @value milliseconds """
+        with self._lock:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        """ Returns an upper bound of the @p percentile (0-100), that is the
+            upper bound of the bucket it falls in, or the maximum value if
+            lower.  Returns None if there are no values. """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, round(self.count * p / 100))
+            seen = 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    if i < len(self.bounds):
+                        return min(self.bounds[i], self.max)
+                    return self.max
+        return self.max
+
+    def buckets(self):
+        """ Returns a list of (upper bound, count), the last upper bound
+            being infinity """
+        with self._lock:
+            return list(zip(self.bounds + (float('inf'),), self.counts))
+
+    def dump(self, file=None):
+        """ Prints the histogram to @file, or the standard output """
+        if not self.count:
+            print("%s: no values" % self.name, file=file)
+            return
+        print("%s: %d values, min %.1fms, mean %.1fms, p50 <= %.1fms, "
+              "p95 <= %.1fms, max %.1fms" %
+              (self.name, self.count, self.min, self.mean(),
+               self.percentile(50), self.percentile(95), self.max),
+              file=file)
+        peak = max(self.counts)
+        for bound, n in self.buckets():
+            if n:
+                print("  <= %6gms %6d %s" % (bound, n, '#' * (40 * n // peak)),
+                      file=file)
+
+
+if __name__ == '__main__':
+    # basic test
+    h = Histogram('test')
+    assert h.percentile(50) is None
+    for v in (0.5, 3, 3, 4, 7, 150, 20000):
+        h.record(v)
+    assert h.count == 7
+    assert h.min == 0.5 and h.max == 20000
+    assert h.percentile(50) == 5
+    assert h.percentile(100) == 20000
+    assert h.buckets()[0] == (1, 1)
+    assert h.buckets()[-1] == (float('inf'), 1)
+    h.dump()
+    h.clear()
+    assert h.count == 0
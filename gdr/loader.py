@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Progressive book loading.
+
+    A BookLoader reads the parts of a Book (see Book.read_parts()) on a
+    worker thread, and hands them over to the main thread, where they are
+    delivered in idle callbacks, each limited to BUDGET seconds so that the
+    main loop stays responsive:
+    - the top level NavPoints and the NavLists are emitted with "nav-items";
+    - the parsed SMIL files are appended to the timeline of the book, and
+      "clips-added" is emitted.  The first SMIL file is read first, so that
+      the beginning of the book can be played right away.
+
+    Once the timeline is complete, the book is stored in the cache on the
+    worker thread if it was parsed, and "finished" is emitted: the book can
+    then be used as a whole.  A complete book, e.g. from the cache, only has
+    its navigation items delivered. """
+
+import threading
+import time
+from collections import deque
+
+from gi.repository import GLib
+from gi.repository import GObject
+
+from daisy import trace
+from daisy.book import NAV, SMIL
+from daisy.navigationcontrol import NavList
+
+
+__all__ = ['BookLoader']
+
+
+# internal parts, after the ones of Book.read_parts()
+_READ = 'read'
+_FINISHED = 'finished'
+_FAILED = 'failed'
+
+
+class BookLoader(GObject.Object):
+    __gtype_name__ = 'GdrBookLoader'
+    __gsignals__ = {
+        # top level NavPoints, and NavLists, read since the last emission
+        'nav-items': (GObject.SignalFlags.RUN_FIRST, None,
+                      (GObject.TYPE_PYOBJECT, GObject.TYPE_PYOBJECT)),
+        # clips were appended to the timeline
+        'clips-added': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        # the book is complete
+        'finished': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        # an error message.  The book is left incomplete.
+        'failed': (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+    }
+
+    # main loop time spent per idle callback, in seconds
+    BUDGET = 0.004
+
+    def __init__(self, book, cache=None):
+        super().__init__()
+        self.book = book
+        self._cache = cache
+        self._parts = deque()
+        self._lock = threading.Lock()
+        self._idle_id = 0
+        self._cancelled = False
+        # set once the timeline is complete, or on cancellation
+        self._appended = threading.Event()
+        self._token = None
+        self._thread = None
+
+    def start(self):
+        self._token = trace.begin()
+        self._thread = threading.Thread(target=self._read, name='book loader',
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """ Stops loading.  No signal is emitted afterwards. """
+        with self._lock:
+            self._cancelled = True
+            self._parts.clear()
+            if self._idle_id:
+                GLib.source_remove(self._idle_id)
+                self._idle_id = 0
+        self._appended.set()
+
+    def join(self):
+        """ Waits for the worker thread to be done, e.g. after cancel(), so
+            that it doesn't read the book anymore """
+        if self._thread is not None:
+            self._thread.join()
+
+    # worker thread
+
+    def _push(self, kind, value=None):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._parts.append((kind, value))
+            if not self._idle_id:
+                self._idle_id = GLib.idle_add(self._on_idle)
+
+    def _read(self):
+        book = self.book
+        parse = not book.complete()
+        try:
+            for kind, value in book.read_parts():
+                if self._cancelled:
+                    return
+                self._push(kind, value)
+            self._push(_READ)
+            self._appended.wait()
+            if parse and self._cache is not None and not self._cancelled:
+                try:
+                    self._cache.store(book.package.path(), book)
+                except OSError as ex:
+                    trace.warning('Failed to cache book: %s' % ex)
+        except Exception as ex:
+            self._push(_FAILED, str(ex))
+        else:
+            self._push(_FINISHED)
+
+    # main thread
+
+    def _take(self):
+        """ Returns the next pending part, or None.  If there is none, the
+            idle callback is considered removed. """
+        with self._lock:
+            if self._parts:
+                return self._parts.popleft()
+            self._idle_id = 0
+            return None
+
+    def _on_idle(self):
+        try:
+            more = self._deliver(time.perf_counter() + self.BUDGET)
+        except Exception as ex:
+            self._fail(str(ex))
+            return GLib.SOURCE_REMOVE
+        # a handler might have cancelled loading
+        if not more or self._cancelled:
+            return GLib.SOURCE_REMOVE
+        return GLib.SOURCE_CONTINUE
+
+    def _fail(self, message):
+        """ Stops loading after an error on the main thread, and reports
+            it.  The worker thread must not wait for the timeline. """
+        with self._lock:
+            self._cancelled = True
+            self._parts.clear()
+            self._idle_id = 0
+        self._appended.set()
+        trace.warning('Failed to load book: %s' % message)
+        self.emit('failed', message)
+
+    def _deliver(self, deadline):
+        """ Delivers pending parts until @deadline, checked after each part
+            as a single one can be a whole SMIL file.  Returns whether parts
+            might be left. """
+        timeline = self.book.timeline
+        points = []
+        lists = []
+        clips = False
+        ends = []
+        more = True
+        while time.perf_counter() < deadline:
+            part = self._take()
+            if part is None:
+                more = False
+                break
+            kind, value = part
+            if kind == NAV:
+                (lists if isinstance(value, NavList) else points).append(value)
+            elif kind == SMIL:
+                if not timeline.files:
+                    trace.end('book load: first clips', self._token)
+                timeline.append_file(*value)
+                clips = True
+            else:
+                # these come after all the others
+                ends.append((kind, value))
+
+        # clips first so that the new navigation items resolve
+        if clips and not self._cancelled:
+            self.emit('clips-added')
+        if (points or lists) and not self._cancelled:
+            self.emit('nav-items', points, lists)
+        for kind, value in ends:
+            if kind == _READ:
+                timeline.finish()
+                self._appended.set()
+            elif self._cancelled:
+                break
+            elif kind == _FINISHED:
+                trace.end('book load', self._token)
+                self.emit('finished')
+            else:
+                self.emit('failed', value)
+        return more
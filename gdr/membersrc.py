@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Playback of files that are not on the local file system.
+
+    Files of a daisy.storage storage that have no local path, such as the
+    members of a zip archive, get an "appsrc://" URI naming them.  playbin and
+    the discoverer create an appsrc element for those, which is set up from
+    their "source-setup" signal by setup_source() to be fed straight from the
+    storage.
+
+    The appsrc is seekable, so that GStreamer can seek anywhere within the
+    member, and data is pushed in chunks from the "need-data" signal, appsrc
+    queueing at most READ_AHEAD bytes ahead of the playback. """
+
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstApp', '1.0')
+from gi.repository import GLib
+from gi.repository import Gst
+from gi.repository import GstApp
+
+from daisy import trace
+from daisy.storage import LOCAL
+
+
+__all__ = ['path_uri', 'uri_path', 'forget_storage', 'setup_source']
+
+
+_SCHEME = 'appsrc://'
+
+# storages of the appsrc URIs handed out, by root
+_storages = {}
+
+
+def path_uri(path, storage=LOCAL):
+    """ Returns a URI GStreamer can play @path of @storage from """
+    local = storage.local_path(path)
+    if local is not None:
+        return GLib.filename_to_uri(local)
+    _storages[storage.root] = storage
+    return _SCHEME + GLib.uri_escape_string(path, '/', False)
+
+
+def forget_storage(storage):
+    """ Stops serving the appsrc URIs of @storage, e.g. before closing
+        it """
+    if _storages.get(storage.root) is storage:
+        del _storages[storage.root]
+
+
+def uri_path(uri):
+    """ Returns the path of the file @uri points to, or None """
+    if uri.startswith('file:'):
+        try:
+            return GLib.filename_from_uri(uri)[0]
+        except GLib.Error:
+            return None
+    if uri.startswith(_SCHEME):
+        return GLib.uri_unescape_string(uri[len(_SCHEME):], None)
+    return None
+
+
+def _storage_of(path):
+    for root, storage in _storages.items():
+        if path.startswith(root + '/'):
+            return storage
+    return None
+
+
+class MemberFeeder:
+    """ Feeds an appsrc with the content of a file """
+
+    CHUNK = 64 * 1024
+    READ_AHEAD = 512 * 1024
+
+    def __init__(self, appsrc, data):
+        self._data = data
+        self._offset = 0
+        # the signals come from streaming threads
+        self._lock = threading.Lock()
+
+        appsrc.set_property('format', Gst.Format.BYTES)
+        appsrc.set_property('stream-type', GstApp.AppStreamType.SEEKABLE)
+        appsrc.set_property('size', len(data))
+        appsrc.set_property('max-bytes', self.READ_AHEAD)
+        appsrc.connect('need-data', self._on_need_data)
+        appsrc.connect('seek-data', self._on_seek_data)
+
+    def _on_need_data(self, appsrc, length):
+        with self._lock:
+            offset = self._offset
+            chunk = self._data[offset:offset + self.CHUNK]
+            self._offset += len(chunk)
+        if not chunk:
+            appsrc.emit('end-of-stream')
+            return
+        buf = Gst.Buffer.new_wrapped(bytes(chunk))
+        buf.offset = offset
+        appsrc.emit('push-buffer', buf)
+
+    def _on_seek_data(self, appsrc, offset):
+        if offset > len(self._data):
+            return False
+        with self._lock:
+            self._offset = offset
+        return True
+
+
+def setup_source(source):
+    """ Sets up @source if it is an appsrc created for a path_uri().  To be
+        called from the "source-setup" signal of playbin or the
+        discoverer.  Returns whether @source was set up. """
+    if not isinstance(source, GstApp.AppSrc):
+        return False
+    uri = source.get_uri()
+    path = uri_path(uri) if uri else None
+    storage = _storage_of(path) if path else None
+    if storage is None:
+        return False
+    try:
+        data = storage.read(path)
+    except OSError as ex:
+        trace.warning('Cannot read %s: %s' % (path, ex))
+        return False
+    MemberFeeder(source, data)
+    return True
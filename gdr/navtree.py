@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Lazy tree view population for navigation items.
+
+    A NavTree shows a tree of navigation items (NavPoints, NavLists and
+    NavTargets) in a Gtk.TreeView backed by a Gtk.TreeStore of a label and an
+    integer.  Only the top level rows are inserted upfront, with the model
+    detached from the view.  Rows with children get a placeholder child so
+    that they can be expanded, and their actual children are inserted when
+    the row is about to be expanded.
+
+    Rows don't hold the items themselves: the integer column is an index in a
+    Python list, so that no GObject wrapper is allocated per row.
+
+    Top level items can also be appended as they get available, with
+    append_roots(). """
+
+from gi.repository import Gtk
+
+
+__all__ = ['NavTree']
+
+
+# item index of placeholder rows
+_PLACEHOLDER = -2
+
+
+def _children(item):
+    return item if isinstance(item, list) else ()
+
+
+class NavTree:
+    """ Shows navigation items in @view, whose model is @store.  @view can
+        be None to only fill @store, rows then being populated by
+        path_of(). """
+
+    def __init__(self, view, store, children=_children):
+        self.view = view
+        self.store = store
+        self._children = children
+        self._items = []
+        self._roots = []
+        # tree path indices of each item, by object ID
+        self._paths = {}
+        if view is not None:
+            view.connect('test-expand-row', self._on_test_expand_row)
+
+    def clear(self):
+        self.store.clear()
+        self._items = []
+        self._roots = []
+        self._paths = {}
+
+    def _index_paths(self, roots, first=0):
+        """ Computes the tree path of every item without inserting rows, the
+            first root being the top level row @first """
+        stack = [((), roots, first)]
+        paths = self._paths
+        while stack:
+            parent_path, items, first = stack.pop()
+            for i, item in enumerate(items, first):
+                path = parent_path + (i,)
+                paths[id(item)] = path
+                children = self._children(item)
+                if children:
+                    stack.append((path, children, 0))
+
+    def _label(self, item):
+        return item.labels[0].text if item.labels else ''
+
+    def _append_rows(self, parent, items):
+        store = self.store
+        for item in items:
+            index = len(self._items)
+            self._items.append(item)
+            it = store.insert_with_valuesv(parent, -1, (0, 1),
+                                           (self._label(item), index))
+            if self._children(item):
+                store.insert_with_valuesv(it, -1, (0, 1),
+                                          ('', _PLACEHOLDER))
+
+    def set_roots(self, roots):
+        """ Shows the items @roots and, lazily, their children """
+        self.clear()
+        self._roots = list(roots)
+        self._index_paths(roots)
+        if self.view is None:
+            self._append_rows(None, roots)
+            return
+        # inserting with the view attached makes it update for each row
+        self.view.set_model(None)
+        try:
+            self._append_rows(None, roots)
+        finally:
+            self.view.set_model(self.store)
+
+    def append_roots(self, roots):
+        """ Shows the items @roots after the current top level ones """
+        self._index_paths(roots, len(self._roots))
+        self._roots.extend(roots)
+        self._append_rows(None, roots)
+
+    def update_roots(self, roots):
+        """ Shows the items @roots, keeping the rows if they already show
+            them in that order """
+        if len(roots) != len(self._roots) or \
+                any(a is not b for a, b in zip(roots, self._roots)):
+            self.set_roots(roots)
+
+    def _populate(self, it):
+        """ Inserts the children of the row @it if not done yet """
+        store = self.store
+        child = store.iter_children(it)
+        if child is None or store[child][1] != _PLACEHOLDER:
+            return
+        item = self._items[store[it][1]]
+        self._append_rows(it, self._children(item))
+        store.remove(child)
+
+    def _on_test_expand_row(self, view, it, path):
+        # the row is not expanded yet, so insertions are cheap
+        self._populate(it)
+        return False
+
+    def item(self, it):
+        """ Returns the item of the row @it, or None """
+        index = self.store[it][1]
+        return self._items[index] if index >= 0 else None
+
+    def item_at(self, path):
+        return self.item(self.store.get_iter(path))
+
+    def path_of(self, item):
+        """ Returns the Gtk.TreePath of @item, populating its ancestors as
+            needed, or None if it is not in the tree """
+        indices = self._paths.get(id(item))
+        if indices is None:
+            return None
+        for depth in range(1, len(indices)):
+            it = self.store.get_iter(
+                Gtk.TreePath.new_from_indices(indices[:depth]))
+            self._populate(it)
+        return Gtk.TreePath.new_from_indices(indices)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Asynchronous book opening.
+
+    A BookOpener opens a book from a GFile in stages, none of which blocks
+    the main loop:
+    - mount: archives other than zip ones are mounted through GIO, with an
+      asynchronous call;
+    - locate: the OPF is looked up, on a worker thread;
+    - parse: the book is loaded from the cache, or only its package is
+      parsed, on a worker thread;
+    - populate: the "ready" signal is emitted on the main thread so that the
+      book can be shown.  A book that is not complete yet is then read with
+      a BookLoader.
+
+    Worker results are handed back to the main thread with GLib.idle_add().
+    Several openers can run at once, sharing the same executor. """
+
+import os
+import time
+import zipfile
+
+from gi.repository import GLib
+from gi.repository import GObject
+from gi.repository import Gio
+
+from daisy import trace
+from daisy.book import Book
+from daisy.storage import LOCAL, ZipStorage
+
+from .archive import archive_open_async, archive_close
+
+
+__all__ = ['BookOpener']
+
+
+class BookOpener(GObject.Object):
+    __gtype_name__ = 'GdrBookOpener'
+    __gsignals__ = {
+        # the Book, to be shown.  The time spent in handlers is the
+        # populate stage.
+        'ready': (GObject.SignalFlags.RUN_FIRST, None,
+                  (GObject.TYPE_PYOBJECT,)),
+        # the stage that failed, and an error message
+        'failed': (GObject.SignalFlags.RUN_FIRST, None, (str, str)),
+    }
+
+    STAGES = ('mount', 'locate', 'parse', 'populate')
+
+    def __init__(self, gfile, executor, cache=None):
+        super().__init__()
+        self.file = gfile
+        # stage name: duration in seconds
+        self.timings = {}
+        # the mounted archive to close with the book, if any
+        self.mount = None
+        self._executor = executor
+        self._cache = cache
+        self._storage = LOCAL
+        self._cancelled = False
+
+    def name(self):
+        return self.file.get_basename()
+
+    def start(self):
+        self._stage_start = time.perf_counter()
+        self._stage_token = trace.begin()
+        self._run('mount', self._probe, self._on_probed)
+
+    def cancel(self):
+        """ Stops at the end of the current stage """
+        self._cancelled = True
+
+    def _run(self, stage, func, then):
+        """ Runs @func on the executor, and @then with its result back on the
+            main thread """
+        def work():
+            try:
+                result, error = func(), None
+            except Exception as ex:
+                result, error = None, ex
+            GLib.idle_add(self._on_work_done, stage, result, error, then)
+
+        self._executor.submit(work)
+
+    def _on_work_done(self, stage, result, error, then):
+        if self._cancelled:
+            # nobody is interested in errors anymore either
+            self._cleanup()
+        elif error is not None:
+            self._fail(stage, str(error))
+        else:
+            then(result)
+        return False
+
+    def _end_stage(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = now - self._stage_start
+        self._stage_start = now
+        trace.end('open: ' + stage, self._stage_token, book=self.name())
+        self._stage_token = trace.begin()
+
+    def _fail(self, stage, message):
+        self._end_stage(stage)
+        self._cleanup()
+        self.emit('failed', stage, message)
+
+    def _cleanup(self):
+        if self.mount is not None:
+            archive_close(self.mount)
+            self.mount = None
+        if isinstance(self._storage, ZipStorage):
+            self._storage.close()
+            self._storage = LOCAL
+
+    # mount
+
+    def _probe(self):
+        """ Returns 'directory', 'zip' or 'archive' for the opened file """
+        file_type = self.file.query_file_type(Gio.FileQueryInfoFlags.NONE,
+                                              None)
+        if file_type == Gio.FileType.DIRECTORY:
+            return 'directory'
+        path = self.file.get_path()
+        if path and zipfile.is_zipfile(path):
+            return 'zip'
+        return 'archive'
+
+    def _on_probed(self, kind):
+        if kind == 'archive':
+            archive_open_async(self.file.get_path(), self._on_mounted)
+            return
+        self._end_stage('mount')
+        if kind == 'zip':
+            self._run('locate', self._locate_zip, self._on_located)
+        else:
+            self._run('locate', lambda: self._locate(self.file),
+                      self._on_located)
+
+    def _on_mounted(self, zf, error):
+        if error is not None:
+            self._fail('mount', 'Failed to open archive: %s' % error.message)
+            return
+        self.mount = zf
+        if self._cancelled:
+            self._cleanup()
+            return
+        self._end_stage('mount')
+        self._run('locate', lambda: self._locate(zf), self._on_located)
+
+    # locate
+
+    def _locate(self, directory):
+        for info in directory.enumerate_children(
+                Gio.FILE_ATTRIBUTE_STANDARD_NAME,
+                Gio.FileQueryInfoFlags.NONE, None):
+            name = info.get_name()
+            if name.endswith('.opf'):
+                opf = directory.get_child(name)
+                if opf.get_path():
+                    return opf.get_path()
+        raise FileNotFoundError(
+            'Cannot find OPF in "%s".  If this is a remote file or an '
+            'archive, make sure you have gvfs-fuse properly set up' %
+            directory.get_uri())
+
+    def _locate_zip(self):
+        storage = ZipStorage(self.file.get_path())
+        opfs = [m for m in storage.members() if m.endswith('.opf')]
+        if not opfs:
+            storage.close()
+            raise FileNotFoundError('Cannot find OPF in "%s"' %
+                                    self.file.get_uri())
+        self._storage = storage
+        # the shallowest one is the most likely to be the book's
+        return min(opfs, key=lambda m: m.count(os.sep))
+
+    def _on_located(self, opf):
+        self._end_stage('locate')
+        self._run('parse',
+                  lambda: Book.open_progressively(opf, cache=self._cache,
+                                                  storage=self._storage),
+                  self._on_parsed)
+
+    # parse and populate
+
+    def _on_parsed(self, book):
+        self._end_stage('parse')
+        self.emit('ready', book)
+        self._end_stage('populate')
@@ -16,30 +16,45 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import datetime
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gst', '1.0')
-gi.require_version('GstPbutils', '1.0')
 from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Gst
-from gi.repository import GstPbutils
+
+from daisy import trace
+from daisy.storage import LOCAL
+
+from .discoverer import DurationService
+from .engine import PlaybackEngine
+from .membersrc import uri_path
+from .resources import ui_template
 
 # ~ from daisy.audioclip import AudioClip
 
 
-@Gtk.Template.from_file('player.ui')
+@ui_template('player.ui')
 class Player(Gtk.Box):
     __gtype_name__ = 'GdrPlayer'
+    __gsignals__ = {
+        # local path of the playing file and position in seconds
+        'position-changed': (GObject.SignalFlags.RUN_FIRST, None,
+                             (str, float)),
+        # the playback engine got created, so GStreamer is initialized
+        'engine-ready': (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+
+    # minimum interval between UI refreshes, in microseconds of frame time
+    REFRESH_INTERVAL = 100000
 
     _slider = Gtk.Template.Child('range')
     _playpause = Gtk.Template.Child('playpause')
 
     @GObject.Property(type=str)
     def uri(self):
-        return self._playbin.get_property('uri')
+        return self._engine.uri if self._engine else None
 
     def _set_duration(self, duration):
         self._duration = duration
@@ -47,64 +62,92 @@ class Player(Gtk.Box):
             seconds = self._duration / Gst.SECOND
         else:
             seconds = 0
-        print("updating playback duration to %ss" %
-              datetime.timedelta(seconds=seconds))
-        self._slider.set_range(0, seconds)
+        trace.event('duration', uri=self.uri, seconds=seconds)
+        if self._range_end != self._range_end:  # NaN: up to the file end
+            self._slider.set_range(self._range_begin, seconds)
 
     @uri.setter
     def uri(self, uri):
-        if uri == self.uri:
-            return
+        self._ensure_engine()
+        self._engine.set_queue(None)
+        self._engine.uri = uri
 
-        self._playbin.set_state(Gst.State.NULL)
+    def _on_engine_uri_changed(self, engine, pspec):
+        uri = engine.uri
         self._duration = Gst.CLOCK_TIME_NONE
-        self._playbin.set_property('uri', uri)
-        self._playbin.set_state(Gst.State.PAUSED)
-
-        if self._duration == Gst.CLOCK_TIME_NONE:
-            discoverer = GstPbutils.Discoverer()
-            info = discoverer.discover_uri(uri)
-            if info:
-                self._set_duration(info.get_duration())
-            else:
-                print("Failed to discover media info")
+        self._path = uri_path(uri) if uri else None
+        if uri:
+            self._durations.discover_uri_async(uri)
+        self.notify('uri')
+
+    def _on_duration_discovered(self, service, uri, duration):
+        if uri == self.uri and self._duration == Gst.CLOCK_TIME_NONE and \
+                duration != Gst.CLOCK_TIME_NONE:
+            self._set_duration(duration)
+
+    def _on_engine_run_changed(self, engine, begin, end):
+        self._range_begin = begin
+        self._range_end = end
+        if end != end:
+            end = 0
+            if self._duration != Gst.CLOCK_TIME_NONE:
+                end = self._duration / Gst.SECOND
+        self._slider.set_range(begin, max(begin, end))
 
     def set_clip(self, clip, basedir=None):
+        """ Plays the single clip @clip, and pauses at its end """
         path = os.path.abspath(os.path.join(basedir, clip.src))
-
-        self.uri = "file://" + GLib.uri_escape_string(path, '/', True)
-        self._slider.set_range(clip.begin, clip.end)
-        print("playing %s from %s to %s" % (path, clip.begin, clip.end))
-        self._playbin.seek_simple(Gst.Format.TIME,
-                                  Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
-                                  clip.begin * Gst.SECOND)
+        trace.event('set clip', path=path, begin=clip.begin, end=clip.end)
+        self._ensure_engine()
+        self._engine.play_single(path, clip.begin, clip.end)
+
+    def set_storage(self, storage):
+        """ Sets the daisy.storage storage audio files are read from """
+        self._storage = storage
+        if self._engine is not None:
+            self._engine.storage = storage
+
+    def set_queue(self, queue):
+        """ Sets the PlayQueue to use with play_clip() """
+        self._queue = queue
+        if self._engine is not None:
+            self._engine.set_queue(queue)
+
+    def play_clip(self, index):
+        """ Plays the queue from its clip @index onwards """
+        self._ensure_engine()
+        self._engine.play_clip(index)
+
+    def _position(self):
+        if self._engine is None:
+            return None
+        available, pos = self._playbin.query_position(Gst.Format.TIME)
+        return pos / Gst.SECOND if available else None
 
     @Gtk.Template.Callback()
     def _on_prev(self, widget):
-        print("prev")
-        pass
+        position = self._position()
+        if position is not None:
+            self._engine.skip(position, -1)
 
     @Gtk.Template.Callback()
     def _on_next(self, widget):
-        print("next")
-        pass
+        position = self._position()
+        if position is not None:
+            self._engine.skip(position, +1)
 
     @Gtk.Template.Callback()
     def _on_playpause(self, widget):
-        print("playpause !")
         state = Gst.State.PLAYING if widget.get_active() else Gst.State.PAUSED
+        trace.event('play/pause', state=state.value_nick)
+        self._ensure_engine()
         if not self._playbin.set_state(state):
-            print("Failed to set state")
+            trace.warning('Failed to set state to %s' % state.value_nick)
 
     @Gtk.Template.Callback()
     def _on_seek(self, slider):
-        # ~ ret, state, pending = self._playbin.get_state(Gst.CLOCK_TIME_NONE)
-        # ~ if state not in (Gst.State.PLAYING, Gst.State.PAUSED):
-            # ~ self._playbin.set_state(Gst.State.PAUSED)  # so we can start where we seeked
-
-        self._playbin.seek_simple(Gst.Format.TIME,
-                                  Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
-                                  slider.get_value() * Gst.SECOND)
+        if self._engine is not None:
+            self._engine.seek(slider.get_value())
 
     def _refresh_ui(self):
         if Gst.CLOCK_TIME_NONE == self._duration:
@@ -118,26 +161,24 @@ class Player(Gtk.Box):
             self._slider.set_value(pos / Gst.SECOND)
             self._slider.handler_unblock_by_func(self._on_seek)
 
-            # meh, how am I supposed to do that?
-            if pos >= self._slider.get_adjustment().get_upper() * Gst.SECOND:
-                print("pausing because current pos %s is >= to end at %s" %
-                      (pos / Gst.SECOND, self._slider.get_adjustment().get_upper()))
-                self.pause()
+            if self._path:
+                self.emit('position-changed', self._path, pos / Gst.SECOND)
 
-        return True
+    def _on_tick(self, widget, frame_clock):
+        # the frame clock only runs while the widget is visible
+        time = frame_clock.get_frame_time()
+        if time - self._last_refresh >= self.REFRESH_INTERVAL:
+            self._last_refresh = time
+            self._refresh_ui()
+        return GLib.SOURCE_CONTINUE
 
     def _on_error(self, bus, msg):
         err, debug = msg.parse_error()
-        print("GST ERROR: %s" % (err))
-        print("debug: %s" % (debug))
+        trace.warning('GStreamer error: %s' % err.message, debug=debug)
 
         # stop playback
         self._playbin.set_state(Gst.State.READY)
 
-    def _on_stream_end(self, bus, msg):
-        print("stream end")
-        self._playbin.set_state(Gst.State.PAUSED)
-
     def _on_state_changed(self, bus, msg):
         if msg.src != self._playbin:
             # ~ print("state changed on %s" % msg.src)
@@ -145,7 +186,8 @@ class Player(Gtk.Box):
 
         # ~ print("state changed")
         old, new, pending = msg.parse_state_changed()
-        # ~ print("states: old=%s new=%s pending=%s" % (old, new, pending))
+        trace.event('state changed', old=old.value_nick, new=new.value_nick,
+                    pending=pending.value_nick)
         self._refresh_ui()
 
         self._playpause.handler_block_by_func(self._on_playpause)
@@ -156,41 +198,79 @@ class Player(Gtk.Box):
             self._playpause.set_active(True)
         self._playpause.handler_unblock_by_func(self._on_playpause)
 
-        if self._refresh_id == 0 and new == Gst.State.PLAYING:
-            self._refresh_id = GLib.timeout_add_seconds(1, self._refresh_ui)
-            delta = (self._slider.get_adjustment().get_upper() - self._slider.get_adjustment().get_value()) * 1000 + 5
-            self._refresh_id2 = GLib.timeout_add(delta, self._refresh_ui)
-        elif self._refresh_id != 0 and Gst.State.PLAYING not in (new, pending):
-            GLib.source_remove(self._refresh_id)
-            GLib.source_remove(self._refresh_id2)
-            self._refresh_id = 0
+        if self._tick_id == 0 and new == Gst.State.PLAYING:
+            self._tick_id = self.add_tick_callback(self._on_tick)
+        elif self._tick_id != 0 and Gst.State.PLAYING not in (new, pending):
+            self.remove_tick_callback(self._tick_id)
+            self._tick_id = 0
 
     def __init__(self, **props):
-        self._refresh_id = 0
+        self._tick_id = 0
+        self._last_refresh = 0
         self._duration = Gst.CLOCK_TIME_NONE
+        self._path = None
+        self._range_begin = 0
+        self._range_end = float('nan')
+
+        self._durations = DurationService.get_default()
+        self._durations_handler = self._durations.connect(
+            'discovered', self._on_duration_discovered)
+
+        # created on first use, so that GStreamer is only initialized when
+        # something gets played
+        self._engine = None
+        self._playbin = None
+        # applied to the engine once created
+        self._storage = LOCAL
+        self._queue = None
+
+        super(Gtk.Box, self).__init__(**props)
 
-        self._playbin = Gst.ElementFactory.make("playbin", "playbin")
+    def has_engine(self):
+        """ Returns whether the playback engine, and thus GStreamer, is
+            initialized """
+        return self._engine is not None
+
+    def _ensure_engine(self):
+        if self._engine is not None:
+            return
+        self._engine = PlaybackEngine()
+        self._engine.connect('notify::uri', self._on_engine_uri_changed)
+        self._engine.connect('run-changed', self._on_engine_run_changed)
+        self._playbin = self._engine.playbin
 
         # ~ self._playbin.flags |= (1 << 3)
         # ~ self._playbin.set_property('vis-plugin', 'wavescope')
 
         bus = self._playbin.get_bus()
-        bus.add_signal_watch()
         bus.connect("message::error", self._on_error)
-        bus.connect("message::eos", self._on_stream_end)
         bus.connect("message::state-changed", self._on_state_changed)
 
-        super(Gtk.Box, self).__init__(**props)
+        self._engine.storage = self._storage
+        self._engine.set_queue(self._queue)
+        self.emit('engine-ready')
 
-    def __del__(self):
-        if self._refresh_id != 0:
-            GLib.source_remove(self._refresh_id)
+    def do_destroy(self):
+        if self._tick_id != 0:
+            self.remove_tick_callback(self._tick_id)
+            self._tick_id = 0
+        if self._durations_handler:
+            self._durations.disconnect(self._durations_handler)
+            self._durations_handler = 0
+        Gtk.Box.do_destroy(self)
 
     def play(self):
+        self._ensure_engine()
         self._playbin.set_state(Gst.State.PLAYING)
 
     def pause(self):
-        self._playbin.set_state(Gst.State.PAUSED)
+        if self._playbin is not None:
+            self._playbin.set_state(Gst.State.PAUSED)
+
+    def stop(self):
+        """ Stops playback and releases the played file """
+        if self._playbin is not None:
+            self._playbin.set_state(Gst.State.NULL)
 
 
 if __name__ == '__main__':
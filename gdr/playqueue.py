@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Continuous playback order of a timeline.
+
+    Consecutive clips of a timeline usually follow each other in the same
+    audio file.  Such clips are grouped in runs, that can be played as a
+    single stretch of audio: only moving from a run to the next one requires
+    a seek or a file change.
+
+    Clips appended to the timeline later on are taken into account by
+    extend(). """
+
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+
+__all__ = ['Run', 'PlayQueue']
+
+
+Run = namedtuple('Run', ('index', 'src', 'begin', 'end', 'first', 'last'))
+
+
+class PlayQueue:
+    # clips less than this apart are considered contiguous
+    EPSILON = 0.010
+
+    def __init__(self, timeline):
+        self.timeline = timeline
+        self._firsts = array('I')
+        # amount of timeline clips in the queue
+        self._count = 0
+        self.extend()
+
+    def extend(self):
+        """ Adds the clips appended to the timeline since the last call.
+            They start a new run, so that the existing runs don't change. """
+        clips = self.timeline.clips
+        src_ids = clips.src_ids
+        begins = clips.begins
+        ends = clips.ends
+
+        start = self._count
+        for i in range(start, len(clips)):
+            # NaN ends never compare close to anything
+            if i == start or src_ids[i] != src_ids[i - 1] or \
+                    not abs(begins[i] - ends[i - 1]) <= self.EPSILON:
+                self._firsts.append(i)
+        self._count = len(clips)
+
+    def __len__(self):
+        return len(self._firsts)
+
+    def run(self, index):
+        """ Returns the Run @index """
+        clips = self.timeline.clips
+        first = self._firsts[index]
+        if index + 1 < len(self._firsts):
+            last = self._firsts[index + 1] - 1
+        else:
+            last = self._count - 1
+        return Run(index, clips.srcs[clips.src_ids[first]],
+                   clips.begins[first], clips.ends[last], first, last)
+
+    def run_of(self, clip):
+        """ Returns the index of the run containing the clip @clip """
+        return bisect_right(self._firsts, clip) - 1
+
+    def clip_at(self, run, position):
+        """ Returns the index of the clip of @run playing at @position """
+        begins = self.timeline.clips.begins
+        i = bisect_right(begins, position, run.first, run.last + 1) - 1
+        return max(i, run.first)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Colomban Wendling <ban@herbesfolles.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" UI files, from the compiled GResource bundle if available.
+
+    `make` compiles the UI files listed in gdr.gresource.xml into
+    gdr.gresource, which is a single mapped file whose content needs no
+    further lookup or reading.  Without it, or for UI files modified since
+    it was compiled, the UI files are read from the source directory. """
+
+import os
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import GLib
+from gi.repository import Gio
+from gi.repository import Gtk
+
+
+__all__ = ['ui_template']
+
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESOURCE_FILE = os.path.join(SOURCE_DIR, 'gdr.gresource')
+RESOURCE_PREFIX = '/org/gdr/Gdr/'
+
+
+def _register():
+    """ Registers the resource bundle, and returns its modification time,
+        or None if it could not be registered """
+    try:
+        mtime = os.stat(RESOURCE_FILE).st_mtime_ns
+        Gio.resources_register(Gio.Resource.load(RESOURCE_FILE))
+    except (OSError, GLib.Error):
+        return None
+    return mtime
+
+
+_registered_mtime = _register()
+
+
+def _is_stale(path):
+    """ Whether the UI file @path changed since the bundle was compiled """
+    try:
+        return os.stat(path).st_mtime_ns > _registered_mtime
+    except OSError:
+        return False
+
+
+def ui_template(name):
+    """ Returns a Gtk.Template decorator for the UI file @name """
+    path = os.path.join(SOURCE_DIR, name)
+    if _registered_mtime is not None and not _is_stale(path):
+        return Gtk.Template.from_resource(RESOURCE_PREFIX + name)
+    return Gtk.Template.from_file(path)
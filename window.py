@@ -17,168 +17,394 @@
 
 import gi
 import sys
+from concurrent.futures import ThreadPoolExecutor
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gst', '1.0')
-from gi.repository import GObject
-from gi.repository import GLib
 from gi.repository import Gio
 from gi.repository import Gtk
 from gi.repository import Gst
-Gst.init(sys.argv)
 
 from gdr.combostackswitcher import ComboStackSwitcher
 from gdr.player import Player
-
-from gdr.archive import archive_open, archive_close
-
-from daisy import package
-from daisy import navigationcontrol
-
-
-
-class PyObjectContainer(GObject.Object):
-    def __init__(self, pyobj):
-        self.obj = pyobj
-        super().__init__()
-
-
-@Gtk.Template.from_file('window.ui')
+from gdr.discoverer import DurationService
+from gdr.engine import PlaybackEngine
+from gdr.loader import BookLoader
+from gdr.membersrc import forget_storage, path_uri
+from gdr.navtree import NavTree
+from gdr.playqueue import PlayQueue
+from gdr.resources import ui_template
+
+from gdr.archive import archive_close
+from gdr.opener import BookOpener
+
+from daisy import trace
+from daisy.cache import BookCache
+from daisy.navigationcontrol import NavList
+from daisy.position import PositionTracker
+from daisy.search import IndexBuilder
+from daisy.storage import ZipStorage
+
+
+@ui_template('window.ui')
 class Window(Gtk.ApplicationWindow):
     __gtype_name__ = 'GdrWindow'
 
     _toc_store = Gtk.Template.Child('toc-store')
+    _toc_view = Gtk.Template.Child('toc-view')
     _nav_store = Gtk.Template.Child('nav-store')
+    _nav_view = Gtk.Template.Child('nav-view')
     _player = Gtk.Template.Child('player')
+    _goto_entry = Gtk.Template.Child('goto-entry')
 
     def __init__(self, **props):
+        self._book = None
         self._package = None
+        self._loading = False
+        self._timeline = None
+        self._queue = None
+        self._tracker = None
+        self._loader = None
+        self._cache = None
+        self._search = None
+        self._audio_uris = {}
+        # cancelled loaders and index builders, possibly still running
+        self._stopped = []
 
         super().__init__(**props)
 
+        self._toc = NavTree(self._toc_view, self._toc_store)
+        self._nav = NavTree(self._nav_view, self._nav_store)
+
+        # typeahead of the "go to" entry, filled from the nav lists index
+        self._goto_store = Gtk.ListStore(str)
+        completion = Gtk.EntryCompletion(model=self._goto_store,
+                                         text_column=0)
+        # the store only holds matches already
+        completion.set_match_func(lambda *args: True)
+        self._goto_entry.set_completion(completion)
+
+        self._durations = DurationService.get_default()
+        self._durations_handler = self._durations.connect(
+            'all-discovered', self._on_all_durations_discovered)
+        # probing initializes GStreamer, so it waits for the first playback
+        self._player.connect('engine-ready',
+                             lambda p: self._discover_durations())
+
+    def do_destroy(self):
+        self._stop_workers()
+        if self._durations_handler:
+            self._durations.disconnect(self._durations_handler)
+            self._durations_handler = 0
+        Gtk.ApplicationWindow.do_destroy(self)
+
+    def _stop_workers(self):
+        """ Cancels the loader and the index builder of the book """
+        for worker in (self._loader, self._search):
+            if worker:
+                worker.cancel()
+                self._stopped.append(worker)
+        self._loader = None
+        self._search = None
+
+    def join_workers(self):
+        """ Waits for the cancelled background work on the books to be done.
+            This is blocking. """
+        while self._stopped:
+            self._stopped.pop().join()
+
+    def _discover_durations(self):
+        """ Probes the audio files of the book in the background, once
+            the player is ready to play """
+        if self._audio_uris and self._player.has_engine():
+            self._durations.discover_all(self._audio_uris)
+
+    def _on_all_durations_discovered(self, service):
+        if not self._audio_uris:
+            return
+
+        durations = {}
+        for uri, src in self._audio_uris.items():
+            duration = service.lookup(uri)
+            if duration is None or duration == Gst.CLOCK_TIME_NONE:
+                return
+            durations[src] = duration / Gst.SECOND
+        self._audio_uris = {}
+
+        if self._timeline.open_ended():
+            self._timeline.set_file_durations(durations)
+            # the tracker's clip index holds the former clip bounds
+            if self._book:
+                nc = self._book.navigation
+                self._tracker = PositionTracker(self._timeline,
+                                                nc.nav_map(), nc.nav_lists(),
+                                                self._clip_basedir)
+        trace.event('book duration', seconds=self._timeline.duration)
+
+    def chapter_durations(self):
+        """ Returns a list of (NavPoint, duration in seconds) for the top
+            level NavPoints, or None if there is no book.  Durations can be
+            None if a NavPoint doesn't point to any clip. """
+        if not self._book:
+            return None
+        points = self._book.navigation.nav_map()
+        starts = [self._timeline.resolve(p.content, self._clip_basedir)
+                  for p in points]
+        durations = []
+        for i, (point, start) in enumerate(zip(points, starts)):
+            duration = None
+            if start is not None:
+                end = next((s for s in starts[i + 1:] if s is not None), None)
+                duration = self._timeline.span(start, end)
+            durations.append((point, duration))
+        return durations
+
     @Gtk.Template.Callback()
     def _on_toc_row_activated(self, view, path, column):
-        print("TOC row %s activated" % (path))
-
         view.expand_row(path, False)
-        model = view.get_model()
-        it = model.get_iter(path)
-        wrapper = model.get(it, 1)[0]
-        if wrapper:
-            nav_point = wrapper.obj
-            print(nav_point)
-            audio = next((l.audio for l in nav_point.labels), None)
-            if audio:
-                self._player.set_clip(audio, basedir=self._clip_basedir)
-                self._player.play()
+        nav_point = self._toc.item_at(path)
+        trace.event('toc row activated', path=str(path), item=nav_point)
+        if nav_point:
+            self._play_nav(nav_point)
 
     @Gtk.Template.Callback()
     def _on_nav_row_activated(self, view, path, column):
-        print("Navigation row %s activated")
-
         view.expand_row(path, False)
-        model = view.get_model()
-        it = model.get_iter(path)
-        wrapper = model.get(it, 1)[0]
-        print(wrapper)
-        if not wrapper:
+        target = self._nav.item_at(path)
+        trace.event('nav row activated', path=str(path), item=target)
+        if not target or isinstance(target, NavList):
             return
 
-        target = wrapper.obj
-        print(target)
-        audio = next((l.audio for l in target.labels), None)
-        if audio:
-            self._player.set_clip(audio, basedir=self._clip_basedir)
-            self._player.play()
+        self._play_nav(target)
 
+    def _play_nav(self, nav):
+        """ Plays the book from the content of a NavPoint or NavTarget, or
+            its label if the content cannot be found """
+        index = None
+        if self._timeline:
+            index = self._timeline.resolve(nav.content, self._clip_basedir)
+        if index is not None:
+            self._player.play_clip(index)
+        else:
+            clip = next((l.audio for l in nav.labels if l.audio), None)
+            if not clip:
+                return
+            self._player.set_clip(clip, basedir=self._clip_basedir)
+        self._player.play()
 
-    def _add_nav_points(self, points, parent=None):
-        for point in points:
-            it = self._toc_store.append(parent, (point.labels[0].text,
-                                                 PyObjectContainer(point)))
-            self._add_nav_points((p for p in point), it)
+    @Gtk.Template.Callback()
+    def _on_goto_changed(self, entry):
+        self._goto_store.clear()
+        text = entry.get_text()
+        if not self._book or not text.strip():
+            return
+        for target in self._book.navigation.search_targets(text):
+            if target.labels:
+                self._goto_store.insert_with_valuesv(-1, (0,),
+                                                     (target.labels[0].text,))
 
-    def set_package(self, opf_package):
-        self._package = opf_package
+    @Gtk.Template.Callback()
+    def _on_goto_activate(self, entry):
+        if not self._book:
+            return
+        text = entry.get_text()
+        target = self._book.navigation.find_target(text)
+        if target is not None:
+            self._play_nav(target)
+            self._select_item(self._nav, target)
+        elif not self._play_search(text):
+            entry.error_bell()
+
+    def _play_search(self, text):
+        """ Plays the book from the first full-text search hit for @text.
+            Returns whether there was one. """
+        if not self._search:
+            return False
+        index = self._search.index
+        for hit in index.search(text, limit=10):
+            clip = index.resolve(hit, self._timeline)
+            if clip is not None:
+                self._player.play_clip(clip)
+                self._player.play()
+                return True
+        return False
 
-        self._toc_store.clear()
-        self._nav_store.clear()
+    @Gtk.Template.Callback()
+    def _on_player_position_changed(self, player, path, position):
+        if not self._tracker or not self._tracker.locate(path, position):
+            return
 
-        if self._package:
-            nc = navigationcontrol.NavigationControl(self._package.manifest())
-            self._clip_basedir = nc.basedir()
+        point = self._tracker.nav_point
+        if point is not None:
+            self._select_item(self._toc, point)
+        for target in self._tracker.targets:
+            if target is not None:
+                self._select_item(self._nav, target)
 
-            self.set_title(nc.title())
-            self._add_nav_points(nc.nav_map())
+    def _select_item(self, tree, item):
+        path = tree.path_of(item)
+        if path is None:
+            return
+        view = tree.view
+        selection = view.get_selection()
+        if selection.path_is_selected(path):
+            return
+        view.expand_to_path(path)
+        selection.select_path(path)
+        view.scroll_to_cell(path, None, False, 0, 0)
+
+    def set_loading(self, name):
+        """ Shows that the book @name is being opened, or that it is not
+            anymore if None """
+        self._loading = name is not None
+        if self._loading:
+            self.set_title('%s (loading…)' % name)
+        elif not self._book:
+            self.set_title('GDR')
+
+    def set_book(self, book, cache=None):
+        """ Shows @book, as it gets loaded if it is not complete yet.  The
+            book and its search index are loaded from or stored in the
+            BookCache @cache. """
+        self._book = None
+        self._package = book.package if book else None
+        self._cache = cache
+
+        self._toc.clear()
+        self._nav.clear()
+        self._goto_store.clear()
+        self._timeline = None
+        self._queue = None
+        self._tracker = None
+        self._audio_uris = {}
+        self._stop_workers()
+
+        if not book:
+            self.set_loading(None)
+            return
 
-            for nav_list in nc.nav_lists():
-                it = self._nav_store.append(None, (nav_list.labels[0].text,
-                                                   None))
-                for target in nav_list:
-                    self._nav_store.append(it, (target.labels[0].text,
-                                                PyObjectContainer(target)))
+        # the timeline and the trees fill up while the loader runs, and the
+        # rest waits for the whole book
+        self._timeline = book.timeline
+        self._queue = PlayQueue(self._timeline)
+        self._player.set_storage(book.storage())
+        self._player.set_queue(self._queue)
+        self._clip_basedir = book.navigation.basedir()
+
+        self._loader = BookLoader(book, cache)
+        self._loader.connect('nav-items', self._on_loader_nav_items)
+        self._loader.connect('clips-added', self._on_loader_clips_added)
+        self._loader.connect('finished', self._on_loader_finished)
+        self._loader.connect('failed', self._on_loader_failed)
+        self._loader.start()
+
+    def _on_loader_nav_items(self, loader, points, lists):
+        with trace.span('tree population'):
+            self._toc.append_roots(points)
+            self._nav.append_roots(lists)
+
+    def _on_loader_clips_added(self, loader):
+        self._queue.extend()
+
+    def _on_loader_failed(self, loader, message):
+        trace.warning('Cannot load "%s": %s' %
+                      (loader.book.package.path(), message))
+        self._loader = None
+        # back to an empty window, that can be reused for another book
+        self.set_book(None)
+
+    def _on_loader_finished(self, loader):
+        book = loader.book
+        self._loader = None
+        self._book = book
+        self.set_loading(None)
+
+        nc = book.navigation
+        self.set_title(nc.title())
+        # in case the play order differs from the document order
+        self._toc.update_roots(nc.nav_map())
+        self._nav.update_roots(nc.nav_lists())
+
+        storage = book.storage()
+        self._audio_uris = {path_uri(src, storage): src
+                            for src in self._timeline.clips.srcs}
+        self._discover_durations()
+
+        self._tracker = PositionTracker(self._timeline, nc.nav_map(),
+                                        nc.nav_lists(), self._clip_basedir)
+
+        # searchable as soon as documents are indexed
+        self._search = IndexBuilder(book, self._cache)
+        self._search.start()
 
 
 class Application(Gtk.Application):
     def __init__(self):
         super().__init__(application_id='org.gdr.Gdr',
                          flags=Gio.ApplicationFlags.HANDLES_OPEN)
+        self._cache = BookCache()
+        # runs the blocking stages of book openings
+        self._executor = ThreadPoolExecutor(max_workers=4)
 
     def do_activate(self):
-        for win in self.get_windows():
-            if not win._package:
-                break
-        else:
-            win = Window(application=self)
+        win = self._window_for_book()
         win.present()
 
+    def _window_for_book(self):
+        for win in self.get_windows():
+            if not win._package and not win._loading:
+                return win
+        return Window(application=self)
+
     def do_open(self, files, n_files, hint=None):
         for f in files:
-            is_archive = False
-            file_type = f.query_file_type(Gio.FileQueryInfoFlags.NONE, None)
-            if file_type != Gio.FileType.DIRECTORY:
-                try:
-                    f = archive_open(f.get_path())
-                except GLib.Error as ex:
-                    print('Failed top open archive: %s' % ex.message)
-                    continue
-                is_archive = True
-                file_type = f.query_file_type(Gio.FileQueryInfoFlags.NONE, None)
-            if file_type != Gio.FileType.DIRECTORY:
-                print('Invalid input file %s: not a directory nor a valid '
-                      'archive file' % f.get_uri())
-                if is_archive:
-                    archive_close(f)
-                continue
-
-            # Look for the OPF
-            for info in f.enumerate_children(Gio.FILE_ATTRIBUTE_STANDARD_NAME,
-                                             Gio.FileQueryInfoFlags.NONE,
-                                             None):
-                name = info.get_name()
-                if name.endswith('.opf'):
-                    opf = f.get_child(name)
-                    if opf.get_path():
-                        break
-            else:
-                print('Cannot find OPF in "%s".  If this is a '
-                      'remote file or an archive, make sure you have '
-                      'gvfs-fuse properly set up' % f.get_uri())
-                if is_archive:
-                    archive_close(f)
-                continue
-
-            pkg = package.Package(opf.get_path())
-
-            for win in self.get_windows():
-                if not win._package:
-                    break
-            else:
-                win = Window(application=self)
-
-            win.connect('destroy', lambda w: archive_close(f))
-            win.set_package(pkg)
+            win = self._window_for_book()
+            win.set_loading(f.get_basename())
             win.present()
 
+            opener = BookOpener(f, self._executor, cache=self._cache)
+            # stop opening if the window is closed in the meantime
+            destroy_id = win.connect('destroy',
+                                     lambda w, opener=opener: opener.cancel())
+            opener.connect('ready', self._on_book_ready, win, destroy_id)
+            opener.connect('failed', self._on_book_failed, win, destroy_id)
+            opener.start()
+
+    def _on_book_ready(self, opener, book, win, destroy_id):
+        win.disconnect(destroy_id)
+        if opener.mount is not None:
+            mount = opener.mount
+            win.connect('destroy', lambda w: archive_close(mount))
+        storage = book.storage()
+        if isinstance(storage, ZipStorage):
+            # after the window cancelled its loaders
+            win.connect_after('destroy', self._on_zip_book_destroy, storage)
+        win.set_book(book, cache=self._cache)
+
+    def _on_zip_book_destroy(self, win, storage):
+        # nothing may read from the archive anymore
+        win._player.stop()
+        forget_storage(storage)
+
+        def close():
+            # cancelled threads only stop at their next check
+            win.join_workers()
+            storage.close()
+
+        self._executor.submit(close)
+
+    def _on_book_failed(self, opener, stage, message, win, destroy_id):
+        win.disconnect(destroy_id)
+        trace.warning('Cannot open "%s" (%s): %s' %
+                      (opener.file.get_uri(), stage, message))
+        win.set_loading(None)
+
+    def do_shutdown(self):
+        self._executor.shutdown(wait=False)
+        if trace.enabled():
+            # along with the trace summary
+            PlaybackEngine.first_audio.dump(sys.stderr)
+        Gtk.Application.do_shutdown(self)
+
 
 if __name__ == '__main__':
     app = Application()